@@ -1,8 +1,11 @@
 import os
 import sys
+import threading
+import time
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, ttk
 from core import load_config, save_config, process_pipeline
+from image_processing import CANCELLED, use_worker_processes
 from watermark_gui import create_watermark_section
 from social_media_gui import create_social_media_section
 
@@ -15,9 +18,20 @@ def resource_path(relative_path):
         base_path = os.path.abspath(".")  # Fallback to current directory
     return os.path.join(base_path, relative_path)
 
+def format_duration(seconds):
+    """Format a number of seconds as H:MM:SS or M:SS."""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
 def create_gui():
     """Create the GUI for the program."""
     print("Initializing GUI...")
+    # Batches run on a background thread while Tk runs; forking worker processes from here
+    # would copy Tk's state and any lock held by the other thread, so the workers are threads
+    use_worker_processes(False)
     root = tk.Tk()
     root.title("Image Sweetener")
 
@@ -53,7 +67,13 @@ def create_gui():
             target_dir_entry.xview_moveto(1)
             target_dir_entry.icursor(tk.END)
 
-    tk.Button(root, text="Browse", command=browse_target_directory).grid(row=0, column=2, padx=10, pady=10)
+    target_buttons = tk.Frame(root)
+    target_buttons.grid(row=0, column=2, padx=10, pady=10)
+    tk.Button(target_buttons, text="Browse", command=browse_target_directory).pack(side=tk.LEFT)
+
+    # Process the images in subfolders too, mirroring them in the output folders
+    recursive_var = tk.BooleanVar(value=config.get("recursive", False))
+    tk.Checkbutton(target_buttons, text="Subfolders", variable=recursive_var).pack(side=tk.LEFT, padx=(5, 0))
 
     # Watermark Section
     watermark_options = {}
@@ -63,17 +83,39 @@ def create_gui():
     social_media_options = {}
     create_social_media_section(root, config, watermark_row + 1, social_media_options)
 
-    # Process Button
+    # State of the current batch, shared with the background worker thread
+    batch = {"thread": None, "cancel_event": None, "target_dir": "", "completed": 0, "total": 0, "started": 0.0,
+             "errors": None, "exception": None, "close_when_done": False}
+
+    def report_progress(completed, total):
+        """Record progress; called from the worker thread, so the widgets are only updated by poll_progress."""
+        if completed == 0:
+            batch["started"] = time.perf_counter()  # A new pass over the directory
+        batch["completed"], batch["total"] = completed, total
+
+    def run_batch(target_dir, options, cancel_event):
+        """Run the pipeline on the worker thread."""
+        try:
+            batch["errors"] = process_pipeline(target_dir, options, progress=report_progress, cancel_event=cancel_event)
+        except Exception as e:
+            batch["exception"] = e
+
+    # Start / Cancel button
     def start_processing():
         """Start processing images based on user configuration."""
+        if batch["thread"] is not None:
+            return
+
         target_dir = target_dir_entry.get()
         if not os.path.isdir(target_dir):
             messagebox.showerror("Error", "Please select a valid target directory.")
             return
 
-        # Extract values from widgets into options dictionary
+        # Extract values from widgets into options dictionary, keeping settings that have no widget
         options = {
+            **config,
             "target_dir": target_dir,
+            "recursive": recursive_var.get(),
             "watermark_path": watermark_options["watermark_path"].get(),
             "corner_watermark_positions": [
                 pos for pos, var in watermark_options["corner_position_vars"].items() if var.get()
@@ -86,6 +128,7 @@ def create_gui():
             "center_watermark_rotation": watermark_options["center_watermark_rotation"].get(),
             "platforms": {k: v.get() for k, v in social_media_options["platform_vars"].items()},
             "instagram_aspect_ratio": social_media_options["instagram_aspect_ratio"].get(),
+            "encoder_profile": social_media_options["encoder_profile"].get(),
         }
 
         # Skip watermark processing if no watermark file is selected
@@ -97,16 +140,90 @@ def create_gui():
         # Save configuration
         save_config(options)
 
-        # Pass options to the processing pipeline
-        print("Options passed to process_pipeline:", options)
-        process_pipeline(target_dir, options)
+        # Pass options to the processing pipeline on a background thread, so the window stays responsive
+        cancel_event = threading.Event()
+        batch.update(cancel_event=cancel_event, target_dir=target_dir, completed=0, total=0, started=time.perf_counter(),
+                     errors=None, exception=None)
+        batch["thread"] = threading.Thread(
+            target=run_batch, args=(target_dir, options, cancel_event), name="image-sweetener-batch", daemon=True
+        )
+        batch["thread"].start()
+
+        process_button.config(text="Cancel", command=cancel_processing)
+        status_var.set("Starting...")
+        root.after(200, poll_progress)
+
+    def cancel_processing():
+        """Ask the worker to stop once the images being processed are finished."""
+        if batch["cancel_event"] is not None:
+            batch["cancel_event"].set()
+            process_button.config(state=tk.DISABLED)
+            status_var.set("Cancelling after the current images...")
+
+    def poll_progress():
+        """Update the progress bar and throughput readout until the batch ends."""
+        completed, total = batch["completed"], batch["total"]
+        progress_bar.config(maximum=max(total, 1), value=completed)
+
+        if batch["thread"].is_alive():
+            if not batch["cancel_event"].is_set():
+                elapsed = time.perf_counter() - batch["started"]
+                if completed and elapsed > 0:
+                    rate = completed / elapsed
+                    eta = format_duration((total - completed) / rate)
+                    status_var.set(f"{completed}/{total} images, {rate:.1f} images/s, ETA {eta}")
+                else:
+                    status_var.set(f"{completed}/{total} images")
+            root.after(200, poll_progress)
+            return
+
+        finish_processing()
+
+    def finish_processing():
+        """Report the outcome of the batch that just ended and re-enable the button."""
+        cancelled = batch["cancel_event"].is_set()
+        batch["thread"] = None
+        process_button.config(text="Process Images", command=start_processing, state=tk.NORMAL)
+
+        if batch["close_when_done"]:
+            close_window()
+            return
+
+        if batch["exception"] is not None:
+            status_var.set("Processing failed.")
+            messagebox.showerror("Error", f"Processing failed: {batch['exception']}")
+            return
 
-    tk.Button(
-        root, text="Process Images", command=start_processing, height=2, width=20
-    ).grid(row=watermark_row + 2, column=0, columnspan=3, pady=20)
+        failures = [error for error in batch["errors"] if error[1] != CANCELLED]
+        if cancelled:
+            status_var.set(f"Cancelled ({len(failures)} error(s)).")
+        elif failures:
+            status_var.set(f"Done with {len(failures)} error(s).")
+            listed = "\n".join(f"{os.path.relpath(path, batch['target_dir'])}: {message}" for path, message in failures[:10])
+            messagebox.showwarning("Processing finished", f"{len(failures)} image(s) could not be processed:\n{listed}")
+        else:
+            status_var.set("Done.")
+
+    process_button = tk.Button(root, text="Process Images", command=start_processing, height=2, width=20)
+    process_button.grid(row=watermark_row + 2, column=0, columnspan=3, pady=(20, 5))
+
+    # Progress bar and throughput readout
+    progress_bar = ttk.Progressbar(root, orient=tk.HORIZONTAL, mode="determinate", length=400)
+    progress_bar.grid(row=watermark_row + 3, column=0, columnspan=3, padx=10)
+    status_var = tk.StringVar(value="")
+    tk.Label(root, textvariable=status_var).grid(row=watermark_row + 4, column=0, columnspan=3, pady=(0, 10))
 
     def on_closing():
-        """Ensure CLI closes when GUI is closed."""
+        """Ensure CLI closes when GUI is closed, letting a running batch finish its current images first."""
+        if batch["thread"] is not None:
+            batch["close_when_done"] = True
+            cancel_processing()
+            status_var.set("Finishing the current images before closing...")
+            return
+        close_window()
+
+    def close_window():
+        """Close the window and end the program."""
         print("Exiting program...")
         root.quit()  # Stops the Tkinter main loop
         root.update()  # Ensures any pending events are processed
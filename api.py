@@ -0,0 +1,187 @@
+"""
+Library API: turn in-memory images into every platform's encoded output, without files.
+
+Sources can be encoded bytes, binary file-like objects, file paths or PIL images, and the
+results are the encoded bytes of each platform's output, so a service can process an upload
+without a temporary file. A JPEG given as bytes, a file or a path is decoded at reduced
+scale when every output is much smaller; a PIL image is decoded at full size (see
+process_image). The platform handlers, watermarking, resize cascade and pass-through of
+compliant JPEGs are those of core.process_pipeline, with every write kept in memory (see
+image_processing.capture_outputs).
+
+Options are the same as in config.json, merged over the defaults. Settings that hold for the
+whole process (memory budget, backend) are applied by configure.
+
+Example:
+    import api
+    outputs = api.process_image(upload, platforms=["instagram", "bluesky"])
+    outputs["instagram"]  # JPEG bytes
+"""
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from config import DEFAULT_CONFIG
+from core import (
+    configure_processing, decode_size, ordered_platform_handlers, run_platforms, watermark_source
+)
+from encoder_profiles import PLATFORMS
+from image_processing import capture_outputs, draft_for_downscale, open_image_data
+import instrumentation
+from watermarking import load_watermark
+
+# Name of a source in error messages, and the key its bytes are passed through under
+SOURCE_NAME = "<source>"
+
+
+def configure(options=None):
+    """
+    Apply the process-wide options (memory budget, link mode, backend, reducing gap).
+
+    Call it once before processing, e.g. at service startup; other options are taken per call.
+    """
+    configure_processing({**DEFAULT_CONFIG, **(options or {})})
+
+
+def _resolve_options(options, platforms):
+    """Merge options over the defaults, enabling exactly the given platforms when there are any."""
+    options = {**DEFAULT_CONFIG, **(options or {})}
+    if platforms is not None:
+        unknown = [platform for platform in platforms if platform not in PLATFORMS]
+        if unknown:
+            raise ValueError(f"Unknown platform(s): {', '.join(unknown)}. Choose from {', '.join(PLATFORMS)}.")
+        options["platforms"] = {platform: platform in platforms for platform in PLATFORMS}
+    if not any(options["platforms"].values()):
+        raise ValueError("No platforms are enabled.")
+    return options
+
+
+def _load_watermark(watermark, options):
+    """Return the watermark as an RGBA image, from the argument or the "watermark_path" option, or None."""
+    if watermark is None:
+        return load_watermark(options["watermark_path"]) if options["watermark_path"] else None
+    if isinstance(watermark, str):
+        return load_watermark(watermark)
+    if isinstance(watermark, Image.Image):
+        return watermark.convert("RGBA")
+    data = watermark.read() if hasattr(watermark, "read") else bytes(watermark)
+    with Image.open(io.BytesIO(data)) as original:
+        return original.convert("RGBA")
+
+
+def _read_source(source):
+    """Return the encoded bytes of a source given as a path, a binary file-like object or bytes."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as file:
+            return file.read()
+    if hasattr(source, "read"):
+        return source.read()
+    return bytes(source)
+
+
+def _render(source, options, platform_handlers, original_watermark):
+    """Run one source through the platform handlers and return {platform: encoded bytes}."""
+    if isinstance(source, Image.Image):
+        data = None
+        # A copy, so neither drafting, decoding nor watermarking in place touches the caller's
+        # image. Copying decodes it, so it can't be drafted to a reduced scale.
+        opened = source.copy()
+    else:
+        data = _read_source(source)
+        name = os.fspath(source) if isinstance(source, (str, os.PathLike)) else SOURCE_NAME
+        opened = open_image_data(data, name)
+
+    output_paths = [platform_handler.platform + platform_handler.extension for platform_handler in platform_handlers]
+    try:
+        with capture_outputs() as outputs:
+            # Unchanged pixels may be passed through as the source's own bytes
+            source_path = None
+            if data is not None and original_watermark is None:
+                outputs[SOURCE_NAME] = data
+                source_path = SOURCE_NAME
+
+            img = opened
+            max_sizes = [platform_handler.max_size for platform_handler in platform_handlers]
+            if draft_for_downscale(img, decode_size(img, max_sizes)) is not None:
+                source_path = None  # The pixels no longer match the source
+            with instrumentation.stage("decode"):
+                img.load()
+
+            if original_watermark is not None:
+                img = watermark_source(img, original_watermark, options)
+            run_platforms(img, platform_handlers, output_paths, source_path, options)
+    finally:
+        opened.close()
+
+    return {
+        platform_handler.platform: outputs[output_path]
+        for platform_handler, output_path in zip(platform_handlers, output_paths)
+    }
+
+
+def process_image(source, options=None, platforms=None, watermark=None):
+    """
+    Process one in-memory image for every enabled platform.
+
+    Args:
+        source: Encoded image as bytes (or another bytes-like object), a binary file-like
+            object, a file path, or a PIL image, which is not modified. A PIL image is
+            decoded at full size, as drafting it would change the caller's image; pass
+            the encoded bytes, file or path instead to let a large JPEG decode at 1/2,
+            1/4 or 1/8 scale.
+        options (dict): Configuration options, as in config.json, merged over the defaults.
+        platforms (iterable): Platforms to produce, e.g. ["instagram", "bluesky"]; defaults
+            to those enabled in options.
+        watermark: Watermark as a path, bytes, file-like object or PIL image; defaults to
+            the "watermark_path" option. Placed as configured by the watermark options.
+
+    Returns:
+        dict: Encoded output bytes keyed by platform, in the format of the platform's
+        encoder profile (see encoder_profiles). A source JPEG that already meets a
+        platform's limits may be returned unchanged.
+
+    Raises:
+        ValueError: If no platform is enabled or one is unknown.
+        OSError: If the source is not an image Pillow can read, or its file can't be read.
+    """
+    options = _resolve_options(options, platforms)
+    return _render(source, options, ordered_platform_handlers(options), _load_watermark(watermark, options))
+
+
+def process_images(sources, options=None, platforms=None, watermark=None, workers=1):
+    """
+    Process a batch of in-memory images for every enabled platform.
+
+    The watermark and platform setup is shared by the batch, and with several workers the
+    images are processed on threads, as Pillow releases the GIL while decoding, resizing
+    and encoding.
+
+    Args:
+        sources (iterable): Sources, as for process_image.
+        options, platforms, watermark: As for process_image.
+        workers (int): Images processed at once.
+
+    Returns:
+        tuple: (results, errors). results holds the outputs of every source, as returned by
+        process_image, in order, or None for sources that failed. errors holds
+        (index of the source, error message) for every failure.
+
+    Raises:
+        ValueError: If no platform is enabled or one is unknown.
+    """
+    options = _resolve_options(options, platforms)
+    platform_handlers = ordered_platform_handlers(options)
+    original_watermark = _load_watermark(watermark, options)
+
+    def render(source):
+        try:
+            return _render(source, options, platform_handlers, original_watermark), None
+        except Exception as e:
+            return None, f"{type(e).__name__}: {e}"
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        rendered = list(executor.map(render, sources))
+
+    results = [outputs for outputs, _ in rendered]
+    errors = [(index, error) for index, (_, error) in enumerate(rendered) if error is not None]
+    return results, errors
@@ -0,0 +1,604 @@
+"""
+Benchmark the watermarking, platform scaling and full pipeline stages on a synthetic corpus.
+
+The corpus is generated deterministically from a seed, so runs on different machines or
+Pillow versions process exactly the same images. Every stage runs in its own child process,
+which keeps one stage's memory use from hiding another's peak RSS.
+
+Examples:
+    python benchmark.py run --corpus small --output results.json
+    python benchmark.py compare baseline.json results.json --threshold 0.10
+    python benchmark.py check-backend pyvips
+    python benchmark.py check-reducing-gap --reducing-gap 3.0
+"""
+import argparse
+import contextlib
+import copy
+import io
+import json
+import math
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import shutil
+import sys
+import tempfile
+import time
+from PIL import Image, ImageChops, ImageDraw, ImageMath, ImageStat
+import PIL
+import image_backends
+import image_processing
+
+CORPUS_VERSION = 1
+CORPUS_SPEC_FILENAME = ".corpus.json"
+WATERMARK_FILENAME = ".watermark.png"
+
+# (megapixels, format, mode, orientation) of every corpus image. Together they cover each
+# size, input format, mode and orientation; "full" adds the very large images.
+CORPUS_PRESETS = {
+    "small": [
+        (1, "JPEG", "RGB", "landscape"),
+        (1, "PNG", "RGBA", "portrait"),
+        (2, "WEBP", "RGB", "portrait"),
+        (2, "PNG", "P", "landscape"),
+        (4, "JPEG", "L", "portrait"),
+        (4, "WEBP", "RGBA", "landscape"),
+        (8, "JPEG", "RGB", "portrait"),
+        (12, "PNG", "RGB", "landscape"),
+    ],
+}
+CORPUS_PRESETS["full"] = CORPUS_PRESETS["small"] + [
+    (24, "JPEG", "RGB", "landscape"),
+    (24, "PNG", "RGBA", "portrait"),
+    (50, "JPEG", "RGB", "portrait"),
+    (50, "WEBP", "RGB", "landscape"),
+    (100, "JPEG", "RGB", "landscape"),
+    (100, "PNG", "L", "portrait"),
+]
+
+EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+SAVE_OPTIONS = {"JPEG": {"quality": 90}, "PNG": {}, "WEBP": {"quality": 90}}
+
+STAGES = ("watermark", "facebook", "instagram", "twitter", "tiktok", "threads", "bluesky", "pipeline")
+
+
+def image_size(megapixels, orientation, aspect=(3, 2)):
+    """Return the (width, height) of a 3:2 image of about the given number of megapixels."""
+    long_side = round((megapixels * 1_000_000 * aspect[0] / aspect[1]) ** 0.5)
+    short_side = round(long_side * aspect[1] / aspect[0])
+    if orientation == "portrait":
+        return short_side, long_side
+    return long_side, short_side
+
+
+def synthetic_image(size, mode, rng):
+    """
+    Draw a deterministic photo-like test image.
+
+    Smooth gradients stand in for skies and backgrounds, random shapes for edges, and a
+    faint noise texture keeps the image from compressing unrealistically well.
+
+    Args:
+        size (tuple): (width, height) of the image.
+        mode (str): Pillow mode of the result: "RGB", "RGBA", "P" or "L".
+        rng (random.Random): Source of randomness; the same seed gives the same image.
+
+    Returns:
+        PIL.Image.Image: The generated image.
+    """
+    width, height = size
+    channels = [
+        Image.linear_gradient("L").rotate(rng.randrange(360), resample=Image.Resampling.BILINEAR)
+        .resize(size, Image.Resampling.BILINEAR)
+        for _ in range(3)
+    ]
+    img = Image.merge("RGB", channels)
+
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = x0 + rng.randrange(1, width // 3 + 2), y0 + rng.randrange(1, height // 3 + 2)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.ellipse((x0, y0, x1, y1), fill=color)
+        else:
+            draw.rectangle((x0, y0, x1, y1), fill=color)
+
+    # Blend a noise tile over the whole image in place, without a second full-size buffer
+    tile = Image.frombytes("RGB", (256, 256), rng.randbytes(256 * 256 * 3))
+    mask = Image.new("L", tile.size, 24)
+    for top in range(0, height, tile.height):
+        for left in range(0, width, tile.width):
+            img.paste(tile, (left, top), mask)
+
+    if mode == "RGBA":
+        img.putalpha(Image.radial_gradient("L").resize(size, Image.Resampling.BILINEAR).point(lambda value: 255 - value // 2))
+    elif mode == "P":
+        img = img.convert("P", palette=Image.Palette.ADAPTIVE, colors=256)
+    elif mode == "L":
+        img = img.convert("L")
+    return img
+
+
+def synthetic_watermark(seed):
+    """Draw a deterministic RGBA watermark: a translucent badge on a transparent background."""
+    rng = random.Random(seed)
+    watermark = Image.new("RGBA", (600, 200), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(watermark)
+    draw.rounded_rectangle((0, 0, 599, 199), radius=40, fill=(255, 255, 255, 160))
+    for _ in range(12):
+        x, y = rng.randrange(560), rng.randrange(160)
+        draw.ellipse((x, y, x + 40, y + 40), fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256), 220))
+    return watermark
+
+
+def corpus_spec(preset, seed):
+    """Describe a corpus; a cached corpus is reused only if its description matches exactly."""
+    return {
+        "version": CORPUS_VERSION,
+        "preset": preset,
+        "seed": seed,
+        "pillow": PIL.__version__,
+        "images": [list(entry) for entry in CORPUS_PRESETS[preset]],
+    }
+
+
+def generate_corpus(corpus_dir, preset="small", seed=0):
+    """
+    Create the synthetic corpus in corpus_dir, or reuse it if it was generated with the same settings.
+
+    Args:
+        corpus_dir (str): Directory to hold the corpus. Its previous contents are replaced.
+        preset (str): Key of CORPUS_PRESETS.
+        seed (int): Seed of the generated images.
+
+    Returns:
+        str: Path to the generated watermark image.
+    """
+    spec = corpus_spec(preset, seed)
+    spec_path = os.path.join(corpus_dir, CORPUS_SPEC_FILENAME)
+    watermark_path = os.path.join(corpus_dir, WATERMARK_FILENAME)
+    try:
+        with open(spec_path, "r") as file:
+            if json.load(file) == spec:
+                print(f"Reusing the {preset} corpus in '{corpus_dir}'.")
+                return watermark_path
+    except (OSError, ValueError):
+        pass
+
+    print(f"Generating the {preset} corpus in '{corpus_dir}'...")
+    shutil.rmtree(corpus_dir, ignore_errors=True)
+    os.makedirs(corpus_dir)
+    for index, (megapixels, format, mode, orientation) in enumerate(CORPUS_PRESETS[preset]):
+        rng = random.Random(seed * 1000 + index)
+        size = image_size(megapixels, orientation)
+        filename = f"{index:02d}_{megapixels}mp_{orientation}_{mode}{EXTENSIONS[format]}"
+        synthetic_image(size, mode, rng).save(os.path.join(corpus_dir, filename), format=format, **SAVE_OPTIONS[format])
+        print(f"  {filename} ({size[0]}x{size[1]})")
+
+    synthetic_watermark(seed).save(watermark_path, format="PNG")
+    with open(spec_path, "w") as file:
+        json.dump(spec, file, indent=1)
+    return watermark_path
+
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def peak_rss_mb():
+    """Return the peak resident set size of this process and its children in MB, or None where unknown."""
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit
+    children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit
+
+    # Linux carries ru_maxrss over from the parent, so prefer this process's own high-water mark
+    try:
+        with open("/proc/self/status", "r") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    own_peak = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return max(own_peak, children_peak)
+
+
+def _stage_options(watermark_path, workers):
+    """Return the pipeline configuration used by the benchmark: every platform and two watermarks."""
+    from config import DEFAULT_CONFIG
+
+    options = copy.deepcopy(DEFAULT_CONFIG)
+    options.update(
+        watermark_path=watermark_path,
+        corner_watermark_positions=["bottom right"],
+        center_watermark_enabled=True,
+        center_watermark_rotation=30,
+        workers=workers,
+    )
+    options["platforms"] = {platform: True for platform in options["platforms"]}
+    return options
+
+
+def _run_stage(stage, corpus_dir, watermark_path, work_dir, workers, verbose, result_queue):
+    """Time one stage in this (child) process and put its measurements on result_queue."""
+    options = _stage_options(watermark_path, workers)
+    output_dir = os.path.join(work_dir, stage)
+    completions = []
+
+    def progress(completed, total):
+        if completed:  # Not the call before the first image
+            completions.append(time.perf_counter())
+
+    iterate_options = {"workers": workers, "progress": progress}
+    if stage == "watermark":
+        from watermarking import apply_watermark_to_directory
+        run = lambda: apply_watermark_to_directory(
+            corpus_dir, output_dir, watermark_path, {"bottom right": True},
+            options["corner_watermark_scale"], options["corner_watermark_transparency"],
+            True, options["center_watermark_scale"], options["center_watermark_transparency"],
+            options["center_watermark_rotation"], **iterate_options,
+        )
+    elif stage == "pipeline":
+        from core import process_pipeline
+        shutil.copytree(corpus_dir, output_dir)
+        run = lambda: process_pipeline(output_dir, options, progress=progress)
+    elif stage == "instagram":
+        from instagram_scaler import process_images_for_aspect_ratio
+        run = lambda: process_images_for_aspect_ratio(corpus_dir, output_dir, options["instagram_aspect_ratio"], **iterate_options)
+    else:
+        module = __import__(f"{stage}_scaler")
+        run = lambda: getattr(module, f"process_images_for_{stage}")(corpus_dir, output_dir, **iterate_options)
+
+    with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+        start = time.perf_counter()
+        completions.append(start)
+        errors = run()
+        seconds = time.perf_counter() - start
+
+    # Time from the start or the previous completion; with one worker this is each image's latency
+    latencies = [(later - earlier) * 1000 for earlier, later in zip(completions, completions[1:])]
+    result_queue.put({
+        "images": len(latencies),
+        "errors": len(errors),
+        "seconds": seconds,
+        "images_per_sec": len(latencies) / seconds if seconds else None,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50),
+            "p90": percentile(latencies, 0.90),
+            "p99": percentile(latencies, 0.99),
+            "max": max(latencies, default=None),
+        },
+        "peak_rss_mb": peak_rss_mb(),
+    })
+
+
+def _wait_for_result(stage, process, result_queue, poll_seconds=1.0):
+    """
+    Return the measurements a stage's child process puts on result_queue.
+
+    Raises:
+        RuntimeError: If the child exits without them, e.g. after crashing or being killed.
+    """
+    while True:
+        try:
+            return result_queue.get(timeout=poll_seconds)
+        except queue.Empty:
+            if process.exitcode is not None:
+                break
+    # The child may have put its result just before exiting
+    try:
+        return result_queue.get(timeout=poll_seconds)
+    except queue.Empty:
+        raise RuntimeError(f"The {stage} stage exited with code {process.exitcode} without reporting results.") from None
+
+
+def run_benchmarks(corpus_dir, watermark_path, stages, workers=1, repeat=1, verbose=False):
+    """
+    Time every stage, each run in a fresh child process.
+
+    Args:
+        corpus_dir (str): Directory holding the corpus.
+        watermark_path (str): Watermark image to apply.
+        stages (list): Names from STAGES to run.
+        workers (int): Worker processes per stage. With 1, the latencies are per image.
+        repeat (int): Runs per stage; the fastest run is reported.
+        verbose (bool): Show the stages' own output.
+
+    Returns:
+        dict: Measurements keyed by stage name.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for stage in stages:
+        runs = []
+        for _ in range(repeat):
+            work_dir = tempfile.mkdtemp(prefix=f"benchmark_{stage}_")
+            try:
+                result_queue = context.Queue()
+                process = context.Process(
+                    target=_run_stage, args=(stage, corpus_dir, watermark_path, work_dir, workers, verbose, result_queue)
+                )
+                process.start()
+                result = _wait_for_result(stage, process, result_queue)
+                process.join()
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            runs.append(result)
+
+        best = min(runs, key=lambda run: run["seconds"])
+        best["runs"] = [run["seconds"] for run in runs]
+        results[stage] = best
+        print(f"{stage:<10} {best['images_per_sec']:8.2f} images/s  p50 {best['latency_ms']['p50']:8.1f} ms  "
+              f"p99 {best['latency_ms']['p99']:8.1f} ms  peak RSS {_format_mb(best['peak_rss_mb'])}")
+    return results
+
+
+def _format_mb(value):
+    return "n/a" if value is None else f"{value:.0f} MB"
+
+
+def compare_results(baseline, current, threshold=0.10):
+    """
+    Compare two benchmark result files stage by stage.
+
+    A stage regresses when its throughput drops, or its p90 latency or peak RSS grows, by
+    more than threshold (a fraction) relative to the baseline.
+
+    Returns:
+        list: (stage, metric, baseline value, current value, relative change) for every regression.
+    """
+    # (metric, value getter, True if higher is better)
+    metrics = [
+        ("images_per_sec", lambda result: result["images_per_sec"], True),
+        ("p90_latency_ms", lambda result: result["latency_ms"]["p90"], False),
+        ("peak_rss_mb", lambda result: result["peak_rss_mb"], False),
+    ]
+    regressions = []
+    for stage, current_result in current["stages"].items():
+        baseline_result = baseline["stages"].get(stage)
+        if baseline_result is None:
+            print(f"{stage:<10} not in the baseline")
+            continue
+        for metric, value, higher_is_better in metrics:
+            old, new = value(baseline_result), value(current_result)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            regressed = -change > threshold if higher_is_better else change > threshold
+            flag = "REGRESSION" if regressed else "ok"
+            print(f"{stage:<10} {metric:<16} {old:10.2f} -> {new:10.2f} ({change:+.1%})  {flag}")
+            if regressed:
+                regressions.append((stage, metric, old, new, change))
+    return regressions
+
+
+def psnr(a, b):
+    """Return the peak signal-to-noise ratio between two images of the same size and mode, in dB."""
+    rms = ImageStat.Stat(ImageChops.difference(a, b)).rms
+    mse = sum(value * value for value in rms) / len(rms)
+    return math.inf if mse == 0 else 10 * math.log10(255 * 255 / mse)
+
+
+def ssim(a, b, block=8):
+    """
+    Return the structural similarity of two images of the same size, over their luminance.
+
+    Computed on non-overlapping block x block windows and averaged: 1.0 for identical images.
+    """
+    x = a.convert("L").convert("F")
+    y = b.convert("L").convert("F")
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+
+    def mean(image):
+        return image.reduce(block)
+
+    def product(p, q):
+        return ImageMath.lambda_eval(lambda args: args["p"] * args["q"], p=p, q=q)
+
+    mean_x, mean_y = mean(x), mean(y)
+    similarity = ImageMath.lambda_eval(
+        lambda args: (
+            (2 * args["mx"] * args["my"] + c1) * (2 * (args["xy"] - args["mx"] * args["my"]) + c2)
+            / ((args["mx"] * args["mx"] + args["my"] * args["my"] + c1)
+               * (args["xx"] - args["mx"] * args["mx"] + args["yy"] - args["my"] * args["my"] + c2))
+        ),
+        mx=mean_x, my=mean_y, xx=mean(product(x, x)), yy=mean(product(y, y)), xy=mean(product(x, y)),
+    )
+    return similarity.resize((1, 1), Image.Resampling.BOX).getpixel((0, 0))
+
+
+def _conformance_image(size=(3000, 2000)):
+    """Draw a deterministic test image with smooth gradients, fine lines, text-like edges and sensor-like noise."""
+    width, height = size
+    gradient = Image.linear_gradient("L").resize(size)
+    radial = Image.radial_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 10)
+    img = Image.merge("RGB", (gradient, radial, noise))
+    draw = ImageDraw.Draw(img)
+    for x in range(0, width, 7):
+        draw.line((x, 0, x + height // 3, height), fill=(255, 255, 255), width=1)
+    for y in range(0, height, 50):
+        draw.rectangle((width // 4, y, width // 4 + 400, y + 20), fill=(0, 0, 0))
+    return img
+
+
+def check_conformance(name, min_resize_psnr=28.0, max_encode_loss=1.0):
+    """
+    Check that a backend's outputs match Pillow's, on a synthetic image at every platform's size.
+
+    Every resize is compared with a single Pillow LANCZOS resize of the same image, and each
+    encoder setting used by the encoder profiles is checked to keep the decoded output
+    as close to the source as Pillow's own encode (in PSNR).
+
+    Args:
+        name (str): Backend to check.
+        min_resize_psnr (float): Lowest PSNR against Pillow's resize that passes, in dB.
+            The default allows for OpenCV's INTER_AREA downscales, which are visually the
+            same but differ from LANCZOS around the test image's single-pixel lines.
+        max_encode_loss (float): How many dB less accurate than Pillow's an encode may be.
+
+    Returns:
+        list: (check, measured PSNR in dB, reference in dB, passed) for every check.
+
+    Raises:
+        ValueError, ImportError: As for image_backends.create_backend.
+    """
+    backend = image_backends.create_backend(name)
+    pillow = image_backends.create_backend("pillow")
+    source = _conformance_image()
+    results = []
+
+    for mode in ("RGB", "L"):
+        img = source.convert(mode)
+        for size in ((2048, 1365), (1080, 720), (640, 427), (4096, 2731)):
+            measured = psnr(backend.resize(img, size), image_processing.lanczos_resize(img, size))
+            results.append((f"resize {mode} to {size[0]}x{size[1]}", measured, min_resize_psnr, measured >= min_resize_psnr))
+
+    img = pillow.resize(source, (1440, 960))
+    encoders = (
+        ("JPEG", {"quality": 100}),
+        ("JPEG", {"quality": 85, "subsampling": "4:2:0", "optimize": True, "progressive": True}),
+        ("WEBP", {"quality": 90, "method": 4}),
+    )
+    for format, save_options in encoders:
+        measured = psnr(Image.open(io.BytesIO(backend.encode(img, format, **save_options))).convert("RGB"), img)
+        reference = psnr(Image.open(io.BytesIO(pillow.encode(img, format, **save_options))).convert("RGB"), img)
+        label = f"encode {format} " + ", ".join(f"{key}={value}" for key, value in save_options.items())
+        results.append((label, measured, reference, measured >= reference - max_encode_loss))
+    return results
+
+
+def check_reducing_gap(reducing_gap=image_backends.DEFAULT_REDUCING_GAP, min_psnr=40.0, min_ssim=0.99):
+    """
+    Check that Pillow resizes reduced by a whole factor first still match single LANCZOS resizes.
+
+    Large downscales of the synthetic conformance image, like those from big PNG/TIFF
+    sources, are made both ways and compared.
+
+    Args:
+        reducing_gap (float): Margin to check (see image_backends.configure).
+        min_psnr (float): Lowest PSNR against the single resize that passes, in dB.
+        min_ssim (float): Lowest structural similarity with the single resize that passes.
+
+    Returns:
+        list: (check, measured, threshold, passed) for the PSNR and SSIM of every resize.
+    """
+    source = _conformance_image((8000, 5333))
+    results = []
+    for mode in ("RGB", "L"):
+        img = source.convert(mode)
+        for size in ((4096, 2731), (2048, 1365), (1080, 720), (640, 427)):
+            reduced = image_processing.lanczos_resize(img, size, reducing_gap=reducing_gap)
+            reference = image_processing.lanczos_resize(img, size)
+            label = f"resize {mode} to {size[0]}x{size[1]}"
+            measured = psnr(reduced, reference)
+            results.append((f"{label} (PSNR)", measured, min_psnr, measured >= min_psnr))
+            measured = ssim(reduced, reference)
+            results.append((f"{label} (SSIM)", measured, min_ssim, measured >= min_ssim))
+    return results
+
+def format_checks(title, results):
+    """Format the results of check_conformance or check_reducing_gap as a table."""
+    header = f"{'check':<80}{'measured':>10}{'reference':>11}"
+    lines = [title, header, "-" * len(header)]
+    for check, measured, reference, passed in results:
+        lines.append(f"{check:<80}{measured:10.4g}{reference:11.4g}  {'ok' if passed else 'FAIL'}")
+    return "\n".join(lines)
+
+
+def _environment():
+    """Describe the machine and library versions a result was measured with."""
+    return {
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Image Sweetener on a synthetic corpus.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks and write the results to JSON.")
+    run_parser.add_argument("--corpus", choices=sorted(CORPUS_PRESETS), default="small")
+    run_parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "image_sweetener_corpus"),
+                            help="Where the corpus is generated and cached between runs.")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--stages", default=",".join(STAGES), help="Comma-separated stages to run.")
+    run_parser.add_argument("--workers", type=int, default=1)
+    run_parser.add_argument("--repeat", type=int, default=1)
+    run_parser.add_argument("--output", default="benchmark_results.json")
+    run_parser.add_argument("--verbose", action="store_true")
+
+    compare_parser = commands.add_parser("compare", help="Flag regressions against a saved baseline.")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="Allowed relative slowdown (default 0.10).")
+
+    backend_parser = commands.add_parser("check-backend", help="Compare a backend's resizes and encodes with Pillow's.")
+    backend_parser.add_argument("backend", choices=("pyvips", "opencv"))
+
+    gap_parser = commands.add_parser("check-reducing-gap",
+                                     help="Compare resizes reduced by a whole factor first with single LANCZOS resizes.")
+    gap_parser.add_argument("--reducing-gap", type=float, default=image_backends.DEFAULT_REDUCING_GAP)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "check-backend":
+        try:
+            results = check_conformance(args.backend)
+        except ImportError as e:
+            parser.error(str(e))
+        print(format_checks(f"Conformance of the {args.backend} backend with pillow (PSNR in dB):", results))
+        return 0 if all(passed for *_, passed in results) else 1
+
+    if args.command == "check-reducing-gap":
+        results = check_reducing_gap(args.reducing_gap)
+        print(format_checks(f"Resizes reduced first at a gap of {args.reducing_gap} against single LANCZOS resizes:", results))
+        return 0 if all(passed for *_, passed in results) else 1
+
+    if args.command == "compare":
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+        with open(args.current, "r") as file:
+            current = json.load(file)
+        regressions = compare_results(baseline, current, args.threshold)
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}.")
+        return 1 if regressions else 0
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(sorted(unknown))}")
+
+    watermark_path = generate_corpus(args.corpus_dir, args.corpus, args.seed)
+    results = run_benchmarks(args.corpus_dir, watermark_path, stages, args.workers, args.repeat, args.verbose)
+
+    with open(args.output, "w") as file:
+        json.dump({
+            "environment": _environment(),
+            "corpus": corpus_spec(args.corpus, args.seed),
+            "workers": args.workers,
+            "repeat": args.repeat,
+            "stages": results,
+        }, file, indent=2)
+    print(f"Results written to '{args.output}'.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,41 +1,96 @@
-from image_processing import iterate_directory
+from encoder_profiles import PROFILES, extension, save_options
+from image_processing import calculate_fit_size, resample_image, encode_to_target_size, iterate_directory, open_image, write_output
 import os
-from PIL import Image
 
-def resize_image(input_path, output_path, max_dimension=2000, target_size_kb=1024):
+MIN_QUALITY = 10  # Prevent excessive quality loss
+SIZE_TOLERANCE = 0.1  # Accept the first encode within 10% under the target size
+DEFAULT_ENCODER = PROFILES["default"]["bluesky"]
+
+def process_image_for_bluesky(img, output_path, max_dimension=2000, target_size_kb=1024, encoder=DEFAULT_ENCODER):
+    """
+    Scale a single in-memory image to fit within 2000x2000 and save it as WebP,
+    adjusting compression to stay under a target file size. If even the lowest
+    quality is too large, the image is scaled down further until it fits.
+
+    Args:
+        img (PIL.Image.Image): Image to scale. Its pixels are not modified.
+        output_path (str): Path to save the resized image.
+        max_dimension (int): Maximum width/height for the image.
+        target_size_kb (int): Target file size in kilobytes (1MB = 1024 KB).
+        encoder (dict): Encoder settings, as in encoder_profiles. Its quality is the
+            highest quality tried.
+    """
+    new_size = calculate_fit_size(img.width, img.height, max_dimension, max_dimension)
+    target_bytes = target_size_kb * 1024
+    encode_options = save_options(encoder)
+    format = encode_options.pop("format")
+    max_quality = encode_options.pop("quality", 100)
+    start_quality = None  # Search from max_quality
+
+    while True:
+        # Resize the image while maintaining aspect ratio
+        resized = resample_image(img, new_size)
+
+        # Convert to RGB if necessary (WebP requires it, JPEG has no alpha)
+        if resized.mode not in (("RGB",) if format == "JPEG" else ("RGB", "RGBA")):
+            resized = resized.convert("RGB")
+
+        # Find the highest quality that fits, encoding in memory only
+        data, quality = encode_to_target_size(
+            resized,
+            target_bytes,
+            format,
+            min_quality=MIN_QUALITY,
+            max_quality=max_quality,
+            tolerance_bytes=int(target_bytes * SIZE_TOLERANCE),
+            start_quality=start_quality,
+            **encode_options,
+        )
+        if len(data) <= target_bytes or new_size == (1, 1):
+            break
+
+        # Even the lowest quality is too large, so scale down instead of writing an oversize file
+        ratio = (target_bytes / len(data)) ** 0.5 * 0.95
+        new_size = (max(1, int(new_size[0] * ratio)), max(1, int(new_size[1] * ratio)))
+        # The smaller image may fit at a much higher quality, so search the whole range again,
+        # starting from the last quality tried
+        start_quality = quality
+        print(f"'{os.path.basename(output_path)}' exceeds {target_size_kb}KB at quality {quality}; scaling down to {new_size[0]}x{new_size[1]}.")
+
+    # Write only the winning encode
+    write_output(output_path, data)
+
+def resize_image(input_path, output_path, max_dimension=2000, target_size_kb=1024, encoder=DEFAULT_ENCODER):
     """
     Resize an image to fit within 2000x2000 while maintaining aspect ratio 
     and adjusting compression to stay under a target file size.
 
     Args:
         input_path (str): Path to the input image.
-        output_path (str): Path to save the resized WebP image.
+        output_path (str): Path to save the resized image.
         max_dimension (int): Maximum width/height for the image.
         target_size_kb (int): Target file size in kilobytes (1MB = 1024 KB).
+        encoder (dict): Encoder settings, as in encoder_profiles.
     """
-    with Image.open(input_path) as img:
-        width, height = img.size
-        scale_factor = min(max_dimension / width, max_dimension / height)
+    with open_image(input_path) as img:
+        process_image_for_bluesky(
+            img, output_path, max_dimension=max_dimension, target_size_kb=target_size_kb, encoder=encoder
+        )
 
-        new_width = int(width * scale_factor)
-        new_height = int(height * scale_factor)
-
-        # Resize the image while maintaining aspect ratio
-        img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+def file_processor_for_bluesky(target_size_kb=1024, encoder=DEFAULT_ENCODER):
+    """
+    Return a process function, as for iterate_directory, that scales one image file for Bluesky.
 
-        # Convert to RGB if necessary (WebP requires it)
-        if img.mode not in ("RGB", "RGBA"):
-            img = img.convert("RGB")
+    The output is named after the encoder's format (.webp by default).
+    """
+    def process_image(input_path, output_path):
+        # Ensure output file has the encoder's extension (.webp by default)
+        output_webp_path = os.path.splitext(output_path)[0] + extension(encoder)
+        resize_image(input_path, output_webp_path, max_dimension=2000, target_size_kb=target_size_kb, encoder=encoder)
 
-        # Start with high quality and adjust if needed
-        quality = 100  
-        while quality > 10:  # Prevent excessive quality loss
-            img.save(output_path, format="WEBP", quality=quality, method=6)
-            if os.path.getsize(output_path) <= target_size_kb * 1024:
-                break  # Stop if file size is within the limit
-            quality -= 5  # Reduce quality and try again
+    return process_image
 
-def process_images_for_bluesky(input_dir, output_dir, target_size_kb=1024):
+def process_images_for_bluesky(input_dir, output_dir, target_size_kb=1024, encoder=DEFAULT_ENCODER, **iterate_options):
     """
     Process images for Bluesky while ensuring max dimensions of 2000x2000 
     and a target file size.
@@ -44,15 +99,20 @@ def process_images_for_bluesky(input_dir, output_dir, target_size_kb=1024):
         input_dir (str): Path to the input directory.
         output_dir (str): Path to the output directory.
         target_size_kb (int): Target file size for each image (in KB).
+        encoder (dict): Encoder settings, as in encoder_profiles.
+        **iterate_options: Extra keyword arguments for iterate_directory, such as workers.
+
+    Returns:
+        list: (input_path, error message) for every image that could not be processed.
     """
     print(f"Processing images for Bluesky in '{input_dir}' with target size {target_size_kb}KB...")
-    print(f"Output will be saved to '{output_dir}' in WebP format.")
+    print(f"Output will be saved to '{output_dir}' in {encoder['format']} format.")
 
-    def process_image(input_path, output_path):
-        # Ensure output file has .webp extension
-        output_webp_path = os.path.splitext(output_path)[0] + ".webp"
-        resize_image(input_path, output_webp_path, max_dimension=2000, target_size_kb=target_size_kb)
+    errors = iterate_directory(
+        input_dir, output_dir, file_processor_for_bluesky(target_size_kb, encoder), preserve_file_type=False,
+        **iterate_options,
+    )
 
-    iterate_directory(input_dir, output_dir, process_image, preserve_file_type=False)
+    print("Bluesky scaling complete.")
 
-    print("Bluesky scaling complete.")
\ No newline at end of file
+    return errors
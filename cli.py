@@ -0,0 +1,253 @@
+"""
+Headless command-line entry point for the Image Sweetener pipeline.
+
+Reads the same config.json as the GUI, applies any command-line overrides and runs
+core.process_pipeline. Only the standard library and config are imported up front;
+Pillow and the pipeline modules are imported once there is a batch to run, so
+`--help` and invalid invocations return immediately.
+
+Example:
+    python cli.py photos/ --platforms instagram,bluesky --no-watermark --workers 4
+"""
+import time
+
+_start_time = time.perf_counter()
+
+import argparse
+import os
+import sys
+from config import CONFIG_FILE, load_config, save_config
+from encoder_profiles import PLATFORMS, profile_names, resolve_profile
+
+CORNER_POSITIONS = ("top left", "top right", "bottom left", "bottom right")
+
+
+def build_parser():
+    """Build the argument parser. Every override defaults to None, meaning "use the config file"."""
+    parser = argparse.ArgumentParser(
+        description="Watermark and resize every image in a directory for social media, without the GUI.",
+    )
+    parser.add_argument("target_dir", nargs="?", help="Directory of images to process (default: target_dir from the config).")
+    parser.add_argument("--config", default=CONFIG_FILE, help=f"Configuration file to read (default: {CONFIG_FILE}).")
+    parser.add_argument("--save-config", action="store_true", help="Write the options, with overrides applied, back to the configuration file.")
+    parser.add_argument("--timings", action="store_true", help="Print how long startup, imports and processing took.")
+
+    watch = parser.add_argument_group("watch mode")
+    watch.add_argument("--watch", action="store_true", help="Keep running and process images as they are added to the target directory.")
+    watch.add_argument("--process-existing", action="store_true", help="In watch mode, first process the images already there.")
+    watch.add_argument("--settle-seconds", dest="watch_settle_seconds", type=float,
+                       help="How long a new file must stay unchanged before it is processed.")
+    watch.add_argument("--poll-interval", dest="watch_poll_interval", type=float,
+                       help="Seconds between directory scans where inotify is unavailable.")
+
+    watermark = parser.add_argument_group("watermark")
+    watermark.add_argument("--watermark", dest="watermark_path", help="Watermark image to apply.")
+    watermark.add_argument("--no-watermark", action="store_true", help="Do not apply a watermark.")
+    watermark.add_argument("--corner", dest="corner_watermark_positions", action="append", choices=CORNER_POSITIONS,
+                           help="Corner to place a watermark in. May be given several times.")
+    watermark.add_argument("--corner-scale", dest="corner_watermark_scale", type=int)
+    watermark.add_argument("--corner-transparency", dest="corner_watermark_transparency", type=int)
+    watermark.add_argument("--center", dest="center_watermark_enabled", action=argparse.BooleanOptionalAction,
+                           help="Add a watermark in the center.")
+    watermark.add_argument("--center-scale", dest="center_watermark_scale", type=int)
+    watermark.add_argument("--center-transparency", dest="center_watermark_transparency", type=int)
+    watermark.add_argument("--center-rotation", dest="center_watermark_rotation", type=int)
+    watermark.add_argument("--save-watermarked", dest="save_watermarked_images", action=argparse.BooleanOptionalAction,
+                           help="Keep the full-size watermarked images in watermarks/.")
+
+    platforms = parser.add_argument_group("platforms")
+    platforms.add_argument("--platforms", help=f"Comma-separated platforms to process, replacing the configured ones ({', '.join(PLATFORMS)} or 'all').")
+    platforms.add_argument("--instagram-aspect-ratio", dest="instagram_aspect_ratio", help="Instagram aspect ratio, e.g. 4:5.")
+
+    sources = parser.add_argument_group("sources")
+    sources.add_argument("--recursive", dest="recursive", action=argparse.BooleanOptionalAction,
+                         help="Also process images in subdirectories, mirroring them under each output directory.")
+    sources.add_argument("--include", dest="include_globs", action="append", metavar="GLOB",
+                         help="Only process images matching this pattern, e.g. '*.jpg' or '2024/*'. May be given several times.")
+    sources.add_argument("--exclude", dest="exclude_globs", action="append", metavar="GLOB",
+                         help="Skip images and subdirectories matching this pattern. May be given several times.")
+    sources.add_argument("--walk-workers", dest="walk_workers", type=int,
+                         help="Directories listed at once in a recursive run.")
+
+    encoding = parser.add_argument_group("encoding")
+    encoding.add_argument("--encoder-profile", dest="encoder_profile",
+                          help=f"Encoder settings for every platform: {', '.join(profile_names())} or a profile from the config.")
+    encoding.add_argument("--link-mode", dest="link_mode", choices=("hardlink", "reflink", "copy"),
+                          help="How sources that need no changes are passed through: reflink, then hardlink, then copy "
+                               "('hardlink'), reflink or copy ('reflink'), or always copy ('copy').")
+    encoding.add_argument("--backend", dest="backend", choices=("pillow", "pyvips", "opencv"),
+                          help="Library that resizes and encodes images; pyvips and opencv fall back to pillow when not installed.")
+    encoding.add_argument("--measure-encoders", action="store_true",
+                          help="Report encode time and output size of every encoder profile on a sample of the images, then exit.")
+    encoding.add_argument("--sample-size", type=int, default=5, help="Images to sample for --measure-encoders (default: 5).")
+
+    performance = parser.add_argument_group("performance")
+    performance.add_argument("--workers", type=int, help="Worker processes; 0 uses every CPU core.")
+    performance.add_argument("--decode-once", dest="decode_once", action=argparse.BooleanOptionalAction)
+    performance.add_argument("--pixel-cache", dest="pixel_cache", action=argparse.BooleanOptionalAction,
+                             help="Keep decoded source pixels on disk, so runs that only change watermark or "
+                                  "platform options skip decoding.")
+    performance.add_argument("--pixel-cache-dir", dest="pixel_cache_dir",
+                             help="Directory of the pixel cache (default: a hidden directory in the target directory).")
+    performance.add_argument("--pixel-cache-mb", dest="pixel_cache_megabytes", type=float,
+                             help="Size the pixel cache is kept within, in megabytes.")
+    performance.add_argument("--incremental", dest="incremental", action=argparse.BooleanOptionalAction,
+                             help="Only regenerate outputs whose source or options changed.")
+    performance.add_argument("--resize-cascade", dest="resize_cascade", action=argparse.BooleanOptionalAction)
+    performance.add_argument("--reducing-gap", dest="reducing_gap", type=float,
+                             help="Shrink large downscales by a whole factor first, keeping this margin over the "
+                                  "target size before LANCZOS; 0 disables it.")
+    performance.add_argument("--streaming", dest="streaming", action=argparse.BooleanOptionalAction,
+                             help="Overlap reading, processing and writing.")
+    performance.add_argument("--prefetch-depth", dest="prefetch_depth", type=int)
+    performance.add_argument("--write-behind-depth", dest="write_behind_depth", type=int)
+    performance.add_argument("--memory-budget", dest="memory_budget_megapixels", type=float,
+                             help="Megapixels an image is reduced to at decode time, with resizes done in strips; 0 disables.")
+    performance.add_argument("--large-image-slots", dest="large_image_slots", type=int,
+                             help="Images over the memory budget processed at once across all workers.")
+    performance.add_argument("--max-image-megapixels", dest="max_image_megapixels", type=float,
+                             help="Largest image to decode; bigger ones fail as decompression bombs. 0 uses the default.")
+    performance.add_argument("--instrument", dest="instrumentation", action=argparse.BooleanOptionalAction,
+                             help="Time every stage of every file and print a per-platform summary.")
+    performance.add_argument("--report", dest="report_path",
+                             help="JSON lines run report to write when instrumenting (default: hidden file in the target directory).")
+    return parser
+
+
+def parse_platforms(value):
+    """Parse a comma-separated platform list into the config's platforms dictionary."""
+    names = {name.strip().lower() for name in value.split(",") if name.strip()}
+    if "all" in names:
+        names = set(PLATFORMS)
+    unknown = names - set(PLATFORMS)
+    if unknown:
+        raise ValueError(f"Unknown platform(s): {', '.join(sorted(unknown))}. Choose from {', '.join(PLATFORMS)}.")
+    return {platform: platform in names for platform in PLATFORMS}
+
+
+def apply_overrides(config, args):
+    """
+    Apply the command-line overrides to a loaded configuration.
+
+    Args:
+        config (dict): Configuration as returned by load_config. It is modified in place.
+        args (argparse.Namespace): Parsed command-line arguments.
+
+    Returns:
+        dict: The configuration.
+    """
+    overridable = (
+        "watermark_path", "corner_watermark_positions", "corner_watermark_scale", "corner_watermark_transparency",
+        "center_watermark_enabled", "center_watermark_scale", "center_watermark_transparency",
+        "center_watermark_rotation", "save_watermarked_images", "instagram_aspect_ratio", "recursive", "include_globs",
+        "exclude_globs", "walk_workers", "encoder_profile", "link_mode", "backend",
+        "workers", "decode_once", "pixel_cache", "pixel_cache_dir", "pixel_cache_megabytes", "incremental", "resize_cascade", "reducing_gap", "streaming", "prefetch_depth", "write_behind_depth",
+        "memory_budget_megapixels", "large_image_slots", "max_image_megapixels", "instrumentation", "report_path",
+        "watch_settle_seconds", "watch_poll_interval",
+    )
+    for key in overridable:
+        value = getattr(args, key)
+        if value is not None:
+            config[key] = value
+
+    if args.target_dir is not None:
+        config["target_dir"] = args.target_dir
+    if args.platforms is not None:
+        config["platforms"] = parse_platforms(args.platforms)
+    resolve_profile(config["encoder_profile"], config["encoder_profiles"])  # Raises ValueError if unusable
+    if config["reducing_gap"] and config["reducing_gap"] < 1:
+        raise ValueError("the reducing gap must be 0 (off) or at least 1")
+    if config["incremental"] and not config["decode_once"]:
+        raise ValueError("incremental runs need decode-once processing; drop --no-decode-once or --incremental")
+
+    # Same as the GUI: without a watermark file, no watermark is placed anywhere
+    if args.no_watermark:
+        config["watermark_path"] = ""
+    if not config["watermark_path"]:
+        config["corner_watermark_positions"] = []
+        config["center_watermark_enabled"] = False
+
+    return config
+
+
+def format_encoder_measurements(results):
+    """Format the results of core.measure_encoder_profiles as a table, with totals relative to the first profile."""
+    header = f"{'profile':<12}{'platform':<12}{'files':>6}{'encode':>11}{'KB/image':>11}"
+    lines = [header, "-" * len(header)]
+    baseline = None
+    for profile, rows in results.items():
+        for platform, row in rows.items():
+            kb_per_image = row["bytes"] / 1024 / max(1, row["files"])
+            lines.append(f"{profile:<12}{platform:<12}{row['files']:>6}{row['encode_seconds']:10.2f}s{kb_per_image:11.1f}")
+        seconds = sum(row["encode_seconds"] for row in rows.values())
+        size = sum(row["bytes"] for row in rows.values())
+        if baseline is None:
+            baseline = (seconds, size)
+        relative = f"  ({seconds / max(baseline[0], 1e-9):.0%} of the time, {size / max(baseline[1], 1):.0%} of the size of {next(iter(results))})"
+        lines.append(f"{profile:<12}{'total':<12}{'':>6}{seconds:10.2f}s{size / (1024 * 1024):9.1f}MB" + relative)
+        lines.append("")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    """
+    Run the pipeline from the command line.
+
+    Returns:
+        int: Exit status; 0 on success, 1 if any image failed, 2 for invalid arguments.
+    """
+    timings = [("cli imports", time.perf_counter() - _start_time)]
+    stage_start = time.perf_counter()
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.config != CONFIG_FILE and not os.path.isfile(args.config):
+        parser.error(f"configuration file '{args.config}' does not exist")
+
+    try:
+        config = apply_overrides(load_config(args.config), args)
+    except ValueError as e:
+        parser.error(str(e))
+
+    target_dir = config["target_dir"]
+    if not target_dir or not os.path.isdir(target_dir):
+        parser.error(f"target directory '{target_dir}' does not exist")
+    if args.save_config:
+        save_config(config, args.config)
+    timings.append(("arguments and config", time.perf_counter() - stage_start))
+
+    stage_start = time.perf_counter()
+    from core import measure_encoder_profiles, process_pipeline
+    timings.append(("pipeline imports", time.perf_counter() - stage_start))
+    startup = time.perf_counter() - _start_time
+
+    if args.measure_encoders:
+        print(format_encoder_measurements(measure_encoder_profiles(target_dir, config, args.sample_size)))
+        return 0
+
+    if args.watch:
+        from watch import watch_directory
+        watch_directory(
+            target_dir,
+            config,
+            settle_seconds=config["watch_settle_seconds"],
+            poll_interval=config["watch_poll_interval"],
+            process_existing=args.process_existing,
+        )
+        return 0
+
+    stage_start = time.perf_counter()
+    errors = process_pipeline(target_dir, config)
+    timings.append(("processing", time.perf_counter() - stage_start))
+
+    if args.timings:
+        print("Timings:")
+        for stage, seconds in timings:
+            print(f"  {stage:<22} {seconds * 1000:10.1f} ms")
+        print(f"  {'startup total':<22} {startup * 1000:10.1f} ms")
+
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+import copy
+import json
+import os
+
+CONFIG_FILE = "config.json"
+
+DEFAULT_CONFIG = {
+    "target_dir": "",
+    "watermark_path": "",
+    "corner_watermark_positions": [],
+    "corner_watermark_scale": 70,
+    "corner_watermark_transparency": 100,
+    "center_watermark_enabled": False,
+    "center_watermark_scale": 70,
+    "center_watermark_transparency": 100,
+    "center_watermark_rotation": 0,
+    "platforms": {
+        "facebook": False,
+        "instagram": False,
+        "twitter": False,
+        "tiktok": False,
+        "threads": False,
+        "bluesky": False,
+    },
+    "instagram_aspect_ratio": "4:5",
+    "recursive": False,
+    "include_globs": [],
+    "exclude_globs": [],
+    "walk_workers": 8,
+    "encoder_profile": "default",
+    "encoder_profiles": {},
+    "link_mode": "hardlink",
+    "backend": "pillow",
+    "reducing_gap": 3.0,
+    "decode_once": True,
+    "pixel_cache": False,
+    "pixel_cache_dir": "",
+    "pixel_cache_megabytes": 4096,
+    "save_watermarked_images": True,
+    "workers": 0,
+    "incremental": False,
+    "resize_cascade": True,
+    "resize_cascade_min_ratio": 2.0,
+    "streaming": False,
+    "prefetch_depth": 8,
+    "write_behind_depth": 16,
+    "memory_budget_megapixels": 0,
+    "large_image_slots": 1,
+    "max_image_megapixels": 0,
+    "instrumentation": False,
+    "report_path": "",
+    "watch_settle_seconds": 2.0,
+    "watch_poll_interval": 1.0,
+}
+
+
+def load_config(config_file=CONFIG_FILE):
+    """Load configuration from file or create default configuration."""
+    print("Loading configuration...")
+    if not os.path.exists(config_file):
+        print("Config file not found. Creating with defaults.")
+        save_config(DEFAULT_CONFIG, config_file)
+        return copy.deepcopy(DEFAULT_CONFIG)
+    
+    with open(config_file, "r") as file:
+        config = json.load(file)
+        print("Config file loaded.")
+        
+        # Ensure missing keys have default values
+        for key, value in DEFAULT_CONFIG.items():
+            config.setdefault(key, copy.deepcopy(value))
+        if "corner_position_vars" not in config:
+            config["corner_position_vars"] = {
+                "top left": False,
+                "top right": False,
+                "bottom left": False,
+                "bottom right": False
+            }
+        
+        return config
+
+
+def save_config(config, config_file=CONFIG_FILE):
+    """Save configuration to file."""
+    print("Saving configuration...")
+    with open(config_file, "w") as file:
+        json.dump(config, file, indent=4)
+    print("Configuration saved.")
@@ -1,88 +1,563 @@
 import os
-from watermarking import apply_watermark_to_directory
-from facebook_scaler import process_images_for_facebook
-from instagram_scaler import process_images_for_aspect_ratio
-from twitter_scaler import process_images_for_twitter
-from tiktok_scaler import process_images_for_tiktok
-from threads_scaler import process_images_for_threads
-from bluesky_scaler import process_images_for_bluesky
-import json
-
-CONFIG_FILE = "config.json"
-
-DEFAULT_CONFIG = {
-    "target_dir": "",
-    "watermark_path": "",
-    "corner_watermark_positions": [],
-    "corner_watermark_scale": 70,
-    "corner_watermark_transparency": 100,
-    "center_watermark_enabled": False,
-    "center_watermark_scale": 70,
-    "center_watermark_transparency": 100,
-    "center_watermark_rotation": 0,
-    "platforms": {
-        "facebook": False,
-        "instagram": False,
-        "twitter": False,
-        "tiktok": False,
-        "threads": False,
-        "bluesky": False,
-    },
-    "instagram_aspect_ratio": "4:5",
-}
-
-
-def load_config():
-    """Load configuration from file or create default configuration."""
-    print("Loading configuration...")
-    if not os.path.exists(CONFIG_FILE):
-        print("Config file not found. Creating with defaults.")
-        save_config(DEFAULT_CONFIG)
-        return DEFAULT_CONFIG
-    
-    with open(CONFIG_FILE, "r") as file:
-        config = json.load(file)
-        print("Config file loaded.")
-        
-        # Ensure missing keys have default values
-        if "corner_position_vars" not in config:
-            config["corner_position_vars"] = {
-                "top left": False,
-                "top right": False,
-                "bottom left": False,
-                "bottom right": False
-            }
-        
-        return config
-
-
-def save_config(config):
-    """Save configuration to file."""
-    print("Saving configuration...")
-    with open(CONFIG_FILE, "w") as file:
-        json.dump(config, file, indent=4)
-    print("Configuration saved.")
-
-
-def process_pipeline(target_dir, options):
+from collections import namedtuple
+from contextlib import nullcontext
+# The configuration lives in its own module so the CLI can read it without loading the pipeline
+from config import CONFIG_FILE, DEFAULT_CONFIG, load_config, save_config
+from encoder_profiles import DEFAULT_PROFILE, PLATFORMS, extension, profile_names, resolve_profile
+# The pipeline modules (Pillow, the worker pools) are imported by the functions that use them,
+# so importing core, e.g. for the CLI's startup, stays cheap
+
+
+# Decompression bomb limit in memory-bounded mode, when none is configured. Pillow's own
+# limit (about 179 MP) would refuse the very panoramas the mode is meant for.
+BUDGET_MAX_IMAGE_MEGAPIXELS = 1000
+
+# Default run report location; hidden, so later runs don't take it for a source image
+REPORT_FILENAME = ".image_sweetener_report.jsonl"
+
+# Output directories inside the target directory, which a recursive run must not take for sources
+OUTPUT_DIRS = ("watermarks",) + PLATFORMS
+
+# handler is called as handler(img, output_path, source_path). settings holds the platform
+# options that affect its output, and max_size is the box its output always fits within.
+# passthrough is (max_dimension, max_bytes) if a compliant source file may be passed through
+# unchanged (see passthrough.is_compliant), and None if the output is always encoded.
+PlatformHandler = namedtuple("PlatformHandler", "platform extension handler settings max_size passthrough")
+
+
+def _platform_handlers(options):
+    """
+    Build the in-memory handler for every enabled platform, in pipeline order.
+
+    Each platform's scaler module is only imported when that platform is enabled. Output
+    formats and encoder settings come from the configured encoder profile.
+
+    Returns:
+        list: A PlatformHandler for every enabled platform.
+    """
+    enabled = options["platforms"]
+    encoders = _encoders(options)
+    handlers = []
+
+    def add(platform, handler, settings, max_size, passthrough_limits=None):
+        encoder = encoders[platform]
+        if not (encoder.get("passthrough", False) and encoder["format"] == "JPEG"):
+            passthrough_limits = None
+        handlers.append(PlatformHandler(
+            platform, extension(encoder), handler, {**settings, "encoder": encoder}, max_size, passthrough_limits
+        ))
+
+    if enabled.get("facebook", False):
+        from facebook_scaler import MAX_DIMENSION, process_image_for_facebook
+        add("facebook", lambda img, output_path, source_path: process_image_for_facebook(
+            img, output_path, source_path, encoder=encoders["facebook"]
+        ), {}, (2048, 2048), (MAX_DIMENSION, None))
+
+    if enabled.get("instagram", False):
+        from instagram_scaler import process_image_for_aspect_ratio
+        add("instagram", lambda img, output_path, source_path: process_image_for_aspect_ratio(
+            img, output_path, options["instagram_aspect_ratio"], encoder=encoders["instagram"]
+        ), {"aspect_ratio": options["instagram_aspect_ratio"]}, (1440, 1440))
+
+    if enabled.get("twitter", False):
+        from twitter_scaler import MAX_DIMENSION, MAX_FILE_BYTES, process_image_for_twitter
+        add("twitter", lambda img, output_path, source_path: process_image_for_twitter(
+            img, output_path, source_path, encoder=encoders["twitter"]
+        ), {}, (4096, 4096), (MAX_DIMENSION, MAX_FILE_BYTES))
+
+    if enabled.get("tiktok", False):
+        from tiktok_scaler import process_image_for_tiktok
+        add("tiktok", lambda img, output_path, source_path: process_image_for_tiktok(
+            img, output_path, encoder=encoders["tiktok"]
+        ), {}, (1080, 1920))
+
+    if enabled.get("threads", False):
+        from threads_scaler import MAX_DIMENSION, process_image_for_threads
+        add("threads", lambda img, output_path, source_path: process_image_for_threads(
+            img, output_path, source_path, encoder=encoders["threads"]
+        ), {}, (2160, 2160), (MAX_DIMENSION, None))
+
+    if enabled.get("bluesky", False):
+        from bluesky_scaler import process_image_for_bluesky
+        add("bluesky", lambda img, output_path, source_path: process_image_for_bluesky(
+            img, output_path, encoder=encoders["bluesky"]
+        ), {}, (2000, 2000))
+
+    return handlers
+
+
+def _encoders(options):
+    """Return the encoder settings of every platform in the configured encoder profile."""
+    return resolve_profile(options.get("encoder_profile", DEFAULT_PROFILE), options.get("encoder_profiles"))
+
+
+def ordered_platform_handlers(options):
+    """
+    Return the PlatformHandler of every enabled platform in the order images are run through them.
+
+    With the "resize_cascade" option, that is from the largest target size down (see
+    resize_planner.plan_resize_order).
+    """
+    from resize_planner import plan_resize_order
+    platform_handlers = _platform_handlers(options)
+    if options.get("resize_cascade", True):
+        platform_handlers = plan_resize_order([(handler, handler.max_size) for handler in platform_handlers])
+    return platform_handlers
+
+
+def decode_size(img, max_sizes):
+    """Return the smallest (width, height) of img that every platform output of the given maximum sizes fits into."""
+    from image_processing import calculate_fit_size
+    needed_sizes = [calculate_fit_size(img.width, img.height, *max_size) for max_size in max_sizes]
+    return max(size[0] for size in needed_sizes), max(size[1] for size in needed_sizes)
+
+
+def watermark_source(img, original_watermark, options):
+    """Apply the configured corner and center watermarks to a decoded image, in place where possible, and return it in RGB."""
+    from watermarking import watermark_image
+    return watermark_image(
+        img,
+        original_watermark,
+        {pos: True for pos in options["corner_watermark_positions"]},
+        options["corner_watermark_scale"],
+        options["corner_watermark_transparency"],
+        options["center_watermark_enabled"],
+        options["center_watermark_scale"],
+        options["center_watermark_transparency"],
+        options["center_watermark_rotation"],
+        in_place=True,
+    )
+
+
+def run_platforms(img, platform_handlers, output_paths, source_path, options):
+    """
+    Run one decoded image through platform handlers, sharing its resizes when cascading.
+
+    Args:
+        img (PIL.Image.Image): Decoded (and watermarked) image.
+        platform_handlers (list): PlatformHandlers, as from ordered_platform_handlers.
+        output_paths (list): Output path for each handler, or None to skip it.
+        source_path (str): File img was decoded from, if its pixels are unchanged, so
+            compliant outputs can be passed through.
+        options (dict): Configuration, for "resize_cascade" and "resize_cascade_min_ratio".
+
+    Returns:
+        resize_planner.ResizeCascade: The cascade used, or None.
+    """
+    import instrumentation
+    from resize_planner import resize_cascade
+    use_cascade = options.get("resize_cascade", True)
+    with resize_cascade(img, options.get("resize_cascade_min_ratio", 2.0)) if use_cascade else nullcontext() as cascade:
+        for platform_handler, output_path in zip(platform_handlers, output_paths):
+            if output_path is not None:
+                with instrumentation.platform(platform_handler.platform):
+                    platform_handler.handler(img, output_path, source_path)
+    if cascade is not None:
+        instrumentation.note_cascade(cascade.source_pixels, cascade.resampled_pixels)
+    return cascade
+
+
+def _passes_through(source_path, passthrough_limits):
+    """Return whether source_path can be passed through unchanged to every output with the given passthrough limits."""
+    from image_processing import probe_file
+    import passthrough
+    if not passthrough_limits or None in passthrough_limits:
+        return False
+    facts = probe_file(source_path)
+    return all(passthrough.is_compliant(*facts, *limits) for limits in passthrough_limits)
+
+
+def _watermark_settings(options, original_watermark):
+    """Return the watermark options that affect the output, or None when no watermark is applied."""
+    if original_watermark is None:
+        return None
+    return {
+        "watermark_hash": original_watermark.info["file_hash"],
+        "corner_watermark_positions": sorted(options["corner_watermark_positions"]),
+        "corner_watermark_scale": options["corner_watermark_scale"],
+        "corner_watermark_transparency": options["corner_watermark_transparency"],
+        "center_watermark_enabled": options["center_watermark_enabled"],
+        "center_watermark_scale": options["center_watermark_scale"],
+        "center_watermark_transparency": options["center_watermark_transparency"],
+        "center_watermark_rotation": options["center_watermark_rotation"],
+    }
+
+
+def _render_settings(options):
+    """
+    Return the process-wide options that affect the pixels or bytes of every output.
+
+    Call it after configure_processing, so the backend is the one actually in use.
+    """
+    import image_backends
+    use_cascade = options.get("resize_cascade", True)
+    return {
+        "backend": image_backends.selected_backend(),
+        "reducing_gap": options.get("reducing_gap", image_backends.DEFAULT_REDUCING_GAP),
+        "resize_cascade": use_cascade,
+        "resize_cascade_min_ratio": options.get("resize_cascade_min_ratio", 2.0) if use_cascade else None,
+        # Images over the budget are reduced when decoded; the other budget options don't change pixels
+        "memory_budget_megapixels": options.get("memory_budget_megapixels", 0),
+    }
+
+
+def _plan_incremental_run(target_dir, outputs, index, filenames, prune_deleted, recursive=False):
+    """
+    Work out which outputs of which sources need to be regenerated.
+
+    Args:
+        target_dir (str): Directory holding the source images.
+        outputs (list): (output_dir, extension, options_hash) for every output directory.
+        index (dict): Entries of target_dir's source index.
+        filenames (iterable): Source filenames to plan for.
+        prune_deleted (bool): Remove the outputs of sources that no longer exist. Only
+            possible when filenames are all the sources.
+        recursive (bool): Whether filenames come from the whole tree. Otherwise the outputs
+            of sources in subdirectories, from earlier recursive runs, are never pruned.
+
+    Returns:
+        tuple: (pending, fingerprints, manifests). pending maps each source filename to the
+        set of output directories that are missing or out of date for it.
+    """
+    from manifest import fingerprint_source, is_up_to_date, load_manifest, prune_deleted_sources
+    manifests = {output_dir: load_manifest(output_dir) for output_dir, _, _ in outputs}
+
+    pending = {}
+    fingerprints = {}
+    for filename in sorted(filenames):
+        known_entries = [manifests[output_dir].get(filename) for output_dir, _, _ in outputs]
+        fingerprint = fingerprint_source(os.path.join(target_dir, filename), known_entries, index[filename])
+        fingerprints[filename] = fingerprint
+        pending[filename] = {
+            output_dir
+            for output_dir, _, options_hash in outputs
+            if not is_up_to_date(manifests[output_dir].get(filename), fingerprint, options_hash, output_dir)
+        }
+
+    # Remove outputs whose source was deleted; a partial run can't tell which sources are gone
+    if prune_deleted:
+        for output_dir, entries in manifests.items():
+            sources = fingerprints if recursive else set(fingerprints) | {name for name in entries if os.sep in name}
+            removed = prune_deleted_sources(output_dir, entries, sources)
+            if removed:
+                print(f"Removed {removed} output(s) of deleted sources from '{output_dir}'.")
+
+    stale = sum(1 for output_dirs in pending.values() if output_dirs)
+    print(f"Incremental run: {stale} of {len(pending)} source(s) need processing.")
+    return pending, fingerprints, manifests
+
+
+def _save_incremental_run(target_dir, outputs, pending, fingerprints, manifests, errors):
+    """Record every successfully regenerated output in its directory's manifest."""
+    from manifest import make_entry, save_manifest
+    failed = {os.path.relpath(input_path, target_dir) for input_path, _ in errors}
+    for output_dir, extension, options_hash in outputs:
+        entries = manifests[output_dir]
+        for filename, output_dirs in pending.items():
+            if output_dir in output_dirs and filename not in failed:
+                output_filename = os.path.splitext(filename)[0] + extension
+                entries[filename] = make_entry(fingerprints[filename], options_hash, output_filename)
+        save_manifest(output_dir, entries)
+
+
+def configure_processing(options):
+    """
+    Apply the options that hold for the whole process: memory budget, link mode and backend.
+
+    Worker processes forked afterwards inherit them.
+    """
+    import image_backends
+    import memory_budget
+    import passthrough
+    budget_megapixels = options.get("memory_budget_megapixels", 0)
+    max_megapixels = options.get("max_image_megapixels", 0)
+    if budget_megapixels and not max_megapixels:
+        max_megapixels = BUDGET_MAX_IMAGE_MEGAPIXELS
+    memory_budget.configure(
+        pixel_budget=int(budget_megapixels * 1_000_000),
+        large_image_slots=options.get("large_image_slots", 1),
+        max_image_pixels=int(max_megapixels * 1_000_000),
+    )
+    passthrough.configure(options.get("link_mode", "hardlink"))
+    backend = image_backends.configure(
+        options.get("backend", image_backends.DEFAULT_BACKEND),
+        reducing_gap=options.get("reducing_gap", image_backends.DEFAULT_REDUCING_GAP),
+    )
+    if backend != image_backends.DEFAULT_BACKEND:
+        print(f"Resizing and encoding with the {backend} backend.")
+
+
+def process_pipeline(target_dir, options, progress=None, cancel_event=None, filenames=None):
+    """
+    Run watermarking and every enabled platform over the images in target_dir.
+
+    With the "recursive" option, the images in every subdirectory of target_dir are
+    processed too, and each platform's outputs mirror the source tree. The output
+    directories themselves are never taken for sources. The tree is walked in parallel,
+    and images are processed as they are found unless the run is incremental or not
+    decode-once, which need the full listing first. "include_globs" and "exclude_globs"
+    select the sources in either mode (see tree_walker.matches).
+
+    Args:
+        target_dir (str): Directory holding the source images.
+        options (dict): Configuration, as returned by load_config.
+        progress (function): Called as progress(completed, total) as images finish.
+        cancel_event (threading.Event): Set it to stop after the images being processed.
+        filenames (iterable): Names of the source images in target_dir to process (paths
+            relative to target_dir in a recursive run). Defaults to every image.
+
+    Returns:
+        list: (input_path, error message) for every image that could not be processed.
+        Images skipped because of cancellation have the message CANCELLED.
+
+    Raises:
+        ValueError: If the run is incremental but not decode-once; only the decode-once
+            pipeline keeps the manifests an incremental run is planned from.
+    """
+    from image_processing import CANCELLED
+    import instrumentation
+    import pixel_cache
+    import source_index
+    from tree_walker import DEFAULT_WALK_WORKERS, is_selected
+    if options.get("incremental", False) and not options.get("decode_once", True):
+        raise ValueError("Incremental runs need decode-once processing (the decode_once option).")
     print("Starting processing pipeline...")
 
+    # 0 means one worker per CPU core
+    iterate_options = {"workers": options.get("workers", 0), "progress": progress, "cancel_event": cancel_event}
+    if options.get("streaming", False):
+        iterate_options.update(
+            streaming=True,
+            prefetch=options.get("prefetch_depth", 8),
+            write_behind=options.get("write_behind_depth", 16),
+        )
+
+    # Configured before the worker pools fork, so they share the large image slots
+    configure_processing(options)
+    if options.get("pixel_cache", False):
+        cache_dir = options.get("pixel_cache_dir") or os.path.join(target_dir, pixel_cache.CACHE_DIRNAME)
+        pixel_cache.configure(cache_dir, options.get("pixel_cache_megabytes", pixel_cache.DEFAULT_MAX_MEGABYTES))
+        print(f"Caching decoded pixels in '{cache_dir}'.")
+    else:
+        pixel_cache.configure(None)
+
+    # List and probe the sources once; every stage works from this index
+    include = options.get("include_globs", [])
+    exclude = options.get("exclude_globs", [])
+    requested = set(filenames) if filenames is not None else None
+    recursive = options.get("recursive", False)
+    decode_once = options.get("decode_once", True)
+    stream_sources = False
+    if recursive:
+        index = {}
+        source_filenames = source_index.index_tree(
+            target_dir, index, include, exclude, skip_dirs=OUTPUT_DIRS,
+            workers=options.get("walk_workers", DEFAULT_WALK_WORKERS),
+        )
+        if requested is not None:
+            source_filenames = (filename for filename in source_filenames if filename in requested)
+        # Start processing while the tree is walked, unless the run has to be planned from the full listing
+        stream_sources = decode_once and not options.get("incremental", False)
+        if stream_sources:
+            iterate_options["stream_filenames"] = True
+        else:
+            source_filenames = sorted(source_filenames)
+    else:
+        index = source_index.index_directory(target_dir)
+        source_filenames = [
+            filename for filename in source_index.image_names(index)
+            if is_selected(filename, include, exclude) and (requested is None or filename in requested)
+        ]
+    source_index.activate(target_dir, index)
+
+    if options.get("instrumentation", False):
+        report_path = options.get("report_path") or os.path.join(target_dir, REPORT_FILENAME)
+        report_context = instrumentation.run_report(report_path)
+    else:
+        report_context = nullcontext()
+
+    try:
+        with report_context as report:
+            if decode_once:
+                errors = _process_pipeline_decode_once(
+                    target_dir, options, iterate_options, index, source_filenames,
+                    prune_deleted=filenames is None and not include and not exclude,
+                )
+            else:
+                errors = _process_pipeline_per_platform(target_dir, options, iterate_options, source_filenames)
+    finally:
+        if stream_sources:
+            source_filenames.close()  # Stops the tree walk if the run ended early
+        source_index.deactivate()
+
+    if report is not None:
+        report.write()
+        print(f"Run report written to '{report.path}'.")
+        print(report.format_table())
+        saved = report.cascade_saved_fraction()
+        if saved:
+            print(f"Resize cascade saved {saved:.0%} of the resample work.")
+
+    failures = [error for error in errors if error[1] != CANCELLED]
+    if cancel_event is not None and cancel_event.is_set():
+        print(f"Processing cancelled with {len(failures)} error(s).")
+    elif failures:
+        print(f"All processing completed with {len(failures)} error(s).")
+    else:
+        print("All processing completed.")
+    return errors
+
+
+def _process_pipeline_decode_once(target_dir, options, iterate_options, index, source_filenames, prune_deleted):
+    """
+    Decode each source image once, watermark it in memory and hand the same pixels
+    to every enabled platform. Writing the watermarks/ intermediate is optional.
+
+    With resize_cascade enabled, platforms run from the largest target size down and each
+    resize starts from the nearest larger platform's resize of the same image (see
+    resize_planner.ResizeCascade).
+
+    In incremental mode, a manifest in each output directory records the source content
+    hash and options each output was made from, so only new or changed sources (or
+    sources whose options changed) are regenerated, and outputs of deleted sources are
+    removed when prune_deleted is set.
+
+    index is target_dir's source index, and source_filenames are the images in it to process.
+    """
+    from image_processing import (
+        decode_image, draft_for_downscale, ensure_directory, iterate_directory, open_image, save_image,
+    )
+    from manifest import hash_options
+    from watermarking import load_watermark
+    watermark_output_dir = os.path.join(target_dir, "watermarks")
+    save_watermarked = bool(options["watermark_path"]) and options.get("save_watermarked_images", True)
+
+    if options["watermark_path"]:
+        print("Applying watermark in memory...")
+        original_watermark = load_watermark(options["watermark_path"])
+    else:
+        print("No watermark selected, skipping watermarking...")
+        original_watermark = None
+
+    watermark_settings = _watermark_settings(options, original_watermark)
+    render_settings = _render_settings(options)
+    outputs = []  # (output_dir, extension, options_hash) of every output, for the manifests
+    if save_watermarked:
+        outputs.append((watermark_output_dir, ".jpg", hash_options(
+            {"watermark": watermark_settings, "render": render_settings}
+        )))
+
+    platform_handlers = ordered_platform_handlers(options)
+    handlers = []
+    max_sizes = []
+    for platform, extension, handler, settings, max_size, passthrough_limits in platform_handlers:
+        output_dir = os.path.join(target_dir, platform)
+        print(f"Output for {platform} will be saved to '{output_dir}'.")
+        ensure_directory(output_dir)
+        handlers.append((platform, output_dir, extension, handler, passthrough_limits))
+        max_sizes.append(max_size)
+        outputs.append((output_dir, extension, hash_options(
+            {"platform": platform, "settings": settings, "watermark": watermark_settings, "render": render_settings}
+        )))
+
+    incremental = options.get("incremental", False)
+    if incremental:
+        pending, fingerprints, manifests = _plan_incremental_run(
+            target_dir, outputs, index, source_filenames, prune_deleted, options.get("recursive", False)
+        )
+    else:
+        pending, fingerprints = {}, {}
+
+    def process_source(input_path, output_path):
+        filename = os.path.relpath(input_path, target_dir)
+        file_root = os.path.splitext(filename)[0]
+
+        # Output directories to write; sources unknown to the plan get every output
+        output_dirs = pending.get(filename)
+        if output_dirs is None:
+            output_dirs = {output_dir for output_dir, _, _ in outputs}
+        elif not output_dirs:
+            return  # Everything is up to date, so skip decoding entirely
+
+        # Mirror a source in a subdirectory (recursive runs); iterate_directory creates the intermediate's
+        subdir = os.path.dirname(filename)
+        if subdir:
+            for _, output_dir, _, _, _ in handlers:
+                if output_dir in output_dirs:
+                    ensure_directory(os.path.join(output_dir, subdir))
+
+        with open_image(input_path) as img:
+            source_path = input_path
+
+            # Without a watermark, a source that every pending output passes through unchanged
+            # is only linked, judged from its header, so it is never decoded
+            passthrough_limits = [limits for _, output_dir, _, _, limits in handlers if output_dir in output_dirs]
+            if original_watermark is not None or not _passes_through(input_path, passthrough_limits):
+                # Unless the full-size watermarked image is saved, a JPEG only needs to be decoded
+                # as large as the largest platform output
+                if max_sizes and not save_watermarked:
+                    if draft_for_downscale(img, decode_size(img, max_sizes)) is not None:
+                        source_path = None  # The pixels no longer match the file
+
+                # Decode once; every handler below reuses these pixels
+                known_hash = fingerprints[filename]["hash"] if filename in fingerprints else None
+                img = decode_image(img, input_path, known_hash)
+
+            if original_watermark is not None:
+                img = watermark_source(img, original_watermark, options)
+                source_path = None
+                if save_watermarked:
+                    if watermark_output_dir in output_dirs:
+                        save_image(img, output_path, "JPEG", quality=100)
+                    source_path = output_path
+
+            output_paths = [
+                os.path.join(output_dir, file_root + extension) if output_dir in output_dirs else None
+                for _, output_dir, extension, _, _ in handlers
+            ]
+            run_platforms(img, platform_handlers, output_paths, source_path, options)
+
+    # Without the intermediate, output_path is unused, so don't create watermarks/.
+    # The intermediate is named like the platform outputs (.jpg), so iterate_directory
+    # also catches sources whose platform outputs would collide.
+    intermediate_dir = watermark_output_dir if save_watermarked else target_dir
+    errors = iterate_directory(
+        target_dir, intermediate_dir, process_source, preserve_file_type=False, filenames=source_filenames, **iterate_options
+    )
+
+    if incremental:
+        _save_incremental_run(target_dir, outputs, pending, fingerprints, manifests, errors)
+
+    return errors
+
+
+def _process_pipeline_per_platform(target_dir, options, iterate_options, source_filenames):
+    """
+    Watermark every image to disk, then run each platform scaler over the watermarked copy.
+
+    Watermarking and the platforms are stages of one scheduled batch on a shared worker
+    pool (see iterate_stages): an image's platform tasks start as soon as its watermarked
+    copy is written, rather than after the whole directory has been watermarked, and each
+    platform's pass no longer waits for the previous platform's. Only source_filenames (the
+    images in target_dir's source index) are processed. The streaming pipeline is not used.
+    """
+    from image_processing import Stage, iterate_stages
+    from watermarking import watermark_file_processor
     watermark_output_dir = os.path.join(target_dir, "watermarks")
     os.makedirs(watermark_output_dir, exist_ok=True)
 
     # Convert corner positions to a dictionary
     corner_positions_dict = {pos: True for pos in options["corner_watermark_positions"]}
 
+    stages = []
+
     # Skip watermarking if no watermark path is selected
     if options["watermark_path"]:
         print("Applying watermark...")
         print(f"Input directory: {target_dir}")
         print(f"Watermark output directory: {watermark_output_dir}")
-        print(f"Watermark options: {options}")
 
-        apply_watermark_to_directory(
-            input_dir=target_dir,
-            output_dir=watermark_output_dir,
+        stages.append(Stage("watermark", target_dir, watermark_output_dir, watermark_file_processor(
             watermark_path=options["watermark_path"],
             corner_positions=corner_positions_dict,  # Use the dictionary format
             corner_scale=options["corner_watermark_scale"],
@@ -91,44 +566,106 @@ def process_pipeline(target_dir, options):
             center_scale=options["center_watermark_scale"],
             center_transparency=options["center_watermark_transparency"],
             center_rotation=options["center_watermark_rotation"],
-        )
+        ), preserve_file_type=True, after=None))
 
+        # Watermarked copies keep their source's name
         processing_dir = watermark_output_dir
+        after = "watermark"
     else:
         print("No watermark selected, skipping watermarking...")
         processing_dir = target_dir  # If no watermark, just use the target directory
+        after = None
+
+    def add_platform(platform, process_function):
+        output_dir = os.path.join(target_dir, platform)
+        print(f"Output for {platform} will be saved to '{output_dir}'.")
+        stages.append(Stage(platform, processing_dir, output_dir, process_function, preserve_file_type=False, after=after))
 
     # Process for each platform
+    encoders = _encoders(options)
     if options["platforms"].get("facebook", False):
-        print("Processing for Facebook...")
-        facebook_output_dir = os.path.join(target_dir, "facebook")
-        process_images_for_facebook(processing_dir, facebook_output_dir)
+        from facebook_scaler import file_processor_for_facebook
+        add_platform("facebook", file_processor_for_facebook(encoders["facebook"]))
 
     if options["platforms"].get("instagram", False):
-        print("Processing for Instagram...")
-        instagram_output_dir = os.path.join(target_dir, "instagram")
-        process_images_for_aspect_ratio(
-            processing_dir, instagram_output_dir, options["instagram_aspect_ratio"]
-        )
+        from instagram_scaler import file_processor_for_aspect_ratio
+        add_platform("instagram", file_processor_for_aspect_ratio(options["instagram_aspect_ratio"], encoders["instagram"]))
 
     if options["platforms"].get("twitter", False):
-        print("Processing for Twitter...")
-        twitter_output_dir = os.path.join(target_dir, "twitter")
-        process_images_for_twitter(processing_dir, twitter_output_dir)
+        from twitter_scaler import file_processor_for_twitter
+        add_platform("twitter", file_processor_for_twitter(encoders["twitter"]))
 
     if options["platforms"].get("tiktok", False):
-        print("Processing for TikTok...")
-        tiktok_output_dir = os.path.join(target_dir, "tiktok")
-        process_images_for_tiktok(processing_dir, tiktok_output_dir)
+        from tiktok_scaler import file_processor_for_tiktok
+        add_platform("tiktok", file_processor_for_tiktok(encoders["tiktok"]))
 
     if options["platforms"].get("threads", False):
-        print("Processing for Threads...")
-        threads_output_dir = os.path.join(target_dir, "threads")
-        process_images_for_threads(processing_dir, threads_output_dir)
+        from threads_scaler import file_processor_for_threads
+        add_platform("threads", file_processor_for_threads(encoders["threads"]))
 
     if options["platforms"].get("bluesky", False):
-        print("Processing for Bluesky...")
-        bluesky_output_dir = os.path.join(target_dir, "bluesky")
-        process_images_for_bluesky(processing_dir, bluesky_output_dir)
+        from bluesky_scaler import file_processor_for_bluesky
+        add_platform("bluesky", file_processor_for_bluesky(encoder=encoders["bluesky"]))
+
+    print(f"Processing {len(source_filenames)} image(s) through {len(stages)} stage(s)...")
+    return iterate_stages(
+        stages, source_filenames, workers=iterate_options["workers"], progress=iterate_options["progress"],
+        cancel_event=iterate_options["cancel_event"],
+    )
+
+
+def measure_encoder_profiles(target_dir, options, sample_size=5, profiles=None):
+    """
+    Measure the encode time and output size of encoder profiles on a sample of the images in target_dir.
+
+    Every sampled image is decoded once and run through the enabled platforms (all of them
+    if none are enabled) with each profile. Outputs are kept in memory, so nothing is written.
+
+    Args:
+        target_dir (str): Directory holding the source images.
+        options (dict): Configuration, as returned by load_config.
+        sample_size (int): Number of images to sample, spread evenly over the directory.
+        profiles (list): Names of the profiles to measure. Defaults to every profile.
+
+    Returns:
+        dict: For every profile, {platform: {"files", "encode_seconds", "bytes"}}.
+    """
+    from image_processing import capture_outputs, open_image
+    import instrumentation
+    import source_index
+    filenames = source_index.image_names(source_index.index_directory(target_dir))
+    step = max(1, len(filenames) / sample_size) if filenames else 1
+    sample = [filenames[int(position * step)] for position in range(min(sample_size, len(filenames)))]
+
+    images = []
+    for filename in sample:
+        try:
+            with open_image(os.path.join(target_dir, filename)) as img:
+                img.load()
+                images.append((filename, img.copy()))
+        except (OSError, ValueError) as e:
+            print(f"Skipping '{filename}' in the encoder measurement: {e}")
+    print(f"Measuring encoder profiles on {len(images)} image(s) from '{target_dir}'...")
+
+    platforms = options["platforms"]
+    if not any(platforms.values()):
+        platforms = {platform: True for platform in platforms}
 
-    print("All processing completed.")
+    results = {}
+    for name in profiles or profile_names(options.get("encoder_profiles")):
+        handlers = _platform_handlers({**options, "platforms": platforms, "encoder_profile": name})
+        with instrumentation.run_report() as report:
+            for filename, img in images:
+                file_root = os.path.splitext(filename)[0]
+                with instrumentation.record_file(filename, os.path.join(target_dir, name, filename)) as record:
+                    with capture_outputs():
+                        for platform, output_extension, handler, _, _, _ in handlers:
+                            with instrumentation.platform(platform):
+                                # No source path, so every output is encoded rather than copied
+                                handler(img, os.path.join(target_dir, platform, file_root + output_extension), None)
+                instrumentation.collect(record)
+        results[name] = {
+            platform: {"files": row["files"], "encode_seconds": row["stages"].get("encode", 0.0), "bytes": row["bytes_out"]}
+            for platform, row in report.summary().items()
+        }
+    return results
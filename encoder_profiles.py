@@ -0,0 +1,118 @@
+"""
+Encoder profiles: how each platform's output is encoded, trading encode speed against output size.
+
+A profile maps every platform to its encoder settings: the Pillow format ("JPEG" or
+"WEBP") plus its save options (quality, subsampling, progressive, optimize, method).
+"passthrough" lets platforms that only need to shrink large images copy a source JPEG
+that already fits, instead of re-encoding it. For Bluesky, quality is the highest quality
+its file size search starts from.
+
+Profiles in the configuration's "encoder_profiles" are merged over the built-in ones, so
+a custom profile only needs the settings it changes, e.g.
+{"smallest": {"twitter": {"quality": 80}}} or {"mine": {"facebook": {"format": "WEBP"}}}.
+"""
+
+DEFAULT_PROFILE = "default"
+
+# Platforms a profile has settings for
+PLATFORMS = ("facebook", "instagram", "twitter", "tiktok", "threads", "bluesky")
+
+# Output file extension of every supported format
+EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp", "PNG": ".png"}
+
+# Encoder settings of JPEG outputs before profiles existed
+DEFAULT_JPEG = {"format": "JPEG", "quality": 100, "passthrough": True}
+_FAST_JPEG = {"format": "JPEG", "quality": 90, "subsampling": "4:2:0", "optimize": False, "progressive": False, "passthrough": True}
+_BALANCED_JPEG = {"format": "JPEG", "quality": 90, "subsampling": "4:2:0", "optimize": True, "progressive": False, "passthrough": False}
+_SMALLEST_JPEG = {"format": "JPEG", "quality": 85, "subsampling": "4:2:0", "optimize": True, "progressive": True, "passthrough": False}
+
+PROFILES = {
+    # The settings used before profiles existed: maximum quality, source JPEGs copied when they fit
+    "default": {
+        "facebook": DEFAULT_JPEG,
+        "instagram": DEFAULT_JPEG,
+        "twitter": DEFAULT_JPEG,
+        "tiktok": {"format": "WEBP", "quality": 100},
+        "threads": DEFAULT_JPEG,
+        "bluesky": {"format": "WEBP", "quality": 100, "method": 6},
+    },
+    # Cheapest encoder settings; the platforms recompress uploads anyway
+    "fast": {
+        "facebook": _FAST_JPEG,
+        "instagram": _FAST_JPEG,
+        "twitter": _FAST_JPEG,
+        "tiktok": {"format": "WEBP", "quality": 90, "method": 0},
+        "threads": _FAST_JPEG,
+        "bluesky": {"format": "WEBP", "quality": 90, "method": 0},
+    },
+    # Near-default visual quality at a fraction of the size, with optimized Huffman tables
+    "balanced": {
+        "facebook": _BALANCED_JPEG,
+        "instagram": _BALANCED_JPEG,
+        "twitter": _BALANCED_JPEG,
+        "tiktok": {"format": "WEBP", "quality": 90, "method": 4},
+        "threads": _BALANCED_JPEG,
+        "bluesky": {"format": "WEBP", "quality": 90, "method": 4},
+    },
+    # Smallest files, at the slowest encoder settings
+    "smallest": {
+        "facebook": _SMALLEST_JPEG,
+        "instagram": _SMALLEST_JPEG,
+        "twitter": _SMALLEST_JPEG,
+        "tiktok": {"format": "WEBP", "quality": 80, "method": 6},
+        "threads": _SMALLEST_JPEG,
+        "bluesky": {"format": "WEBP", "quality": 85, "method": 6},
+    },
+}
+
+
+def profile_names(custom_profiles=None):
+    """Return the names of the built-in profiles followed by those only defined in custom_profiles."""
+    names = list(PROFILES)
+    names += [name for name in (custom_profiles or {}) if name not in PROFILES]
+    return names
+
+
+def resolve_profile(name, custom_profiles=None):
+    """
+    Look up the encoder settings of every platform in a profile.
+
+    Args:
+        name (str): Profile name, built-in or from custom_profiles.
+        custom_profiles (dict): Profiles from the configuration, merged over the built-in
+            ones. Platforms and settings a custom profile leaves out come from the built-in
+            profile of the same name, or from the default profile.
+
+    Returns:
+        dict: Encoder settings keyed by platform.
+
+    Raises:
+        ValueError: If the profile does not exist or uses an unsupported format.
+    """
+    custom_profiles = custom_profiles or {}
+    if name not in PROFILES and name not in custom_profiles:
+        raise ValueError(f"Unknown encoder profile '{name}'. Choose from {', '.join(profile_names(custom_profiles))}.")
+
+    base = PROFILES.get(name, PROFILES[DEFAULT_PROFILE])
+    custom = custom_profiles.get(name, {})
+    encoders = {}
+    for platform in PLATFORMS:
+        encoder = {**base[platform], **custom.get(platform, {})}
+        encoder["format"] = encoder["format"].upper()
+        if encoder["format"] not in EXTENSIONS:
+            raise ValueError(
+                f"Unsupported format '{encoder['format']}' for {platform} in encoder profile '{name}'. "
+                f"Choose from {', '.join(EXTENSIONS)}."
+            )
+        encoders[platform] = encoder
+    return encoders
+
+
+def extension(encoder):
+    """Return the output file extension for an encoder's format, e.g. ".jpg"."""
+    return EXTENSIONS[encoder["format"]]
+
+
+def save_options(encoder):
+    """Return the keyword arguments for image_processing.save_image (format included)."""
+    return {key: value for key, value in encoder.items() if key != "passthrough"}
@@ -0,0 +1,277 @@
+"""
+Resampling and encoding backends: the engine behind every LANCZOS resize and every encode.
+
+"pillow" is the default and the reference. "pyvips" (libvips) and "opencv" are used when
+their packages are installed; a run that selects one that is missing falls back to Pillow
+with a message. Their packages are only imported when the backend is selected, so runs
+with Pillow don't pay for loading them. Backends take and return PIL images, so decoding,
+drafts, watermarking and the resize cascade work the same with all of them.
+
+Images in modes a backend can't handle as they are (anything but RGB and L, e.g. RGBA
+watermarks, which Pillow resamples with premultiplied alpha), resizes of a fractional
+region (some reduced-scale JPEG decodes), and save options a backend has no equivalent
+for are handed to Pillow, so every backend produces every output.
+
+benchmark.py checks a backend's resizes and encodes against Pillow's (check-backend).
+"""
+import importlib.util
+import io
+from PIL import Image
+
+# Packages of the optional backends, imported when one is created (see create_backend)
+pyvips = None
+cv2 = None
+numpy = None
+
+DEFAULT_BACKEND = "pillow"
+
+# Pillow downscales shrink by a whole factor first while the result stays at least this many
+# times the target size (see image_processing.reduce_for_resize). Pillow documents 3.0 as
+# indistinguishable from a single LANCZOS resize in most cases.
+DEFAULT_REDUCING_GAP = 3.0
+
+# Modes the optional backends resize and encode themselves
+NATIVE_MODES = ("RGB", "L")
+
+
+class PillowBackend:
+    """The reference backend: Pillow's reduce-then-LANCZOS (in bands under a memory budget) and Image.save."""
+
+    name = "pillow"
+    reducing_gap = DEFAULT_REDUCING_GAP
+
+    def resize(self, img, size, box=None):
+        # Imported here, as image_processing resizes through this module
+        from image_processing import lanczos_resize
+        return lanczos_resize(img, size, box=box, reducing_gap=self.reducing_gap)
+
+    def encode(self, img, format, **save_options):
+        buffer = io.BytesIO()
+        img.save(buffer, format=format, **save_options)
+        return buffer.getvalue()
+
+
+_pillow = PillowBackend()
+
+
+def _whole_pixel_box(img, box):
+    """Return box as integers if it lies on pixel boundaries (None meaning the whole image), else None."""
+    if box is None:
+        return (0, 0, img.width, img.height)
+    if all(float(side).is_integer() for side in box):
+        return tuple(int(side) for side in box)
+    return None
+
+
+def _jpeg_subsampling(save_options):
+    """Return the save_options' chroma subsampling as "4:2:0" or "4:4:4", or None for other settings."""
+    subsampling = save_options.get("subsampling", "4:2:0")  # Pillow's (libjpeg's) default
+    return {"4:2:0": "4:2:0", 2: "4:2:0", "4:4:4": "4:4:4", 0: "4:4:4"}.get(subsampling)
+
+
+class PyvipsBackend:
+    """
+    libvips: demand-driven, multithreaded LANCZOS3 resizes and libjpeg/libwebp encodes.
+
+    Large reductions shrink by whole factors first, as libvips always does, so results
+    differ slightly from Pillow's. Upscales (only ever of small images here) are left to
+    Pillow, as libvips aligns upsampled pixels differently.
+
+    Images arrive decoded by Pillow (drafted, watermarked), so their pixels are copied
+    into libvips once per call; libvips' own demand-driven loading from files is not used.
+    """
+
+    name = "pyvips"
+    JPEG_OPTIONS = ("quality", "optimize", "progressive", "subsampling")
+    WEBP_OPTIONS = ("quality", "method", "lossless")
+
+    def __init__(self):
+        pyvips.cache_set_max(0)  # Every image is new, so cached operations are never reused
+
+    @staticmethod
+    def _to_vips(img):
+        return pyvips.Image.new_from_memory(img.tobytes(), img.width, img.height, len(img.getbands()), "uchar")
+
+    def resize(self, img, size, box=None):
+        whole_box = _whole_pixel_box(img, box)
+        if img.mode not in NATIVE_MODES or whole_box is None:
+            return _pillow.resize(img, size, box)
+        if size[0] > whole_box[2] - whole_box[0] or size[1] > whole_box[3] - whole_box[1]:
+            return _pillow.resize(img, size, box)
+        box = whole_box
+
+        region = self._to_vips(img)
+        if box != (0, 0, img.width, img.height):
+            region = region.crop(box[0], box[1], box[2] - box[0], box[3] - box[1])
+        resized = region.resize(size[0] / region.width, vscale=size[1] / region.height, kernel="lanczos3")
+        if (resized.width, resized.height) != tuple(size):
+            return _pillow.resize(img, size, box)  # libvips rounded the size differently
+        return Image.frombytes(img.mode, size, resized.write_to_memory())
+
+    def encode(self, img, format, **save_options):
+        if img.mode not in NATIVE_MODES:
+            return _pillow.encode(img, format, **save_options)
+
+        if format == "JPEG" and set(save_options) <= set(self.JPEG_OPTIONS) and _jpeg_subsampling(save_options):
+            return self._to_vips(img).jpegsave_buffer(
+                Q=save_options.get("quality", 75),
+                optimize_coding=bool(save_options.get("optimize", False)),
+                interlace=bool(save_options.get("progressive", False)),
+                subsample_mode="on" if _jpeg_subsampling(save_options) == "4:2:0" else "off",
+            )
+        if format == "WEBP" and set(save_options) <= set(self.WEBP_OPTIONS):
+            return self._to_vips(img).webpsave_buffer(
+                Q=save_options.get("quality", 80),
+                effort=save_options.get("method", 4),
+                lossless=bool(save_options.get("lossless", False)),
+            )
+        return _pillow.encode(img, format, **save_options)
+
+
+class OpenCVBackend:
+    """
+    OpenCV: SIMD resizes and encodes on numpy views of the pixels.
+
+    OpenCV's LANCZOS4 doesn't widen its kernel when shrinking, so it would alias on the
+    large reductions this pipeline makes; downscales use INTER_AREA instead and other
+    resizes INTER_LANCZOS4. OpenCV has no WebP effort setting, so "method" is ignored.
+    """
+
+    name = "opencv"
+    JPEG_OPTIONS = ("quality", "optimize", "progressive", "subsampling")
+    WEBP_OPTIONS = ("quality", "method", "lossless")
+
+    def resize(self, img, size, box=None):
+        whole_box = _whole_pixel_box(img, box)
+        if img.mode not in NATIVE_MODES or whole_box is None:
+            return _pillow.resize(img, size, box)
+        box = whole_box
+
+        region = numpy.asarray(img)[box[1]:box[3], box[0]:box[2]]
+        shrinking = size[0] <= region.shape[1] and size[1] <= region.shape[0]
+        interpolation = cv2.INTER_AREA if shrinking else cv2.INTER_LANCZOS4
+        return Image.fromarray(cv2.resize(region, tuple(size), interpolation=interpolation), img.mode)
+
+    def encode(self, img, format, **save_options):
+        if img.mode not in NATIVE_MODES:
+            return _pillow.encode(img, format, **save_options)
+
+        if format == "JPEG" and set(save_options) <= set(self.JPEG_OPTIONS) and _jpeg_subsampling(save_options):
+            sampling = cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420
+            if _jpeg_subsampling(save_options) == "4:4:4":
+                sampling = cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444
+            extension, params = ".jpg", [
+                cv2.IMWRITE_JPEG_QUALITY, save_options.get("quality", 75),
+                cv2.IMWRITE_JPEG_OPTIMIZE, int(bool(save_options.get("optimize", False))),
+                cv2.IMWRITE_JPEG_PROGRESSIVE, int(bool(save_options.get("progressive", False))),
+                cv2.IMWRITE_JPEG_SAMPLING_FACTOR, sampling,
+            ]
+        elif format == "WEBP" and set(save_options) <= set(self.WEBP_OPTIONS):
+            # Qualities above 100 select lossless
+            quality = 101 if save_options.get("lossless", False) else save_options.get("quality", 80)
+            extension, params = ".webp", [cv2.IMWRITE_WEBP_QUALITY, quality]
+        else:
+            return _pillow.encode(img, format, **save_options)
+
+        pixels = numpy.asarray(img)
+        if img.mode == "RGB":
+            pixels = cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR)
+        ok, data = cv2.imencode(extension, pixels, params)
+        if not ok:
+            raise OSError(f"OpenCV could not encode {format}")
+        return data.tobytes()
+
+
+# Backend classes by name, in order of preference for the optional ones
+BACKENDS = {"pillow": PillowBackend, "pyvips": PyvipsBackend, "opencv": OpenCVBackend}
+
+# Backend of this process and the workers it forks afterwards (see configure)
+_backend = _pillow
+
+
+def _installed(module):
+    return importlib.util.find_spec(module) is not None
+
+
+def available_backends():
+    """Return the names of the backends whose packages are installed, without importing them."""
+    installed = {"pillow": True, "pyvips": _installed("pyvips"), "opencv": _installed("cv2") and _installed("numpy")}
+    return [name for name in BACKENDS if installed[name]]
+
+
+def _import_packages(name):
+    """Import the packages of an optional backend into this module."""
+    global pyvips, cv2, numpy
+    if name == "pyvips" and pyvips is None:
+        try:
+            import pyvips as vips
+        except OSError as e:  # The package is installed, but libvips is not
+            raise ImportError(f"The pyvips backend needs libvips, which could not be loaded ({e}).") from e
+        pyvips = vips
+    elif name == "opencv" and cv2 is None:
+        import cv2 as opencv
+        import numpy as np
+        cv2, numpy = opencv, np
+
+
+def create_backend(name):
+    """
+    Create a backend by name.
+
+    Raises:
+        ValueError: If there is no such backend.
+        ImportError: If its package is not installed, or cannot be loaded.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}'. Choose from {', '.join(BACKENDS)}.")
+    if name not in available_backends():
+        raise ImportError(f"The {name} backend needs the '{name}' package, which is not installed.")
+    if name == "pillow":
+        return _pillow
+    _import_packages(name)
+    return BACKENDS[name]()
+
+
+def configure(name=DEFAULT_BACKEND, reducing_gap=DEFAULT_REDUCING_GAP):
+    """
+    Select the backend of this process and the worker processes it forks afterwards.
+
+    A backend whose package is missing falls back to Pillow.
+
+    Args:
+        name (str): Backend to use.
+        reducing_gap (float): Margin of Pillow's whole-factor reduction before LANCZOS
+            (see image_processing.reduce_for_resize); 0 resizes with LANCZOS alone. Other
+            backends hand some resizes to Pillow, which uses it too.
+
+    Returns:
+        str: Name of the backend in use.
+
+    Raises:
+        ValueError: If there is no such backend, or reducing_gap is below 1 but not 0.
+    """
+    global _backend
+    if reducing_gap and reducing_gap < 1:
+        raise ValueError(f"The reducing gap must be 0 (off) or at least 1, not {reducing_gap}.")
+    _pillow.reducing_gap = reducing_gap
+    try:
+        _backend = create_backend(name)
+    except ImportError as e:
+        print(f"{e} Using the pillow backend instead.")
+        _backend = _pillow
+    return _backend.name
+
+
+def selected_backend():
+    """Return the name of the backend in use, after any fallback to Pillow."""
+    return _backend.name
+
+
+def resize(img, size, box=None):
+    """Resize img (or its box region) to size with the selected backend's LANCZOS equivalent."""
+    return _backend.resize(img, size, box)
+
+
+def encode(img, format, **save_options):
+    """Encode img with the selected backend, taking Pillow's save options, and return the bytes."""
+    return _backend.encode(img, format, **save_options)
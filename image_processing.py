@@ -1,5 +1,53 @@
+import heapq
+import io
+import math
 import os
-from PIL import Image
+import multiprocessing
+import queue
+import threading
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager, nullcontext
+from functools import partial
+from PIL import Image, UnidentifiedImageError
+from encoder_profiles import DEFAULT_JPEG, save_options
+import image_backends
+import instrumentation
+import memory_budget
+import passthrough
+import pixel_cache
+import source_index
+from resize_planner import active_cascade
+
+# Process function of the current worker process, installed by _init_worker
+_worker_function = None
+
+# Whether worker pools fork processes where the platform can (see use_worker_processes)
+_fork_workers = True
+
+# Input bytes and output sink of the streaming task running on the current thread
+_io_state = threading.local()
+
+# Error message of files skipped because the batch was cancelled
+CANCELLED = "Cancelled"
+
+# A reduced JPEG decode is never smaller than the final size times this margin
+DRAFT_MARGIN = 1.0
+
+# Modes Pillow resamples with LANCZOS and that can be pasted band by band
+_BANDED_MODES = ("RGB", "RGBA", "RGBX", "L", "LA", "CMYK")
+
+# Modes box-reduced before a LANCZOS downscale. Pillow resamples alpha modes premultiplied,
+# which Image.reduce doesn't, so they are left out.
+_REDUCED_MODES = ("RGB", "RGBX", "L", "CMYK")
+
+# LANCZOS reaches this many target pixels to either side
+LANCZOS_SUPPORT = 3
+
+# One pass of iterate_stages: process_function runs on every file in input_dir, writing to
+# output_dir as in iterate_directory. after is the name of the stage whose output for the
+# same file this stage reads (input_dir being that stage's output_dir), or None.
+Stage = namedtuple("Stage", "name input_dir output_dir process_function preserve_file_type after")
 
 
 def ensure_directory(directory):
@@ -10,30 +58,961 @@ def ensure_directory(directory):
         os.makedirs(directory)
 
 
-def iterate_directory(input_dir, output_dir, process_function, preserve_file_type=True):
+def open_image(input_path):
+    """
+    Open an image, from the bytes prefetched by the streaming pipeline when they are available.
+
+    Images over the memory budget are decoded straight away at reduced size
+    (see memory_budget.reduce_to_budget).
+
+    Args:
+        input_path (str): Path to the image.
+
+    Returns:
+        PIL.Image.Image: The opened image, not decoded yet unless it was reduced.
+    """
+    prefetched = getattr(_io_state, "prefetched", None)
+    if prefetched is not None and prefetched[0] == input_path:
+        instrumentation.add_bytes_in(len(prefetched[1]))
+        return open_image_data(prefetched[1], input_path)
+
+    if instrumentation.recording():
+        instrumentation.add_bytes_in(os.path.getsize(input_path))
+    return _within_budget(Image.open(input_path))
+
+
+def open_image_data(data, name):
+    """
+    Open an image from its encoded bytes, as open_image opens a file.
+
+    Args:
+        data (bytes): Encoded image.
+        name (str): Name of the image in error messages, e.g. its path.
+
+    Returns:
+        PIL.Image.Image: The opened image, not decoded yet unless it was reduced.
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+    except UnidentifiedImageError:
+        # Name the file, as opening it from disk would
+        raise UnidentifiedImageError(f"cannot identify image file {name!r}") from None
+    return _within_budget(img)
+
+
+def _within_budget(img):
+    """Decode an opened image at reduced size straight away if it is over the memory budget."""
+    if memory_budget.is_large(img.size):
+        with instrumentation.stage("decode"):
+            return memory_budget.reduce_to_budget(img)
+    return img
+
+
+def decode_image(img, input_path, content_hash=None):
+    """
+    Decode an opened image, mapping its pixels from the decoded-pixel cache when they are there.
+
+    Args:
+        img (PIL.Image.Image): Image from open_image, drafted to its decode size if needed.
+        input_path (str): Path it was opened from.
+        content_hash (str): SHA-256 of the file, if already known.
+
+    Returns:
+        PIL.Image.Image: The decoded image: img itself, or the cached pixels in its place.
+    """
+    prefetched = getattr(_io_state, "prefetched", None)
+    data = prefetched[1] if prefetched is not None and prefetched[0] == input_path else None
+    with instrumentation.stage("decode"):
+        return pixel_cache.decode(img, input_path, data, content_hash)
+
+
+def _replace_file(output_path, write):
+    """
+    Create output_path through a hidden temporary file in the same directory.
+
+    The temporary file is moved over output_path only once write(temp_path) has
+    completed, so an interrupted run never leaves a truncated output behind.
+    """
+    directory, filename = os.path.split(output_path)
+    temp_path = os.path.join(directory, f".{filename}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        write(temp_path)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _write_bytes(output_path, data):
+    """Write bytes to output_path atomically."""
+    def write(temp_path):
+        with open(temp_path, "wb") as file:
+            file.write(data)
+
+    with instrumentation.stage("write"):
+        _replace_file(output_path, write)
+
+
+def write_output(output_path, data):
+    """
+    Write encoded output bytes to output_path, atomically.
+
+    Inside a streaming task the bytes are handed to the write-behind stage instead, and
+    inside capture_outputs they are only kept in memory.
+    """
+    instrumentation.add_bytes_out(len(data))
+    outputs = getattr(_io_state, "outputs", None)
+    if outputs is not None:
+        outputs[output_path] = data
+        return
+    _write_bytes(output_path, data)
+
+
+def save_image(img, output_path, format, **save_options):
+    """Encode an image and write it to output_path (see write_output)."""
+    write_output(output_path, encode_image(img, format, **save_options))
+
+
+def copy_file(input_path, output_path):
+    """
+    Copy a file unchanged to output_path, as a link to it where possible (see passthrough.link_file).
+
+    An output that already holds the file, from an earlier run, is left as it is. Inside a
+    streaming task the source may be an output the task has not written yet, which is
+    copied from memory, and inside capture_outputs the copy is only kept in memory.
+    """
+    outputs = getattr(_io_state, "outputs", None)
+    # Streaming tasks always have prefetched input; capture_outputs has none
+    if outputs is not None and (input_path in outputs or getattr(_io_state, "prefetched", None) is None):
+        if input_path in outputs:
+            data = outputs[input_path]
+        else:
+            with open(input_path, "rb") as file:
+                data = file.read()
+        write_output(output_path, data)
+        return
+
+    if instrumentation.recording():
+        instrumentation.add_bytes_out(os.path.getsize(input_path))
+    if passthrough.is_up_to_date(input_path, output_path):
+        return
+    with instrumentation.stage("write"):
+        _replace_file(output_path, partial(passthrough.link_file, input_path))
+
+
+def probe_file(path):
+    """
+    Read the header facts of an image file without decoding it.
+
+    Sources in the run's index (see source_index) are looked up there. Inside a streaming
+    task, outputs not written yet and the prefetched input are read from memory.
+
+    Returns:
+        tuple: (format, (width, height), mode, size in bytes).
+    """
+    entry = source_index.lookup(path)
+    if entry is not None:
+        return entry["format"], (entry["width"], entry["height"]), entry["mode"], entry["size"]
+
+    outputs = getattr(_io_state, "outputs", None) or {}
+    prefetched = getattr(_io_state, "prefetched", None)
+    if path in outputs:
+        data = outputs[path]
+    elif prefetched is not None and prefetched[0] == path:
+        data = prefetched[1]
+    else:
+        with Image.open(path) as img:
+            return img.format, img.size, img.mode, os.path.getsize(path)
+    with Image.open(io.BytesIO(data)) as img:
+        return img.format, img.size, img.mode, len(data)
+
+
+@contextmanager
+def capture_outputs():
+    """
+    Keep everything written on this thread inside the block in memory instead of on disk.
+
+    Yields:
+        dict: Encoded bytes keyed by output path, filled in as the block runs.
+    """
+    previous = getattr(_io_state, "outputs", None)
+    _io_state.outputs = {}
+    try:
+        yield _io_state.outputs
+    finally:
+        _io_state.outputs = previous
+
+
+def _init_worker(process_function):
+    """Install the process function in a freshly started worker process."""
+    global _worker_function
+    _worker_function = process_function
+
+
+def _large_image_slot(input_path):
+    """
+    Wait for a large image slot if input_path is over the memory budget (see memory_budget.large_image_slot).
+
+    Only the image header is read. Files that cannot be opened are left for the process
+    function to report.
+    """
+    if not memory_budget.limits_large_images():
+        return nullcontext()
+    try:
+        _, size, _, _ = probe_file(input_path)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return nullcontext()
+    return memory_budget.large_image_slot(size)
+
+
+def _run_process_function(process_function, input_path, output_path):
+    """
+    Run process_function on one file, returning its error message instead of raising.
+
+    Returns:
+        tuple: (input_path, error message or None, instrumentation record or None).
+    """
+    with _large_image_slot(input_path), instrumentation.record_file(input_path, output_path) as record:
+        try:
+            process_function(input_path, output_path)
+        except Exception as e:
+            return input_path, f"{type(e).__name__}: {e}", record
+    return input_path, None, record
+
+
+def _run_worker_task(task):
+    """Run the installed process function on one (input_path, output_path) task."""
+    return _run_process_function(_worker_function, *task)
+
+
+def _run_chunk(run_task, chunk):
+    """Run a worker's run_task on every task of a chunk, returning their results in order."""
+    return [run_task(task) for task in chunk]
+
+
+def _run_task_with(process_function, task):
+    """Run process_function on one (input_path, output_path) task."""
+    return _run_process_function(process_function, *task)
+
+
+def _run_streaming_function(process_function, input_path, output_path, data):
+    """
+    Run process_function on prefetched input bytes and collect its outputs in memory.
+
+    Returns:
+        tuple: (input_path, error message or None, instrumentation record or None,
+        list of (output_path, bytes)).
+    """
+    _io_state.prefetched = (input_path, data)
+    _io_state.outputs = {}
+    try:
+        input_path, error, record = _run_process_function(process_function, input_path, output_path)
+        outputs = list(_io_state.outputs.items())
+    finally:
+        _io_state.prefetched = None
+        _io_state.outputs = None
+    return input_path, error, record, outputs
+
+
+def _run_streaming_worker_task(task):
+    """Run the installed process function on one (input_path, output_path, data) task."""
+    return _run_streaming_function(_worker_function, *task)
+
+
+def _run_streaming_task_with(process_function, task):
+    """Run process_function on one (input_path, output_path, data) task."""
+    return _run_streaming_function(process_function, *task)
+
+
+def _run_stage_task(task):
+    """Run one (stage index, input_path, output_path) task of iterate_stages in a worker process."""
+    return _run_stage_task_with(_worker_function, task)
+
+
+def _run_stage_task_with(process_functions, task):
+    stage_index, input_path, output_path = task
+    return _run_process_function(process_functions[stage_index], input_path, output_path)
+
+
+def use_worker_processes(enabled=True):
+    """
+    Choose whether the worker pools of this process fork worker processes or run threads.
+
+    Forking a process that runs a GUI toolkit is unsafe: each worker gets a copy of the
+    toolkit's state and of any lock another thread holds at that moment, and a spawned
+    worker cannot take over the process functions, which are closures. A GUI therefore
+    calls use_worker_processes(False) before its first batch; Pillow releases the GIL
+    while decoding, resizing and encoding, so threads still keep every core busy for
+    most of the work.
+
+    Args:
+        enabled (bool): Fork worker processes where the platform supports fork.
+    """
+    global _fork_workers
+    _fork_workers = enabled
+
+
+def _create_executor(workers, process_function, streaming=False, staged=False):
+    """
+    Create a pool of workers able to run process_function.
+
+    With streaming, tasks are (input_path, output_path, data) and return their outputs
+    instead of writing them (see _run_streaming_function). With staged, process_function
+    is a list of process functions and tasks are (index into it, input_path, output_path).
+
+    Process functions are usually closures, which cannot be pickled, so worker processes
+    inherit them by forking. Where fork is unavailable (Windows), or worker processes are
+    turned off (see use_worker_processes), a thread pool is used instead; Pillow releases
+    the GIL while decoding, resizing and encoding.
+    """
+    if _fork_workers and "fork" in multiprocessing.get_all_start_methods():
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(process_function,),
+        )
+        # Fork every worker now, before the caller starts threads (a tree walk, the streaming
+        # reader): a process forked while another thread holds a lock inherits it locked
+        executor.submit(int).result()
+        if streaming:
+            return executor, _run_streaming_worker_task
+        return executor, _run_stage_task if staged else _run_worker_task
+
+    if streaming:
+        run_task_with = _run_streaming_task_with
+    else:
+        run_task_with = _run_stage_task_with if staged else _run_task_with
+    return ThreadPoolExecutor(max_workers=workers), partial(run_task_with, process_function)
+
+
+class QueueDepths:
+    """Record how full a pipeline stage's queue is each time an item is handed over."""
+
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self.samples = 0
+        self.total = 0
+        self.peak = 0
+
+    def sample(self, depth):
+        self.samples += 1
+        self.total += depth
+        self.peak = max(self.peak, depth)
+
+    def summary(self):
+        average = self.total / self.samples if self.samples else 0.0
+        return f"{self.name} queue avg {average:.1f}, peak {self.peak} of {self.maxsize}"
+
+
+def _iterate_streaming(tasks, process_function, workers, prefetch, write_behind, report_done, is_cancelled):
+    """
+    Run tasks through a bounded read -> process -> write pipeline.
+
+    A reader thread prefetches input files in order into a queue of at most prefetch files.
+    Up to two tasks per worker are decoded, processed and encoded at a time, and their
+    encoded outputs go to a write-behind thread through a queue of at most write_behind
+    outputs. Every stage blocks when the next one falls behind, so memory stays bounded
+    however many files there are, while disk reads and writes overlap with the CPU work.
+
+    report_done is called after each processed task. Once is_cancelled() returns True, no
+    more files are read or started; tasks already started are finished and written.
+
+    Returns:
+        tuple: (results, depths). results holds (input_path, error message or None) per
+        started task, and depths a QueueDepths for the read and write queues.
+    """
+    read_queue = queue.Queue(maxsize=prefetch)
+    write_queue = queue.Queue(maxsize=write_behind)
+    read_depths = QueueDepths("read", prefetch)
+    write_depths = QueueDepths("write", write_behind)
+    results = []
+    write_errors = {}
+    stop = threading.Event()
+
+    def read_files():
+        for input_path, output_path in tasks:
+            if stop.is_set():
+                break
+            try:
+                with open(input_path, "rb") as file:
+                    data = file.read()
+            except OSError as e:
+                data = e
+            read_queue.put((input_path, output_path, data))
+        read_queue.put(None)
+
+    def write_files():
+        while True:
+            item = write_queue.get()
+            if item is None:
+                break
+            input_path, output_path, data = item
+            try:
+                _write_bytes(output_path, data)
+            except OSError as e:
+                write_errors.setdefault(input_path, f"{type(e).__name__}: {e}")
+
+    executor, run_task = _create_executor(workers, process_function, streaming=True)
+    reader = threading.Thread(target=read_files, name="image-reader", daemon=True)
+    writer = threading.Thread(target=write_files, name="image-writer", daemon=True)
+    reader.start()
+    writer.start()
+
+    try:
+        with executor:
+            in_flight = set()
+            reading = True
+            while reading or in_flight:
+                if reading and is_cancelled():
+                    reading = False
+                    stop.set()
+
+                # Keep every worker busy with one task queued behind it
+                while reading and len(in_flight) < workers * 2:
+                    item = read_queue.get()
+                    read_depths.sample(read_queue.qsize())
+                    if item is None:
+                        reading = False
+                    elif isinstance(item[2], OSError):
+                        results.append((item[0], f"{type(item[2]).__name__}: {item[2]}"))
+                        report_done()
+                    else:
+                        in_flight.add(executor.submit(run_task, item))
+
+                if not in_flight:
+                    continue
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    input_path, error, record, outputs = future.result()
+                    instrumentation.collect(record)
+                    results.append((input_path, error))
+                    for output_path, data in outputs:
+                        write_queue.put((input_path, output_path, data))
+                        write_depths.sample(write_queue.qsize())
+                    report_done()
+    finally:
+        stop.set()
+        # Unblock the reader if it is waiting on a full queue, then drain the writer
+        while reader.is_alive():
+            try:
+                read_queue.get_nowait()
+            except queue.Empty:
+                reader.join(0.01)
+        write_queue.put(None)
+        writer.join()
+
+    results = [
+        (input_path, error or write_errors.get(input_path))
+        for input_path, error in sorted(results)
+    ]
+    return results, (read_depths, write_depths)
+
+
+def _claim_output(input_path, output_dir, filename, preserve_file_type, claimed_outputs, output_subdirs, errors):
+    """
+    Work out the output path of input_path (filename in its directory), creating its subdirectory if needed.
+
+    Args:
+        claimed_outputs (dict): Filename each output path is written from so far; updated.
+        output_subdirs (set): Subdirectories of output_dir created so far; updated.
+        errors (list): Gets an error if another file already writes the same output.
+
+    Returns:
+        str: The output path, or None if the file must be skipped.
+    """
+    file_root, file_ext = os.path.splitext(filename)
+    if preserve_file_type:
+        output_filename = f"{file_root}{file_ext}"
+    else:
+        output_filename = f"{file_root}.jpg"
+
+    output_path = os.path.join(output_dir, output_filename)
+    if output_path in claimed_outputs:
+        if claimed_outputs[output_path] != filename:
+            errors.append((input_path, f"Output '{output_filename}' is already written from '{claimed_outputs[output_path]}'"))
+        return None
+    claimed_outputs[output_path] = filename
+
+    # Mirror the source's subdirectory under output_dir
+    output_subdir = os.path.dirname(output_filename)
+    if output_subdir and output_subdir not in output_subdirs:
+        ensure_directory(os.path.join(output_dir, output_subdir))
+        output_subdirs.add(output_subdir)
+    return output_path
+
+
+def iterate_directory(input_dir, output_dir, process_function, preserve_file_type=True, workers=1, chunksize=None,
+                      streaming=False, prefetch=8, write_behind=16, progress=None, cancel_event=None, filenames=None,
+                      stream_filenames=False):
     """
     Iterate over files in a directory, applying a processing function to each file.
 
+    Files are handled in sorted order and hidden files are skipped. When two files would be written to the same
+    output path, only the first is processed and the others are reported as errors.
+    A file that fails is reported and does not stop the rest of the batch.
+
     Args:
         input_dir (str): Path to the input directory.
         output_dir (str): Path to the output directory.
         process_function (function): Function to process each file.
         preserve_file_type (bool): Whether to preserve the original file extension.
+        workers (int): Number of worker processes. 1 runs serially; 0 or None uses every CPU core.
+        chunksize (int): Number of files dispatched to a worker at a time. Defaults to
+            about four chunks per worker.
+        streaming (bool): Overlap reading, processing and writing in a bounded pipeline
+            (see _iterate_streaming). process_function must open its input with open_image
+            and write its outputs with save_image, write_output or copy_file.
+        prefetch (int): With streaming, the most input files read ahead of the workers.
+        write_behind (int): With streaming, the most encoded outputs waiting to be written.
+        progress (function): Called as progress(completed, total) once before the first file
+            and after every file.
+        cancel_event (threading.Event): Once set, no further files are started. Files already
+            being processed are finished, and the rest are reported as cancelled.
+        filenames (iterable): Names of the files in input_dir to process, e.g. the images in a
+            source_index. Paths into subdirectories of input_dir (e.g. "2024/a.jpg") are
+            written to the same subdirectories of output_dir. Defaults to every file directly
+            in input_dir that is not hidden.
+        stream_filenames (bool): Start on files as filenames yields them, e.g. from a tree
+            walk still in progress, instead of listing them all first. Files are then
+            processed in the order they are yielded, one per task, and the progress total
+            grows as files are found.
+
+    Returns:
+        list: (input_path, error message) for every file that could not be processed,
+        including files skipped because of cancellation.
     """
     ensure_directory(output_dir)
 
-    for filename in os.listdir(input_dir):
-        input_path = os.path.join(input_dir, filename)
+    tasks = []
+    errors = []
+    claimed_outputs = {}
+    output_subdirs = set()
+    if filenames is None:
+        # Hidden files (e.g. manifests, .DS_Store) are never images to process
+        with os.scandir(input_dir) as entries:
+            filenames = [entry.name for entry in entries if entry.is_file() and not entry.name.startswith(".")]
+
+    def make_tasks(filenames):
+        for filename in filenames:
+            input_path = os.path.join(input_dir, filename)
+            output_path = _claim_output(
+                input_path, output_dir, filename, preserve_file_type, claimed_outputs, output_subdirs, errors
+            )
+            if output_path is None:
+                continue
+            task = (input_path, output_path)
+            tasks.append(task)
+            yield task
+
+    if not workers:
+        workers = os.cpu_count() or 1
+    if stream_filenames:
+        task_source = make_tasks(filenames)
+    else:
+        task_source = list(make_tasks(sorted(set(filenames))))
+        workers = min(workers, len(tasks))
+
+    completed = 0
+
+    def report_done():
+        nonlocal completed
+        completed += 1
+        if progress is not None:
+            progress(completed, len(tasks))
+
+    def is_cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+
+    if progress is not None:
+        progress(0, len(tasks))
+
+    results = []
+    pending_tasks = [] if is_cancelled() else task_source
+    if streaming and pending_tasks:
+        results, depths = _iterate_streaming(
+            pending_tasks, process_function, max(1, workers), prefetch, write_behind, report_done, is_cancelled
+        )
+        print("Streaming pipeline: " + "; ".join(stage.summary() for stage in depths))
+    elif workers <= 1 or not pending_tasks:
+        for task in pending_tasks:
+            if is_cancelled():
+                break
+            input_path, error, record = _run_process_function(process_function, *task)
+            instrumentation.collect(record)
+            results.append((input_path, error))
+            report_done()
+    elif stream_filenames:
+        # Files are submitted as they are found, keeping every worker busy with one task queued behind it
+        executor, run_task = _create_executor(workers, process_function)
+        with executor:
+            in_flight = set()
+            finding = True
+            while finding or in_flight:
+                while finding and len(in_flight) < workers * 2:
+                    task = None if is_cancelled() else next(pending_tasks, None)
+                    if task is None:
+                        finding = False
+                    else:
+                        in_flight.add(executor.submit(run_task, task))
+
+                if not in_flight:
+                    continue
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    input_path, error, record = future.result()
+                    instrumentation.collect(record)
+                    results.append((input_path, error))
+                    report_done()
+    else:
+        if chunksize is None:
+            chunksize = max(1, len(tasks) // (workers * 4))
+        executor, run_task = _create_executor(workers, process_function)
+        with executor:
+            chunks = [pending_tasks[start:start + chunksize] for start in range(0, len(pending_tasks), chunksize)]
+            futures = [executor.submit(_run_chunk, run_task, chunk) for chunk in chunks]
+            for future in futures:
+                if future.cancelled():
+                    continue  # Never started; its files are reported as cancelled
+                for input_path, error, record in future.result():
+                    instrumentation.collect(record)
+                    results.append((input_path, error))
+                    report_done()
+                if is_cancelled():
+                    # Drop the chunks not started yet. Those already running finish, and their
+                    # files are collected like the others, as their outputs are written.
+                    for later in futures:
+                        later.cancel()
+
+    errors.extend((input_path, error) for input_path, error in results if error)
+    for input_path, error in errors:
+        print(f"Error processing '{input_path}': {error}")
+
+    finished = {input_path for input_path, _ in results}
+    cancelled = [input_path for input_path, _ in tasks if input_path not in finished]
+    if cancelled:
+        print(f"Cancelled: {len(cancelled)} file(s) in '{input_dir}' were not processed.")
+        errors.extend((input_path, CANCELLED) for input_path in cancelled)
+
+    return errors
+
+
+def iterate_stages(stages, filenames, workers=1, progress=None, cancel_event=None):
+    """
+    Run several passes over the same files as one batch of (file, stage) tasks on a shared pool.
+
+    Instead of every stage waiting for the whole previous pass, a file's task for a stage
+    starts as soon as the task it depends on (see Stage.after) has completed. Ready tasks
+    are started earliest file first, and a file's stages in stage order, so the first files
+    are completely processed within seconds while the workers stay busy with later files.
+    Files are reported as completed in sorted order. When a task fails, the file's tasks
+    that depend on it are skipped.
+
+    Args:
+        stages (list): Stage of every pass. A stage must come after the stage it depends on.
+        filenames (iterable): Names of the files to process, in the input_dir of every stage.
+        workers (int): Number of worker processes shared by all stages. 1 runs serially; 0
+            or None uses every CPU core.
+        progress (function): Called as progress(completed, total) once before the first file
+            and whenever the next file in sorted order has completed all its stages.
+        cancel_event (threading.Event): Once set, no further tasks are started. Tasks already
+            running are finished, and the rest are reported as cancelled.
+
+    Returns:
+        list: (input_path, error message) for every task that failed or was cancelled, in
+        file then stage order.
+    """
+    stage_indexes = {stage.name: index for index, stage in enumerate(stages)}
+    filenames = sorted(set(filenames))
 
-        if os.path.isfile(input_path):
-            file_root, file_ext = os.path.splitext(filename)
-            if preserve_file_type:
-                output_filename = f"{file_root}{file_ext}"
+    # Tasks keyed by (file index, stage index), which is also the order they are started in
+    tasks = {}
+    errors = []
+    dependents = {}  # Task key -> stage indexes of the same file's tasks waiting for it
+    ready = []
+    for stage_index, stage in enumerate(stages):
+        ensure_directory(stage.output_dir)
+        claimed_outputs = {}
+        output_subdirs = set()
+        for file_index, filename in enumerate(filenames):
+            parent = None if stage.after is None else (file_index, stage_indexes[stage.after])
+            if parent is not None and parent not in tasks:
+                continue  # The stage this one reads from doesn't write this file
+            input_path = os.path.join(stage.input_dir, filename)
+            output_path = _claim_output(
+                input_path, stage.output_dir, filename, stage.preserve_file_type, claimed_outputs, output_subdirs, errors
+            )
+            if output_path is None:
+                continue
+            tasks[(file_index, stage_index)] = (input_path, output_path)
+            if parent is None:
+                ready.append((file_index, stage_index))
             else:
-                output_filename = f"{file_root}.jpg"
+                dependents.setdefault(parent, []).append(stage_index)
+    heapq.heapify(ready)
 
-            output_path = os.path.join(output_dir, output_filename)
-            process_function(input_path, output_path)
+    if not workers:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(tasks))
+
+    remaining = [0] * len(filenames)  # Tasks of every file not finished yet
+    for file_index, _ in tasks:
+        remaining[file_index] += 1
+    finished = set()
+    failures = {}
+    completed = 0
+
+    def is_cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+
+    def report_completed_files():
+        nonlocal completed
+        while completed < len(filenames) and remaining[completed] == 0:
+            completed += 1
+            if progress is not None:
+                progress(completed, len(filenames))
+
+    def finish(key, error):
+        file_index, _ = key
+        finished.add(key)
+        remaining[file_index] -= 1
+        if error:
+            failures[key] = error
+            # Skip everything downstream of the failed task
+            skipped = list(dependents.get(key, ()))
+            while skipped:
+                skipped_key = (file_index, skipped.pop())
+                finished.add(skipped_key)
+                remaining[file_index] -= 1
+                skipped.extend(dependents.get(skipped_key, ()))
+        else:
+            for stage_index in dependents.get(key, ()):
+                heapq.heappush(ready, (file_index, stage_index))
+        report_completed_files()
+
+    if progress is not None:
+        progress(0, len(filenames))
+    report_completed_files()  # Files without any task
+
+    if workers <= 1:
+        while ready and not is_cancelled():
+            key = heapq.heappop(ready)
+            input_path, error, record = _run_process_function(stages[key[1]].process_function, *tasks[key])
+            instrumentation.collect(record)
+            finish(key, error)
+    else:
+        executor, run_task = _create_executor(workers, [stage.process_function for stage in stages], staged=True)
+        with executor:
+            in_flight = {}
+            while ready or in_flight:
+                # Keep every worker busy with one task queued behind it
+                while ready and len(in_flight) < workers * 2 and not is_cancelled():
+                    key = heapq.heappop(ready)
+                    in_flight[executor.submit(run_task, (key[1],) + tasks[key])] = key
+
+                if not in_flight:
+                    break  # Cancelled
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = in_flight.pop(future)
+                    input_path, error, record = future.result()
+                    instrumentation.collect(record)
+                    finish(key, error)
+
+    errors.extend((tasks[key][0], failures[key]) for key in sorted(failures))
+    for input_path, error in errors:
+        print(f"Error processing '{input_path}': {error}")
+
+    cancelled = [tasks[key][0] for key in sorted(tasks) if key not in finished]
+    if cancelled:
+        print(f"Cancelled: {len(cancelled)} task(s) were not processed.")
+        errors.extend((input_path, CANCELLED) for input_path in cancelled)
+
+    return errors
+
+
+def calculate_fit_size(width, height, max_width, max_height):
+    """
+    Calculate the largest size that fits within max_width x max_height while keeping the aspect ratio.
+
+    Args:
+        width (int): Width of the image.
+        height (int): Height of the image.
+        max_width (int): Maximum width of the result.
+        max_height (int): Maximum height of the result.
+
+    Returns:
+        tuple: The (width, height) of the fitted image.
+    """
+    scale_factor = min(max_width / width, max_height / height)
+    return int(width * scale_factor), int(height * scale_factor)
+
+
+def draft_for_downscale(img, target_size):
+    """
+    Let a JPEG that has not been decoded yet decode at 1/2, 1/4 or 1/8 scale.
+
+    The scale is only reduced as far as keeps the decoded image at least target_size
+    (times DRAFT_MARGIN) in both dimensions, so the final LANCZOS resample never upscales.
+    Other formats and images that are already decoded are left untouched.
+
+    Args:
+        img (PIL.Image.Image): Opened image, before load().
+        target_size (tuple): Final (width, height) the image will be resampled to.
+
+    Returns:
+        tuple: The box of the decoded image covering the original frame, to pass to
+        Image.resize, or None if the image is decoded at full size.
+    """
+    if img.format != "JPEG":
+        return None
+
+    requested_size = tuple(max(1, math.ceil(side * DRAFT_MARGIN)) for side in target_size)
+    if requested_size[0] * 2 > img.width or requested_size[1] * 2 > img.height:
+        return None  # Not even a 1/2 scale decode would be large enough
+
+    result = img.draft(img.mode, requested_size)
+    if result is None:
+        return None  # Already decoded
+    return result[1]
+
+
+def reduce_for_resize(img, size, box, reducing_gap):
+    """
+    Shrink the region of img around box with Image.reduce, leaving a LANCZOS pass to size.
+
+    The factor in each dimension is the largest whole number that keeps the reduced box at
+    least reducing_gap times size, like Pillow's own reducing_gap. Only whole blocks of the
+    factor, counted from the image's corner, are averaged, so the bands of a banded resize
+    all sample the same reduced pixels.
+
+    Args:
+        img (PIL.Image.Image): Decoded image.
+        size (tuple): Target (width, height) of the LANCZOS pass.
+        box (tuple): Region of img that is resized.
+        reducing_gap (float): Margin the reduced box keeps over size; None or 0 never reduces.
+
+    Returns:
+        tuple: (image, box) to resize instead: img and box themselves when no reduction applies.
+    """
+    if not reducing_gap or img.mode not in _REDUCED_MODES:
+        return img, box
+    scale_x = (box[2] - box[0]) / size[0]
+    scale_y = (box[3] - box[1]) / size[1]
+    factor_x = max(1, int(scale_x / reducing_gap))
+    factor_y = max(1, int(scale_y / reducing_gap))
+    if factor_x == 1 and factor_y == 1:
+        return img, box
+
+    # Whole blocks covering the box and the filter's reach beyond it
+    left = max(0, math.floor((box[0] - LANCZOS_SUPPORT * scale_x) / factor_x) * factor_x)
+    top = max(0, math.floor((box[1] - LANCZOS_SUPPORT * scale_y) / factor_y) * factor_y)
+    right = min(img.width, math.ceil((box[2] + LANCZOS_SUPPORT * scale_x) / factor_x) * factor_x)
+    bottom = min(img.height, math.ceil((box[3] + LANCZOS_SUPPORT * scale_y) / factor_y) * factor_y)
+    reduced = img.reduce((factor_x, factor_y), box=(left, top, right, bottom))
+    reduced_box = (
+        (box[0] - left) / factor_x, (box[1] - top) / factor_y,
+        (box[2] - left) / factor_x, (box[3] - top) / factor_y,
+    )
+    return reduced, reduced_box
+
+
+def lanczos_resize(img, size, box=None, reducing_gap=None):
+    """
+    Resize an image with LANCZOS, in horizontal bands when it is large enough to matter.
+
+    Pillow resamples horizontally first, holding every source row of the box at the target
+    width. Under a memory budget, splitting the target into bands keeps that intermediate
+    below the budget's strip size (see memory_budget.strip_pixels). Each band is resampled with the same filter positions as the whole image, so the
+    result only differs from a single resize by rounding (at most one level, on few pixels).
+
+    With a reducing_gap, large downscales are first reduced by a whole factor (see
+    reduce_for_resize), which costs far less than a LANCZOS filter spanning the full
+    factor and differs from a single LANCZOS resize by a few levels at most.
+
+    Args:
+        img (PIL.Image.Image): Image to resize.
+        size (tuple): Target (width, height).
+        box (tuple): Region of img to resize, or None for the whole image.
+        reducing_gap (float): Margin kept over size when reducing first; None or 0 never reduces.
+
+    Returns:
+        PIL.Image.Image: The resized image.
+    """
+    if box is None:
+        box = (0, 0, img.width, img.height)
+    if reducing_gap:
+        img.load()
+        img, box = reduce_for_resize(img, size, box, reducing_gap)
+    source_rows = box[3] - box[1]
+    strip_pixels = memory_budget.strip_pixels()
+    if strip_pixels is None or img.mode not in _BANDED_MODES or source_rows * size[0] <= strip_pixels:
+        return img.resize(size, Image.Resampling.LANCZOS, box=box)
+
+    bands = math.ceil(source_rows * size[0] / strip_pixels)
+    band_height = max(1, math.ceil(size[1] / bands))
+    scale = source_rows / size[1]
+    resized = Image.new(img.mode, size)
+    for top in range(0, size[1], band_height):
+        bottom = min(size[1], top + band_height)
+        band_box = (box[0], box[1] + top * scale, box[2], box[1] + bottom * scale)
+        resized.paste(img.resize((size[0], bottom - top), Image.Resampling.LANCZOS, box=band_box), (0, top))
+    return resized
+
+
+def resample_image(img, size, box=None):
+    """
+    Resize an image with LANCZOS (or the selected backend's equivalent, see image_backends),
+    decoding a JPEG at reduced scale first when size allows it.
+
+    While img is the source of an active resize cascade, the resize is derived from the
+    cascade's nearest larger intermediate instead.
+
+    Args:
+        img (PIL.Image.Image): Image to resize. If it is not decoded yet, it may be drafted.
+        size (tuple): Target (width, height).
+        box (tuple): Region of img to resize, as returned by draft_for_downscale.
+
+    Returns:
+        PIL.Image.Image: The resized image.
+    """
+    cascade = active_cascade(img)
+    if cascade is not None:
+        with instrumentation.stage("resize"):
+            return cascade.resize(size, box=box)
+
+    if box is None:
+        box = draft_for_downscale(img, size)
+    with instrumentation.stage("decode"):
+        img.load()
+    instrumentation.note_resample(img.size, size)
+    with instrumentation.stage("resize"):
+        return image_backends.resize(img, size, box=box)
+
+
+def scale_image(img, max_dimension):
+    """
+    Resize an in-memory image to fit within a square of max_dimension x max_dimension.
+
+    Args:
+        img (PIL.Image.Image): Image to resize. Its pixels are not modified.
+        max_dimension (int): Maximum size for the longest side of the image.
+
+    Returns:
+        PIL.Image.Image: The resized image in RGB mode.
+    """
+    new_size = calculate_fit_size(img.width, img.height, max_dimension, max_dimension)
+
+    # Resize the image
+    img = resample_image(img, new_size)
+
+    # Convert to RGB if necessary
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    return img
 
 
 def resize_image(input_path, output_path, max_dimension):
@@ -45,23 +1024,130 @@ def resize_image(input_path, output_path, max_dimension):
         output_path (str): Path to save the resized image.
         max_dimension (int): Maximum size for the longest side of the image.
     """
-    with Image.open(input_path) as img:
-        width, height = img.size
+    with open_image(input_path) as img:
+        img = scale_image(img, max_dimension)
+
+        # Save as JPEG
+        save_image(img, output_path, "JPEG", quality=100)
 
-        # Determine scaling factor
-        scale_factor = min(max_dimension / width, max_dimension / height)
-        new_width = int(width * scale_factor)
-        new_height = int(height * scale_factor)
 
-        # Resize the image
-        img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+def encode_image(img, format, **save_options):
+    """Encode an image in memory with the selected backend (see image_backends) and return the encoded bytes."""
+    with instrumentation.stage("encode"):
+        return image_backends.encode(img, format, **save_options)
 
-        # Convert to RGB if necessary
-        if img.mode != "RGB":
-            img = img.convert("RGB")
 
-        # Save as JPEG
-        img.save(output_path, format="JPEG", quality=100)
+def encode_to_target_size(
+    img, target_bytes, format, min_quality=10, max_quality=100, tolerance_bytes=0, start_quality=None, **save_options
+):
+    """
+    Encode an image in memory at the highest quality whose output fits within target_bytes.
+
+    start_quality (the maximum quality by default) is tried first. If it is too large, the
+    quality is lowered in growing steps (5, 10, 20, ...) until an encode fits; if it fits,
+    the quality is raised the same way until an encode is too large. The range between
+    the last two attempts is then bisected. The search stops as soon as an encode fits
+    within tolerance_bytes of the target, so most images need only two or three encodes.
+
+    Args:
+        img (PIL.Image.Image): Image to encode.
+        target_bytes (int): Maximum size of the encoded image in bytes.
+        format (str): Pillow format name, e.g. "WEBP" or "JPEG".
+        min_quality (int): Lowest quality to try.
+        max_quality (int): Highest quality to try.
+        tolerance_bytes (int): How far under target_bytes an encode may be to stop searching.
+        start_quality (int): Quality to try first, e.g. the result of an earlier search;
+            None starts at max_quality.
+        **save_options: Extra options for Image.save, e.g. method=6.
+
+    Returns:
+        tuple: (encoded bytes, quality). If even min_quality does not fit, the bytes of the
+        min_quality encode are returned and are larger than target_bytes.
+    """
+    def fits(data):
+        return len(data) <= target_bytes
+
+    def close_enough(data):
+        return target_bytes - len(data) <= tolerance_bytes
+
+    start_quality = max_quality if start_quality is None else min(max(start_quality, min_quality), max_quality)
+    data = encode_image(img, format, quality=start_quality, **save_options)
+    step = 5
+    if fits(data):
+        # Step up until an encode is too large, doubling the step each time
+        best = (data, start_quality)
+        while True:
+            if best[1] == max_quality or close_enough(best[0]):
+                return best
+            quality = min(max_quality, best[1] + step)
+            data = encode_image(img, format, quality=quality, **save_options)
+            if not fits(data):
+                too_large = (data, quality)
+                break
+            best = (data, quality)
+            step *= 2
+    else:
+        # Step down until an encode fits, doubling the step each time
+        too_large = (data, start_quality)
+        while True:
+            if too_large[1] == min_quality:
+                return too_large
+            quality = max(min_quality, too_large[1] - step)
+            data = encode_image(img, format, quality=quality, **save_options)
+            if fits(data):
+                best = (data, quality)
+                break
+            too_large = (data, quality)
+            step *= 2
+
+    # Bisect between the best quality that fits and the lowest one that was too large
+    low, high = best[1] + 1, too_large[1] - 1
+    while low <= high and not close_enough(best[0]):
+        quality = (low + high) // 2
+        data = encode_image(img, format, quality=quality, **save_options)
+        if fits(data):
+            best = (data, quality)
+            low = quality + 1
+        else:
+            high = quality - 1
+
+    return best
+
+
+def save_within_max_dimension(img, output_path, max_dimension, source_path=None, encoder=DEFAULT_JPEG, max_bytes=None):
+    """
+    Save an in-memory image no larger than max_dimension x max_dimension.
+
+    Larger images are scaled down. When the encoder allows passthrough and writes JPEG,
+    a source_path that already meets the constraints (see passthrough.is_compliant) is
+    linked or copied unchanged, judged from its header alone, so img is never decoded.
+    Anything else is re-encoded.
+
+    Args:
+        img (PIL.Image.Image): Image to save. It is not modified.
+        output_path (str): Path to save the image.
+        max_dimension (int): Maximum size for the longest side of the image.
+        source_path (str): Path of a file holding exactly the pixels of img, or None.
+        encoder (dict): Encoder settings, as in encoder_profiles.
+        max_bytes (int): Largest file the platform accepts, or None if it has no limit.
+    """
+    width, height = img.size
+    if (
+        source_path is not None
+        and encoder.get("passthrough", False)
+        and encoder["format"] == "JPEG"
+        and max(width, height) <= max_dimension
+        and passthrough.is_compliant(*probe_file(source_path), max_dimension, max_bytes)
+    ):
+        copy_file(source_path, output_path)
+        return
+
+    # Scale down if larger
+    if width > max_dimension or height > max_dimension:
+        img = scale_image(img, max_dimension)
+    if encoder["format"] == "JPEG" and img.mode != "RGB":
+        img = img.convert("RGB")
+    save_image(img, output_path, **save_options(encoder))
 
 
 def apply_watermark(input_path, output_path, watermark_path, scale=70, transparency=100, position="bottom right"):
@@ -76,19 +1162,16 @@ def apply_watermark(input_path, output_path, watermark_path, scale=70, transpare
         transparency (int): Transparency of the watermark (0 to 100).
         position (str): Position for the watermark (e.g., "bottom right").
     """
-    with Image.open(input_path) as base_image, Image.open(watermark_path) as watermark:
-        base_width, base_height = base_image.size
+    # Imported here because watermarking itself builds on this module
+    from watermarking import load_watermark, prepare_watermark_layer
 
-        # Resize watermark based on the base image width
-        watermark_width = int((scale / 100) * base_width)
-        watermark.thumbnail((watermark_width, watermark_width), Image.Resampling.LANCZOS)
+    with open_image(input_path) as base_image:
+        base_width, base_height = base_image.size
 
-        # Adjust transparency
-        if watermark.mode != "RGBA":
-            watermark = watermark.convert("RGBA")
-        alpha = watermark.split()[3]  # Get alpha channel
-        alpha = alpha.point(lambda p: p * (transparency / 100))
-        watermark.putalpha(alpha)
+        # Resize watermark based on the base image width and adjust transparency (cached per width)
+        watermark = prepare_watermark_layer(
+            load_watermark(watermark_path), base_width, scale, transparency, fit="thumbnail"
+        )
 
         # Position the watermark
         wm_width, wm_height = watermark.size
@@ -103,8 +1186,9 @@ def apply_watermark(input_path, output_path, watermark_path, scale=70, transpare
         else:
             raise ValueError("Invalid watermark position. Choose from 'top left', 'top right', 'bottom left', 'bottom right'.")
 
-        # Apply watermark and save
-        base_image = base_image.convert("RGBA")
-        base_image.paste(watermark, offset, mask=watermark)
-        base_image = base_image.convert("RGB")  # Ensure the output is in RGB mode
-        base_image.save(output_path, format="JPEG", quality=100)
+        # Apply watermark and save, blending only the watermark's region of the RGB image
+        with instrumentation.stage("composite"):
+            if base_image.mode != "RGB":
+                base_image = base_image.convert("RGB")  # Ensure the output is in RGB mode
+            base_image.paste(watermark, offset, mask=watermark)
+        save_image(base_image, output_path, "JPEG", quality=100)
@@ -1,20 +1,28 @@
-from image_processing import resize_image, iterate_directory
+from encoder_profiles import DEFAULT_JPEG, extension, save_options
+from image_processing import iterate_directory, open_image, resample_image, save_image
+import instrumentation
+import os
+import threading
+from collections import OrderedDict
 from PIL import Image, ImageOps
 
+MAX_DIMENSION = 1440  # Maximum dimension for Instagram images
+MAX_CANVASES = 4  # Letterbox canvases kept for reuse per thread
 
-def process_images_for_aspect_ratio(input_dir, output_dir, aspect_ratio):
+# Reusable letterbox canvases of the current thread, keyed by size
+_canvas_state = threading.local()
+
+
+def parse_aspect_ratio(aspect_ratio):
     """
-    Process images to fit a given aspect ratio with padding and scaling, without upscaling.
+    Parse an aspect ratio in "width:height" format.
 
     Args:
-        input_dir (str): Path to the input directory containing images.
-        output_dir (str): Path to the output directory for processed images.
         aspect_ratio (str): Desired aspect ratio in "width:height" format (e.g., "4:5").
-    """
-    print(f"Processing images for aspect ratio {aspect_ratio} in '{input_dir}'...")
-    print(f"Output will be saved to '{output_dir}'.")
 
-    # Parse aspect ratio
+    Returns:
+        tuple: The (width_ratio, height_ratio) as floats.
+    """
     try:
         width_ratio, height_ratio = map(float, aspect_ratio.split(":"))
         
@@ -22,48 +30,145 @@ def process_images_for_aspect_ratio(input_dir, output_dir, aspect_ratio):
         if width_ratio < 10:  # Detect if the ratio is like 1.91:1
             width_ratio *= 100
             height_ratio *= 100
-            print(f"Converted aspect ratio: {width_ratio:.0f}:{height_ratio:.0f}")
 
     except ValueError:
         raise ValueError("Aspect ratio must be in 'width:height' format, e.g., '4:5'.")
 
+    return width_ratio, height_ratio
+
+
+def _letterbox_canvas(size):
+    """
+    Return a reusable RGB canvas of the given size for the current thread.
+
+    The canvas still holds the previous image drawn on it, so every pixel must be
+    overwritten before it is saved.
+    """
+    canvases = getattr(_canvas_state, "canvases", None)
+    if canvases is None:
+        canvases = _canvas_state.canvases = OrderedDict()
+
+    canvas = canvases.pop(size, None)
+    if canvas is None:
+        canvas = Image.new("RGB", size)
+    canvases[size] = canvas
+    while len(canvases) > MAX_CANVASES:
+        canvases.popitem(last=False)
+    return canvas
+
+
+def calculate_letterbox_geometry(width, height, width_ratio, height_ratio):
+    """
+    Calculate the final canvas size and the size of the image inside it.
+
+    The canvas has the target aspect ratio and is as large as the image's long side,
+    then scaled down to at most MAX_DIMENSION pixels in either direction. The image is
+    never scaled up.
+
+    Returns:
+        tuple: ((canvas_width, canvas_height), (image_width, image_height)).
+    """
+    is_portrait = height > width
+
+    # Calculate target dimensions at the original resolution
+    if is_portrait:
+        # Portrait orientation
+        long_side = height
+        short_side = int(long_side / (height_ratio / width_ratio))
+        target_width, target_height = short_side, long_side
+    else:
+        # Landscape orientation
+        long_side = width
+        short_side = int(long_side / (width_ratio / height_ratio))
+        target_width, target_height = long_side, short_side
+
+    # Scale down if the canvas exceeds MAX_DIMENSION pixels in either direction
+    scale_factor = min(MAX_DIMENSION / target_width, MAX_DIMENSION / target_height, 1)
+    canvas_size = (int(target_width * scale_factor), int(target_height * scale_factor))
+
+    image_size = (
+        max(1, min(canvas_size[0], round(min(width, target_width) * scale_factor))),
+        max(1, min(canvas_size[1], round(min(height, target_height) * scale_factor))),
+    )
+    return canvas_size, image_size
+
+
+def process_image_for_aspect_ratio(img, output_path, aspect_ratio, encoder=DEFAULT_JPEG):
+    """
+    Fit a single in-memory image to an aspect ratio with padding and scaling, without upscaling.
+
+    Args:
+        img (PIL.Image.Image): Image to process. Its pixels are not modified.
+        output_path (str): Path to save the processed image.
+        aspect_ratio (str): Desired aspect ratio in "width:height" format (e.g., "4:5").
+        encoder (dict): Encoder settings, as in encoder_profiles.
+    """
+    width_ratio, height_ratio = parse_aspect_ratio(aspect_ratio)
+
+    canvas_size, image_size = calculate_letterbox_geometry(img.width, img.height, width_ratio, height_ratio)
+
+    # Resample the source once, straight to its size inside the final canvas
+    img = resample_image(img, image_size)
+
+    # Paint only the padding bars black, then draw the image over the rest of the canvas
+    with instrumentation.stage("composite"):
+        padded_img = _letterbox_canvas(canvas_size)
+        canvas_width, canvas_height = canvas_size
+        left = (canvas_width - img.width) // 2
+        top = (canvas_height - img.height) // 2
+        right, bottom = left + img.width, top + img.height
+        for bar in ((0, 0, canvas_width, top), (0, bottom, canvas_width, canvas_height),
+                    (0, top, left, bottom), (right, top, canvas_width, bottom)):
+            if bar[2] > bar[0] and bar[3] > bar[1]:
+                padded_img.paste((0, 0, 0), bar)  # Black padding
+        padded_img.paste(img, (left, top))
+
+    # Save the processed image
+    save_image(padded_img, output_path, **save_options(encoder))
+
+
+def file_processor_for_aspect_ratio(aspect_ratio, encoder=DEFAULT_JPEG):
+    """
+    Return a process function, as for iterate_directory, that fits one image file to an aspect ratio.
+
+    The output is named after the encoder's format.
+    """
     def process_image(input_path, output_path):
-        with Image.open(input_path) as img:
-            orig_width, orig_height = img.size
-            is_portrait = orig_height > orig_width
-
-            # Step 1: Calculate target dimensions
-            if is_portrait:
-                # Portrait orientation
-                long_side = orig_height
-                short_side = int(long_side / (height_ratio / width_ratio))
-            else:
-                # Landscape orientation
-                long_side = orig_width
-                short_side = int(long_side / (width_ratio / height_ratio))
-
-            if is_portrait:
-                target_width, target_height = short_side, long_side
-            else:
-                target_width, target_height = long_side, short_side
-
-            # Step 2: Resize to fit the target aspect ratio with padding
-            img = img.resize((min(orig_width, target_width), min(orig_height, target_height)), Image.Resampling.LANCZOS)
-            padded_img = Image.new("RGB", (target_width, target_height), (0, 0, 0))  # Black padding
-            offset_x = (target_width - img.width) // 2
-            offset_y = (target_height - img.height) // 2
-            padded_img.paste(img, (offset_x, offset_y))
-
-            # Step 3: Scale down if the image exceeds 1440 pixels in either direction
-            if target_width > 1440 or target_height > 1440:
-                scale_factor = min(1440 / target_width, 1440 / target_height)
-                new_width = int(target_width * scale_factor)
-                new_height = int(target_height * scale_factor)
-                padded_img = padded_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-            # Save the processed image
-            padded_img.save(output_path, format="JPEG", quality=100)
-
-    iterate_directory(input_dir, output_dir, process_image, preserve_file_type=False)
+        # Name the output after the encoder's format
+        output_path = os.path.splitext(output_path)[0] + extension(encoder)
+        with open_image(input_path) as img:
+            process_image_for_aspect_ratio(img, output_path, aspect_ratio, encoder=encoder)
+
+    return process_image
+
+
+def process_images_for_aspect_ratio(input_dir, output_dir, aspect_ratio, encoder=DEFAULT_JPEG, **iterate_options):
+    """
+    Process images to fit a given aspect ratio with padding and scaling, without upscaling.
+
+    Args:
+        input_dir (str): Path to the input directory containing images.
+        output_dir (str): Path to the output directory for processed images.
+        aspect_ratio (str): Desired aspect ratio in "width:height" format (e.g., "4:5").
+        encoder (dict): Encoder settings, as in encoder_profiles.
+        **iterate_options: Extra keyword arguments for iterate_directory, such as workers.
+
+    Returns:
+        list: (input_path, error message) for every image that could not be processed.
+    """
+    print(f"Processing images for aspect ratio {aspect_ratio} in '{input_dir}'...")
+    print(f"Output will be saved to '{output_dir}'.")
+
+    # Parse aspect ratio
+    width_ratio, height_ratio = parse_aspect_ratio(aspect_ratio)
+    if width_ratio >= 100:
+        print(f"Converted aspect ratio: {width_ratio:.0f}:{height_ratio:.0f}")
+
+    errors = iterate_directory(
+        input_dir, output_dir, file_processor_for_aspect_ratio(aspect_ratio, encoder), preserve_file_type=False,
+        **iterate_options,
+    )
 
     print("Aspect ratio processing complete.")
+
+    return errors
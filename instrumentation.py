@@ -0,0 +1,241 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Stages shown in the summary table, in pipeline order
+STAGES = ("decode", "resize", "composite", "encode", "write")
+
+# Report collecting the records of the current run in this process, or None when disabled.
+# Forked worker processes inherit it, which tells them to record; their records are sent
+# back to the parent with each task's result.
+_report = None
+
+# Record of the file being processed on the current thread, and the platform being made from it
+_state = threading.local()
+
+# Returned by stage() when nothing is being recorded; entering it costs next to nothing
+_NOT_RECORDING = nullcontext()
+
+
+class _StageTimer:
+    """Add the time spent inside a with block to one stage of a file record."""
+
+    __slots__ = ("stages", "name", "start")
+
+    def __init__(self, stages, name):
+        self.stages = stages
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.stages[self.name] = self.stages.get(self.name, 0.0) + time.perf_counter() - self.start
+
+
+def enabled():
+    """Return whether a run report is being collected in this process."""
+    return _report is not None
+
+
+def recording():
+    """Return whether a file is being recorded on the current thread, to skip costly measurements otherwise."""
+    return getattr(_state, "record", None) is not None
+
+
+def _scope():
+    """Return the platform being processed on this thread, or the record's own output directory."""
+    return getattr(_state, "platform", None) or _state.record["pass"]
+
+
+@contextmanager
+def record_file(input_path, output_path):
+    """
+    Record the stages of processing one file on the current thread.
+
+    Yields:
+        dict: The file's record, filled in as the block runs, or None when disabled.
+    """
+    if _report is None:
+        yield None
+        return
+
+    record = {
+        "file": input_path,
+        "pass": os.path.basename(os.path.dirname(output_path)),
+        "seconds": 0.0,
+        "bytes_in": 0,
+        "stages": {},
+        "bytes_out": {},
+        "resample": [],
+        "cascade": {"source_pixels": 0, "resampled_pixels": 0},
+    }
+    _state.record = record
+    _state.platform = None
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        _state.record = None
+
+
+def stage(name):
+    """
+    Time a stage (see STAGES) of the file being recorded, attributed to the current platform.
+
+    Returns:
+        A context manager; a shared no-op when nothing is being recorded.
+    """
+    record = getattr(_state, "record", None)
+    if record is None:
+        return _NOT_RECORDING
+    return _StageTimer(record["stages"].setdefault(_scope(), {}), name)
+
+
+@contextmanager
+def platform(name):
+    """Attribute the stages recorded inside the block to a platform."""
+    previous = getattr(_state, "platform", None)
+    _state.platform = name
+    try:
+        yield
+    finally:
+        _state.platform = previous
+
+
+def add_bytes_in(count):
+    """Count bytes read from the source file."""
+    record = getattr(_state, "record", None)
+    if record is not None:
+        record["bytes_in"] += count
+
+
+def add_bytes_out(count):
+    """Count bytes written for the current platform."""
+    record = getattr(_state, "record", None)
+    if record is not None:
+        bytes_out = record["bytes_out"]
+        scope = _scope()
+        bytes_out[scope] = bytes_out.get(scope, 0) + count
+
+
+def note_resample(source_size, target_size):
+    """Record a resample from source_size to target_size."""
+    record = getattr(_state, "record", None)
+    if record is not None:
+        ratio = (source_size[0] * source_size[1]) / max(1, target_size[0] * target_size[1])
+        record["resample"].append({
+            "scope": _scope(), "from": list(source_size), "to": list(target_size), "ratio": round(ratio, 3),
+        })
+
+
+def note_cascade(source_pixels, resampled_pixels):
+    """
+    Record the resample work of a resize cascade: the pixels resampling every output from
+    the source would read, and the pixels actually read.
+    """
+    record = getattr(_state, "record", None)
+    if record is not None:
+        record["cascade"]["source_pixels"] += source_pixels
+        record["cascade"]["resampled_pixels"] += resampled_pixels
+
+
+def collect(record):
+    """Add a finished file record, returned by a task, to the current run report."""
+    if _report is not None and record is not None:
+        _report.records.append(record)
+
+
+class RunReport:
+    """The file records of one run, with a per-platform summary."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.records = []
+
+    def summary(self):
+        """
+        Total up the records per platform (or per output directory outside platforms).
+
+        Returns:
+            dict: For every scope, the files, seconds per stage, bytes out and mean resample ratio.
+        """
+        rows = {}
+        for record in self.records:
+            scopes = set(record["stages"]) | set(record["bytes_out"])
+            for scope in scopes:
+                row = rows.setdefault(scope, {"files": 0, "stages": {}, "bytes_out": 0, "resample_ratios": []})
+                row["files"] += 1
+                for name, seconds in record["stages"].get(scope, {}).items():
+                    row["stages"][name] = row["stages"].get(name, 0.0) + seconds
+                row["bytes_out"] += record["bytes_out"].get(scope, 0)
+            for resample in record["resample"]:
+                rows.setdefault(resample["scope"], {"files": 0, "stages": {}, "bytes_out": 0, "resample_ratios": []})
+                rows[resample["scope"]]["resample_ratios"].append(resample["ratio"])
+
+        for row in rows.values():
+            ratios = row.pop("resample_ratios")
+            row["mean_resample_ratio"] = sum(ratios) / len(ratios) if ratios else None
+        return rows
+
+    def cascade_saved_fraction(self):
+        """Return the fraction of resample work the resize cascade saved over the run, or None if it never ran."""
+        source_pixels = sum(record["cascade"]["source_pixels"] for record in self.records)
+        if not source_pixels:
+            return None
+        return 1 - sum(record["cascade"]["resampled_pixels"] for record in self.records) / source_pixels
+
+    def write(self):
+        """Write one JSON line per file record, followed by a summary line."""
+        with open(self.path, "w") as file:
+            for record in self.records:
+                file.write(json.dumps({"type": "file", **record}) + "\n")
+            file.write(json.dumps({
+                "type": "summary",
+                "files": len({record["file"] for record in self.records}),
+                "bytes_in": sum(record["bytes_in"] for record in self.records),
+                "seconds": sum(record["seconds"] for record in self.records),
+                "cascade_saved_fraction": self.cascade_saved_fraction(),
+                "platforms": self.summary(),
+            }) + "\n")
+
+    def format_table(self):
+        """Format the summary as a text table, the most expensive platform first."""
+        rows = self.summary()
+        header = f"{'platform':<12}{'files':>6}" + "".join(f"{name:>11}" for name in STAGES) + f"{'MB out':>9}{'ratio':>8}"
+        lines = [header, "-" * len(header)]
+        totals = {name: 0.0 for name in STAGES}
+        for scope, row in sorted(rows.items(), key=lambda item: -sum(item[1]["stages"].values())):
+            cells = []
+            for name in STAGES:
+                seconds = row["stages"].get(name, 0.0)
+                totals[name] += seconds
+                cells.append(f"{seconds:10.2f}s")
+            ratio = row["mean_resample_ratio"]
+            lines.append(
+                f"{scope:<12}{row['files']:>6}" + "".join(cells)
+                + f"{row['bytes_out'] / (1024 * 1024):9.1f}" + (f"{ratio:8.1f}" if ratio else f"{'-':>8}")
+            )
+        lines.append("-" * len(header))
+        lines.append(f"{'total':<12}{'':>6}" + "".join(f"{totals[name]:10.2f}s" for name in STAGES))
+        return "\n".join(lines)
+
+
+@contextmanager
+def run_report(path=None):
+    """
+    Collect the records of every file processed inside the block in this process.
+
+    Yields:
+        RunReport: The report, complete once the block ends.
+    """
+    global _report
+    previous = _report
+    _report = RunReport(path)
+    try:
+        yield _report
+    finally:
+        _report = previous
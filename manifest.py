@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+
+MANIFEST_FILENAME = ".image_sweetener_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_options(options):
+    """Return a stable SHA-256 hex digest of a JSON-serializable options dictionary."""
+    encoded = json.dumps(options, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def load_manifest(output_dir):
+    """
+    Load the manifest of an output directory.
+
+    Returns:
+        dict: Entries keyed by source filename. Empty if there is no readable manifest.
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    try:
+        with open(manifest_path, "r") as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest.get("sources", {})
+
+
+def save_manifest(output_dir, entries):
+    """Write the manifest of an output directory, replacing the old one atomically."""
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, "w") as file:
+        json.dump({"version": MANIFEST_VERSION, "sources": entries}, file, indent=1, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+
+def fingerprint_source(input_path, known_entries=(), file_stat=None):
+    """
+    Identify the current contents of a source file.
+
+    The content hash is reused from the first known manifest entry whose size and mtime
+    still match, so unchanged files are not read again.
+
+    Args:
+        input_path (str): Path to the source file.
+        known_entries (iterable): Manifest entries previously recorded for this source.
+        file_stat (dict): The file's "size" and "mtime_ns" if already known, e.g. a
+            source_index entry. Otherwise the file is stat'ed.
+
+    Returns:
+        dict: The file's "size", "mtime_ns" and content "hash".
+    """
+    if file_stat is None:
+        stat = os.stat(input_path)
+        file_stat = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    size, mtime_ns = file_stat["size"], file_stat["mtime_ns"]
+    for entry in known_entries:
+        if entry and entry.get("size") == size and entry.get("mtime_ns") == mtime_ns:
+            return {"size": size, "mtime_ns": mtime_ns, "hash": entry["hash"]}
+    return {"size": size, "mtime_ns": mtime_ns, "hash": hash_file(input_path)}
+
+
+def is_up_to_date(entry, fingerprint, options_hash, output_dir):
+    """Check whether a manifest entry still matches the source, the options and an existing output."""
+    return (
+        entry is not None
+        and entry.get("hash") == fingerprint["hash"]
+        and entry.get("options_hash") == options_hash
+        and os.path.isfile(os.path.join(output_dir, entry.get("output", "")))
+    )
+
+
+def make_entry(fingerprint, options_hash, output_filename):
+    """Create the manifest entry recording that output_filename was generated from a source."""
+    return {**fingerprint, "options_hash": options_hash, "output": output_filename}
+
+
+def prune_deleted_sources(output_dir, entries, source_filenames):
+    """
+    Delete the outputs of sources that no longer exist and drop their manifest entries.
+
+    Returns:
+        int: Number of entries removed.
+    """
+    removed = 0
+    for filename in [name for name in entries if name not in source_filenames]:
+        output_path = os.path.join(output_dir, entries.pop(filename).get("output", ""))
+        if os.path.isfile(output_path):
+            os.remove(output_path)
+        removed += 1
+    return removed
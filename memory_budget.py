@@ -0,0 +1,130 @@
+"""
+Keep the memory each worker needs for very large images (100 MP+ panoramas) within a budget.
+
+With a pixel budget configured:
+
+- Images larger than the budget are decoded at reduced scale (JPEG draft) and/or shrunk
+  with Image.reduce straight after decoding, so the rest of the pipeline only ever holds
+  about pixel_budget pixels per image.
+- LANCZOS resizes are done in horizontal bands of at most strip_pixels (see
+  image_processing.lanczos_resize), so Pillow's intermediate of source rows times target
+  width stays a small fraction of the budget.
+- At most large_image_slots images over the budget are processed at once across all
+  worker processes; the other workers carry on with smaller images.
+"""
+import math
+import multiprocessing
+import threading
+from contextlib import contextmanager, nullcontext
+from PIL import Image
+
+# Largest platform output (Twitter). A reduced image is always longer than this, so every
+# platform still resamples it and none passes the full-size source file through as a copy.
+MIN_REDUCED_SIDE = 4096
+
+# A resize band's intermediate is kept below the pixel budget divided by this
+STRIP_FRACTION = 16
+
+# Pillow's decompression bomb limit, restored when a run configures none
+_DEFAULT_MAX_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS
+
+_pixel_budget = None  # Most pixels an image is kept at, or None when unlimited
+_strip_pixels = None  # Most pixels in a resize band's intermediate, or None when not banding
+_large_image_slots = None  # Semaphore shared with worker processes, or None when unlimited
+
+
+def configure(pixel_budget=None, large_image_slots=1, max_image_pixels=None):
+    """
+    Set the memory budget for this process and the worker processes it forks afterwards.
+
+    Args:
+        pixel_budget (int): Most pixels to keep an image at, or None/0 for no budget.
+        large_image_slots (int): Images over the budget allowed in flight at once.
+        max_image_pixels (int): Largest image Pillow may decode, or None/0 for Pillow's
+            default decompression bomb limit.
+    """
+    global _pixel_budget, _strip_pixels, _large_image_slots
+
+    _pixel_budget = pixel_budget or None
+    _strip_pixels = _pixel_budget // STRIP_FRACTION if _pixel_budget else None
+    _large_image_slots = None
+    if _pixel_budget and large_image_slots:
+        try:
+            # Forked workers inherit the semaphore, so the limit holds across processes
+            _large_image_slots = multiprocessing.BoundedSemaphore(large_image_slots)
+        except (ImportError, OSError):
+            _large_image_slots = threading.BoundedSemaphore(large_image_slots)
+
+    # Pillow warns above MAX_IMAGE_PIXELS and refuses images over twice it
+    Image.MAX_IMAGE_PIXELS = max_image_pixels // 2 if max_image_pixels else _DEFAULT_MAX_IMAGE_PIXELS
+
+
+def is_large(size):
+    """Return whether an image of the given (width, height) exceeds the pixel budget."""
+    return _pixel_budget is not None and size[0] * size[1] > _pixel_budget
+
+
+def strip_pixels():
+    """Return the most pixels a resize band's intermediate may hold, or None when resizes aren't banded."""
+    return _strip_pixels
+
+
+def limits_large_images():
+    """Return whether images over the budget have to wait for a slot."""
+    return _large_image_slots is not None
+
+
+def large_image_slot(size):
+    """
+    Wait for one of the slots for images over the budget, if an image of this size needs one.
+
+    Returns:
+        A context manager holding the slot until the block ends.
+    """
+    if _large_image_slots is None or not is_large(size):
+        return nullcontext()
+    return _held(_large_image_slots)
+
+
+@contextmanager
+def _held(semaphore):
+    semaphore.acquire()
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+def reduce_to_budget(img):
+    """
+    Decode an opened image at a size within the pixel budget.
+
+    JPEGs are drafted straight to the nearest larger DCT scale; whatever reduction remains
+    is done with Image.reduce, and the full-size decode is released.
+
+    Args:
+        img (PIL.Image.Image): Opened image, before load().
+
+    Returns:
+        PIL.Image.Image: img itself if it fits the budget, and a decoded, reduced copy otherwise.
+    """
+    if not is_large(img.size):
+        return img
+
+    factor = math.ceil(math.sqrt(img.width * img.height / _pixel_budget))
+    # Stay longer than the largest platform output
+    factor = min(factor, max(1, (max(img.size) - 1) // MIN_REDUCED_SIDE))
+    if factor <= 1:
+        return img
+
+    target_size = (math.ceil(img.width / factor), math.ceil(img.height / factor))
+    if img.format == "JPEG":
+        img.draft(img.mode, target_size)
+    img.load()
+
+    remaining = min(img.width // target_size[0], img.height // target_size[1])
+    if remaining <= 1:
+        return img
+    reduced = img.reduce(remaining)
+    img.close()
+    return reduced
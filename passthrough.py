@@ -0,0 +1,128 @@
+"""
+Pass source files that already meet a platform's constraints straight through to its output.
+
+Whether a file can pass through is decided from header facts only (format, dimensions,
+mode and byte size), so compliant sources are never decoded. The output is then created
+as a reflink (copy-on-write clone, on Btrfs/XFS/APFS-like filesystems) or a hardlink of
+the source, falling back to a plain copy, so passing a 20 MB JPEG to three platforms
+costs no extra disk space or write I/O.
+
+Outputs are always replaced atomically (see image_processing), never written in place, so
+regenerating a hardlinked output can't modify the source it was linked from. Editing an
+output in place with another program does change the source, though; use the "reflink"
+or "copy" link mode if outputs are edited that way.
+"""
+import os
+from shutil import copy2, copystat
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows
+    fcntl = None
+
+LINK_MODES = ("hardlink", "reflink", "copy")
+
+FICLONE = 0x40049409  # ioctl request from <linux/fs.h>
+
+# Files only pass through in formats and modes every platform accepts as they are
+PASSTHROUGH_FORMATS = ("JPEG",)
+PASSTHROUGH_MODES = ("RGB", "L")
+
+# How outputs are created from passed-through sources in this process (see configure)
+_link_mode = "hardlink"
+
+
+def configure(link_mode="hardlink"):
+    """
+    Set how passed-through outputs are created, in this process and the workers it forks afterwards.
+
+    Args:
+        link_mode (str): "hardlink" tries a reflink, then a hardlink, then a copy.
+            "reflink" tries a reflink, then a copy. "copy" always copies.
+
+    Raises:
+        ValueError: If link_mode is not one of LINK_MODES.
+    """
+    global _link_mode
+    if link_mode not in LINK_MODES:
+        raise ValueError(f"Unknown link mode '{link_mode}'. Choose from {', '.join(LINK_MODES)}.")
+    _link_mode = link_mode
+
+
+def is_compliant(format, size, mode, byte_size, max_dimension, max_bytes=None):
+    """
+    Return whether a file can be used unchanged as a platform output.
+
+    Args:
+        format (str): Format from the file header, e.g. "JPEG".
+        size (tuple): (width, height) from the file header.
+        mode (str): Pillow mode from the file header.
+        byte_size (int): File size in bytes.
+        max_dimension (int): The platform's maximum width and height.
+        max_bytes (int): The platform's maximum file size, or None if it has none.
+    """
+    return (
+        format in PASSTHROUGH_FORMATS
+        and mode in PASSTHROUGH_MODES
+        and max(size) <= max_dimension
+        and (max_bytes is None or byte_size <= max_bytes)
+    )
+
+
+def is_up_to_date(source_path, output_path):
+    """
+    Return whether output_path already holds source_path unchanged from an earlier pass-through.
+
+    That is the case when it is a hardlink to the same file (in "hardlink" mode only, so
+    switching modes replaces old links), or a copy with the same size and modification
+    time (which copy2 and reflinks preserve).
+    """
+    try:
+        source_stat = os.stat(source_path)
+        output_stat = os.stat(output_path)
+    except OSError:
+        return False
+    if (source_stat.st_dev, source_stat.st_ino) == (output_stat.st_dev, output_stat.st_ino):
+        return _link_mode == "hardlink"
+    return source_stat.st_size == output_stat.st_size and source_stat.st_mtime_ns == output_stat.st_mtime_ns
+
+
+def _reflink(source_path, output_path):
+    """Create output_path as a copy-on-write clone of source_path, raising OSError where unsupported."""
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(source_path, "rb") as source, open(output_path, "wb") as output:
+        try:
+            fcntl.ioctl(output.fileno(), FICLONE, source.fileno())
+        except OSError:
+            output.close()
+            os.remove(output_path)
+            raise
+    copystat(source_path, output_path)
+
+
+def link_file(source_path, output_path):
+    """
+    Create output_path with the contents of source_path, sharing its data on disk where possible.
+
+    Args:
+        source_path (str): Existing file.
+        output_path (str): Path to create; it must not exist yet.
+
+    Returns:
+        str: How the file was created: "reflink", "hardlink" or "copy".
+    """
+    if _link_mode != "copy":
+        try:
+            _reflink(source_path, output_path)
+            return "reflink"
+        except OSError:
+            pass
+    if _link_mode == "hardlink":
+        try:
+            os.link(source_path, output_path)
+            return "hardlink"
+        except OSError:
+            pass  # E.g. another filesystem, or links not supported
+    copy2(source_path, output_path)
+    return "copy"
@@ -0,0 +1,163 @@
+"""
+Persistent cache of decoded source pixels, for re-running a folder while tuning options.
+
+Re-running the same sources with a different watermark scale, transparency or rotation
+decodes every image again, although its pixels are the same as last time. With the cache
+enabled (see configure), the pixels of every decoded source are written to a raw file
+keyed by the file's content hash and the decoded mode and size, and later runs memory-map
+that file instead of decoding. A JPEG decoded at reduced scale (when only platform outputs
+are made) is cached at that scale, so entries stay small.
+
+Pillow uses a mapping as it is for L, RGBA and CMYK images; RGB pixels are unpacked from
+it with one copy, which still costs a fraction of a decode.
+
+The cache is capped in size: every hit marks its file as recently used, and writing a
+new entry deletes the least recently used ones until the cache fits again.
+"""
+import hashlib
+import mmap
+import os
+import threading
+from PIL import Image
+from manifest import hash_file
+
+CACHE_DIRNAME = ".image_sweetener_pixels"
+CACHE_VERSION = 1
+
+DEFAULT_MAX_MEGABYTES = 4096
+
+# Modes cached: one byte per band, so a file's size follows from the image size
+CACHED_MODES = ("L", "LA", "RGB", "RGBA", "CMYK")
+
+_directory = None  # Cache directory of this process, or None when disabled
+_max_bytes = None
+
+
+def configure(directory=None, max_megabytes=DEFAULT_MAX_MEGABYTES):
+    """
+    Enable the cache in this process and the worker processes it forks afterwards.
+
+    Args:
+        directory (str): Cache directory, created if needed; None disables the cache.
+        max_megabytes (float): Size the cache is kept within.
+    """
+    global _directory, _max_bytes
+    _directory = directory
+    _max_bytes = int(max_megabytes * 1024 * 1024)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+def enabled():
+    """Return whether decoded pixels are cached in this process."""
+    return _directory is not None
+
+
+def cache_key(content_hash, mode, size):
+    """Return the key of a source's pixels decoded in mode at size, for this Pillow version."""
+    description = f"{CACHE_VERSION}:{Image.__version__}:{content_hash}:{mode}:{size[0]}x{size[1]}"
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+
+def content_hash(path, data=None):
+    """Return the SHA-256 hex digest of a source, from its bytes if they have been read already."""
+    if data is not None:
+        return hashlib.sha256(data).hexdigest()
+    return hash_file(path)
+
+
+def _entry_path(key):
+    return os.path.join(_directory, key + ".raw")
+
+
+def _byte_size(mode, size):
+    return size[0] * size[1] * Image.getmodebands(mode)
+
+
+def load(key, mode, size):
+    """
+    Map the cached pixels of a key as an image.
+
+    Returns:
+        PIL.Image.Image: The decoded image (read-only until modified), or None on a miss.
+    """
+    path = _entry_path(key)
+    try:
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size != _byte_size(mode, size):
+                return None  # Left incomplete by another program; rewritten on this miss
+            pixels = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        os.utime(path)  # Most recently used
+    except OSError:
+        pass
+    return Image.frombuffer(mode, size, pixels, "raw", mode, 0, 1)
+
+
+def store(key, img):
+    """Write an image's decoded pixels under a key, then evict entries until the cache fits."""
+    path = _entry_path(key)
+    temp_path = os.path.join(_directory, f".{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(temp_path, "wb") as file:
+            file.write(img.tobytes())
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Could not cache the decoded pixels in '{_directory}': {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return
+    evict()
+
+
+def evict():
+    """Delete the least recently used entries until the cache is within its size cap."""
+    entries = []
+    total = 0
+    try:
+        with os.scandir(_directory) as scan:
+            for entry in scan:
+                if entry.name.endswith(".raw"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                    total += stat.st_size
+    except OSError:
+        return
+
+    for _, byte_size, path in sorted(entries):
+        if total <= _max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # Already evicted by another worker, or still mapped on Windows
+        total -= byte_size
+
+
+def decode(img, path, data=None, known_hash=None):
+    """
+    Decode an opened image, from the cache when its pixels are there.
+
+    Args:
+        img (PIL.Image.Image): Opened image, drafted to its decode size if needed.
+        path (str): Path of the source file.
+        data (bytes): Contents of the source file, if they have been read already.
+        known_hash (str): SHA-256 of the source file, if already known.
+
+    Returns:
+        PIL.Image.Image: img itself after load(), or the cached pixels in its place.
+    """
+    if _directory is None or not getattr(img, "tile", None) or img.mode not in CACHED_MODES:
+        img.load()  # Disabled, already decoded (reduced to the memory budget), or a mode not cached
+        return img
+
+    key = cache_key(known_hash or content_hash(path, data), img.mode, img.size)
+    cached = load(key, img.mode, img.size)
+    if cached is not None:
+        return cached
+    img.load()
+    store(key, img)
+    return img
@@ -0,0 +1,92 @@
+import threading
+from contextlib import contextmanager
+import image_backends
+import instrumentation
+
+# Cascade of the source image currently being fanned out on this thread
+_state = threading.local()
+
+
+class ResizeCascade:
+    """
+    Derive each resize of one source image from the nearest larger resize already made from it.
+
+    Platform targets are nested, so when platforms are processed from the largest target
+    down, most of them can be resampled from a much smaller intermediate instead of from
+    the full-resolution source. An intermediate is only used when it is at least min_ratio
+    times the requested size in both dimensions, which keeps the extra resample step from
+    softening the result.
+    """
+
+    def __init__(self, source, min_ratio=2.0):
+        self.source = source
+        self.min_ratio = min_ratio
+        self.frames = []
+        self.source_pixels = 0  # Pixels that resampling everything from the source would read
+        self.resampled_pixels = 0  # Pixels actually read
+
+    def resize(self, size, box=None):
+        """Resize the source to size with LANCZOS, starting from the best intermediate available."""
+        base = self.source
+        if box is None:
+            for frame in sorted(self.frames, key=lambda frame: frame.width * frame.height):
+                if frame.width >= size[0] * self.min_ratio and frame.height >= size[1] * self.min_ratio:
+                    base = frame
+                    break
+
+        instrumentation.note_resample(base.size, size)
+        if base is self.source:
+            resized = image_backends.resize(self.source, size, box=box)
+        else:
+            resized = image_backends.resize(base, size)
+
+        self.source_pixels += self.source.width * self.source.height
+        self.resampled_pixels += base.width * base.height
+        # Upscaled frames hold no extra detail, so they never serve as intermediates
+        if size[0] < self.source.width and size[1] < self.source.height:
+            self.frames.append(resized)
+        return resized
+
+    def saved_fraction(self):
+        """Return the fraction of resample work saved compared to resampling everything from the source."""
+        if not self.source_pixels:
+            return 0.0
+        return 1 - self.resampled_pixels / self.source_pixels
+
+
+def plan_resize_order(targets):
+    """
+    Sort platform targets from the largest to the smallest, so smaller targets can reuse larger ones.
+
+    Args:
+        targets (list): (key, (max_width, max_height)) pairs.
+
+    Returns:
+        list: The keys, largest target first.
+    """
+    return [key for key, (width, height) in sorted(targets, key=lambda target: -target[1][0] * target[1][1])]
+
+
+@contextmanager
+def resize_cascade(source, min_ratio=2.0):
+    """
+    Route every resample_image call on source in this thread through a ResizeCascade.
+
+    Yields:
+        ResizeCascade: The cascade, for reading the work saved once the block ends.
+    """
+    cascade = ResizeCascade(source, min_ratio)
+    previous = getattr(_state, "cascade", None)
+    _state.cascade = cascade
+    try:
+        yield cascade
+    finally:
+        _state.cascade = previous
+
+
+def active_cascade(img):
+    """Return the cascade that img is the source of on this thread, or None."""
+    cascade = getattr(_state, "cascade", None)
+    if cascade is not None and cascade.source is img:
+        return cascade
+    return None
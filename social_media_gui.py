@@ -1,4 +1,5 @@
 import tkinter as tk
+from encoder_profiles import profile_names
 
 
 def create_social_media_section(root, config, start_row, options):
@@ -88,6 +89,17 @@ def create_social_media_section(root, config, start_row, options):
     platform_vars["instagram"].trace_add("write", toggle_instagram_options)
     toggle_instagram_options()  # Ensure initial state matches configuration
 
+    # Encoder profile, trading encode speed against output size
+    encoder_profile = tk.StringVar(value=config.get("encoder_profile", "default"))
+    options["encoder_profile"] = encoder_profile
+
+    encoder_frame = tk.Frame(social_media_frame)
+    encoder_frame.grid(row=2, column=0, columnspan=3, pady=5, sticky="ew")
+    tk.Label(encoder_frame, text="Encoder Profile:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
+    tk.OptionMenu(encoder_frame, encoder_profile, *profile_names(config.get("encoder_profiles"))).grid(
+        row=0, column=1, padx=5, pady=5, sticky="w"
+    )
+
     return start_row + 1
 
 
@@ -0,0 +1,217 @@
+"""
+Metadata index of the source images in a directory, built once per run.
+
+A single os.scandir pass lists the directory, and every new or changed file is probed
+from its header only (Image.open does not decode pixels) for its format, dimensions,
+mode and EXIF orientation. Files Pillow can't identify, such as a stray config.json, are
+recorded as non-images so they are skipped without being probed again. The index is
+saved as a hidden file in the directory, and entries whose size and modification time
+are unchanged are reused on the next run.
+
+A recursive run indexes the whole tree instead (see index_tree), keyed by relative path,
+while the tree is being walked.
+
+While a run is active (see activate), the pipeline stages look files up here instead of
+listing the directory or opening files to read their size.
+"""
+import json
+import os
+from PIL import Image
+from tree_walker import DEFAULT_WALK_WORKERS, walk_tree
+
+INDEX_FILENAME = ".image_sweetener_index.json"
+INDEX_VERSION = 1
+
+ORIENTATION_TAG = 0x0112  # EXIF orientation
+
+# (absolute directory, entries) of the index the current run uses, or None. Forked worker
+# processes inherit it.
+_active = None
+
+
+def probe_header(path):
+    """
+    Read the header facts of an image file, without decoding it.
+
+    Returns:
+        dict: "format", "width", "height", "mode" and EXIF "orientation" (1 when absent).
+
+    Raises:
+        OSError: If the file can't be read or is not an image Pillow can identify.
+    """
+    with Image.open(path) as img:
+        try:
+            orientation = img.getexif().get(ORIENTATION_TAG, 1)
+        except (OSError, ValueError, SyntaxError):
+            orientation = 1  # Unreadable EXIF doesn't make the image unusable
+        return {"format": img.format, "width": img.width, "height": img.height, "mode": img.mode, "orientation": orientation}
+
+
+def load_index(directory):
+    """
+    Load the saved index of a directory.
+
+    Returns:
+        dict: Entries keyed by filename. Empty if there is no readable index.
+    """
+    try:
+        with open(os.path.join(directory, INDEX_FILENAME), "r") as file:
+            index = json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+    if index.get("version") != INDEX_VERSION:
+        return {}
+    return index.get("files", {})
+
+
+def save_index(directory, entries):
+    """Write the index of a directory, replacing the old one atomically."""
+    index_path = os.path.join(directory, INDEX_FILENAME)
+    temp_path = index_path + ".tmp"
+    with open(temp_path, "w") as file:
+        json.dump({"version": INDEX_VERSION, "files": entries}, file, indent=1, sort_keys=True)
+    os.replace(temp_path, index_path)
+
+
+def _index_entry(path, stat, known):
+    """
+    Return (entry, whether the file was probed) for a file, reusing known if it is unchanged.
+    """
+    if (
+        known and "error" not in known
+        and known.get("size") == stat.st_size and known.get("mtime_ns") == stat.st_mtime_ns
+    ):
+        return known, False
+
+    try:
+        facts = probe_header(path)
+    except Image.DecompressionBombError as e:
+        # Still an image; processing it reports the error, and the limit may differ next run
+        facts = {"format": None, "error": str(e)}
+    except (OSError, ValueError, SyntaxError):
+        facts = {"format": None}
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, **facts}, True
+
+
+def build_index(directory, previous=None):
+    """
+    Index the files directly in a directory with one os.scandir pass.
+
+    Hidden files and subdirectories are left out. Entries from previous are reused for
+    files whose size and modification time are unchanged; other files are probed.
+
+    Args:
+        directory (str): Directory to index.
+        previous (dict): Entries of an earlier index of the directory.
+
+    Returns:
+        tuple: (entries keyed by filename, number of files probed). An entry holds the
+        file's "size" and "mtime_ns" plus the facts from probe_header. Its "format" is None
+        for files that are not images, and for images over the decompression bomb limit,
+        which also have an "error".
+    """
+    previous = previous or {}
+    entries = {}
+    probed = 0
+    with os.scandir(directory) as scan:
+        for dir_entry in scan:
+            if dir_entry.name.startswith(".") or not dir_entry.is_file():
+                continue
+            entries[dir_entry.name], was_probed = _index_entry(dir_entry.path, dir_entry.stat(), previous.get(dir_entry.name))
+            probed += was_probed
+    return entries, probed
+
+
+def _finish_index(directory, entries, previous, probed):
+    """Save the index if it changed and report what was indexed."""
+    if entries != previous:
+        try:
+            save_index(directory, entries)
+        except OSError as e:
+            print(f"Could not save the source index of '{directory}': {e}")
+
+    skipped = sorted(name for name, entry in entries.items() if entry["format"] is None and "error" not in entry)
+    print(f"Indexed {len(entries) - len(skipped)} image(s) in '{directory}' ({probed} probed).")
+    if skipped:
+        print(f"Skipping {len(skipped)} file(s) that are not images: {', '.join(skipped)}")
+
+
+def index_directory(directory):
+    """
+    Bring the saved index of a directory up to date and return its entries (see build_index).
+    """
+    previous = load_index(directory)
+    entries, probed = build_index(directory, previous)
+    _finish_index(directory, entries, previous, probed)
+    return entries
+
+
+def index_tree(directory, entries, include=(), exclude=(), skip_dirs=(), workers=DEFAULT_WALK_WORKERS):
+    """
+    Index a whole directory tree while it is walked, yielding its images as they are found.
+
+    The tree is walked by tree_walker.walk_tree, whose threads also probe the new and
+    changed files. Entries are keyed by path relative to directory, and the index is
+    saved once the walk has completed; a walk that is stopped early saves nothing.
+
+    Args:
+        directory (str): Root of the tree.
+        entries (dict): Filled in with the entry of every file found (see build_index).
+        include (iterable): Glob patterns of the files to index; empty indexes every file.
+        exclude (iterable): Glob patterns of files and directories to leave out.
+        skip_dirs (iterable): Paths relative to directory of subdirectories to leave out.
+        workers (int): Directories scanned at once.
+
+    Yields:
+        str: Relative path of every image, in the order the walk finds them.
+    """
+    previous = load_index(directory)
+    probed = 0
+
+    def visit(relative_path, stat):
+        return _index_entry(os.path.join(directory, relative_path), stat, previous.get(relative_path))
+
+    for relative_path, (entry, was_probed) in walk_tree(directory, include, exclude, skip_dirs, workers, visit):
+        entries[relative_path] = entry
+        probed += was_probed
+        if entry["format"] is not None or "error" in entry:
+            yield relative_path
+    _finish_index(directory, entries, previous, probed)
+
+
+def image_names(entries):
+    """Return the sorted filenames (or relative paths) of the images in an index."""
+    return sorted(name for name, entry in entries.items() if entry["format"] is not None or "error" in entry)
+
+
+def activate(directory, entries):
+    """
+    Make lookup answer from this index of directory, in this process and workers forked afterwards.
+
+    Entries added to it later, while index_tree is still walking, are only seen by this process.
+    """
+    global _active
+    _active = (os.path.abspath(directory), entries)
+
+
+def deactivate():
+    """Stop answering lookups from the active index."""
+    global _active
+    _active = None
+
+
+def lookup(path):
+    """
+    Return the active index's entry for an image path, or None if it has no header facts for it.
+    """
+    if _active is None:
+        return None
+    directory, entries = _active
+    path = os.path.abspath(path)
+    if not path.startswith(directory + os.sep):
+        return None
+    entry = entries.get(path[len(directory) + 1:])
+    if entry is None or entry["format"] is None:
+        return None
+    return entry
@@ -0,0 +1,129 @@
+import io
+import os
+from PIL import Image, ImageDraw
+import api
+import image_processing
+from config import DEFAULT_CONFIG
+from core import process_pipeline
+
+PLATFORMS = ("facebook", "instagram", "twitter", "tiktok", "threads", "bluesky")
+
+
+def make_photo(size, seed=0):
+    """A JPEG-like test image: gradients, edges and noise."""
+    img = Image.merge("RGB", (
+        Image.linear_gradient("L").resize(size),
+        Image.radial_gradient("L").resize(size),
+        Image.effect_noise(size, 20 + seed),
+    ))
+    draw = ImageDraw.Draw(img)
+    for x in range(0, size[0], 97):
+        draw.line((x, 0, x + size[1] // 2, size[1]), fill=(255, 255, 255), width=3)
+    return img
+
+
+def encode(img, format="JPEG", **save_options):
+    buffer = io.BytesIO()
+    img.save(buffer, format=format, **save_options)
+    return buffer.getvalue()
+
+
+def watermark_options(watermark_path):
+    return {
+        **DEFAULT_CONFIG,
+        "watermark_path": watermark_path,
+        "corner_watermark_positions": ["top left", "bottom right"],
+        "corner_watermark_scale": 30,
+        "corner_watermark_transparency": 80,
+        "center_watermark_enabled": True,
+        "center_watermark_scale": 40,
+        "center_watermark_transparency": 40,
+        "center_watermark_rotation": 30,
+        "save_watermarked_images": False,
+        "platforms": {platform: True for platform in PLATFORMS},
+        "workers": 1,
+    }
+
+
+def test_caller_image_is_not_modified():
+    data = encode(make_photo((5000, 3300)), quality=90)
+    img = Image.open(io.BytesIO(data))  # Not decoded yet, so it could be drafted
+    expected = Image.open(io.BytesIO(data))
+    expected.load()
+
+    outputs = api.process_image(img, platforms=["instagram", "tiktok"])
+
+    assert set(outputs) == {"instagram", "tiktok"}
+    assert img.size == (5000, 3300)
+    assert img.tobytes() == expected.tobytes()
+
+
+def test_caller_image_is_not_watermarked(tmp_path):
+    watermark_path = tmp_path / "watermark.png"
+    Image.new("RGBA", (200, 100), (255, 0, 0, 200)).save(watermark_path)
+    img = make_photo((1200, 900))
+    before = img.tobytes()
+
+    api.process_image(img, watermark_options(str(watermark_path)), platforms=["facebook"])
+
+    assert img.tobytes() == before
+
+
+def test_outputs_match_process_pipeline(tmp_path):
+    watermark_path = tmp_path / "watermark.png"
+    watermark = Image.new("RGBA", (300, 150), (0, 0, 0, 0))
+    ImageDraw.Draw(watermark).ellipse((10, 10, 290, 140), fill=(255, 255, 255, 180))
+    watermark.save(watermark_path)
+
+    target_dir = tmp_path / "photos"
+    target_dir.mkdir()
+    sources = {
+        "land.jpg": encode(make_photo((3000, 2000), 1), quality=92),
+        "small.jpg": encode(make_photo((900, 600), 2), quality=92),
+        "graphic.png": encode(make_photo((1600, 1200), 3), format="PNG"),
+    }
+    for filename, data in sources.items():
+        (target_dir / filename).write_bytes(data)
+
+    for label, watermark_path_option in (("watermarked", str(watermark_path)), ("plain", "")):
+        # The fast profile keeps Bluesky's WebP size search short
+        options = {**watermark_options(watermark_path_option), "encoder_profile": "fast"}
+        assert process_pipeline(str(target_dir), dict(options)) == []
+
+        results, errors = api.process_images(list(sources.values()), options, workers=2)
+        assert errors == []
+        for filename, outputs in zip(sources, results):
+            root = os.path.splitext(filename)[0]
+            assert set(outputs) == set(PLATFORMS)
+            for platform, data in outputs.items():
+                (output_path,) = (target_dir / platform).glob(root + ".*")
+                assert data == output_path.read_bytes(), (label, filename, platform)
+
+
+def test_batch_reports_unreadable_sources():
+    good = encode(make_photo((800, 600)))
+    results, errors = api.process_images([good, b"not an image"], platforms=["facebook"])
+
+    assert results[0]["facebook"]
+    assert results[1] is None
+    assert errors == [(1, "UnidentifiedImageError: cannot identify image file '<source>'")]
+
+
+def test_encoded_and_path_sources_are_drafted_but_pil_images_are_not(tmp_path, monkeypatch):
+    data = encode(make_photo((5000, 3300)), quality=90)
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(data)
+    boxes = []
+
+    def draft_for_downscale(img, target_size):
+        boxes.append(image_processing.draft_for_downscale(img, target_size))
+        return boxes[-1]
+
+    monkeypatch.setattr(api, "draft_for_downscale", draft_for_downscale)
+    from_bytes = api.process_image(data, platforms=["tiktok"])
+    from_path = api.process_image(str(path), platforms=["tiktok"])
+    from_file = api.process_image(io.BytesIO(data), platforms=["tiktok"])
+    api.process_image(Image.open(io.BytesIO(data)), platforms=["tiktok"])
+
+    assert [box is not None for box in boxes] == [True, True, True, False]
+    assert from_bytes == from_path == from_file
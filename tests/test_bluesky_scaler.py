@@ -0,0 +1,32 @@
+import io
+import random
+from PIL import Image
+from bluesky_scaler import process_image_for_bluesky
+from image_processing import capture_outputs, encode_image, encode_to_target_size
+
+
+def noise_image(size, seed=0):
+    """Deterministic noise, which compresses poorly at any quality."""
+    return Image.frombytes("RGB", size, random.Random(seed).randbytes(size[0] * size[1] * 3))
+
+
+def test_quality_is_searched_again_after_scaling_down():
+    target_size_kb = 50
+    with capture_outputs() as outputs:
+        process_image_for_bluesky(noise_image((1000, 750)), "out.webp", target_size_kb=target_size_kb)
+
+    data = outputs["out.webp"]
+    with Image.open(io.BytesIO(data)) as output:
+        assert output.width < 1000  # Even the lowest quality was too large at full size
+    # At the minimum quality the smaller image would use a fraction of the budget
+    assert target_size_kb * 1024 * 0.8 < len(data) <= target_size_kb * 1024
+
+
+def test_search_from_a_start_quality_finds_the_highest_quality_that_fits():
+    img = noise_image((300, 200))
+    target_bytes = len(encode_image(img, "WEBP", quality=70)) + 1
+
+    data, quality = encode_to_target_size(img, target_bytes, "WEBP", start_quality=10)
+
+    assert quality >= 70 and len(data) <= target_bytes
+    assert encode_to_target_size(img, target_bytes, "WEBP") == (data, quality)
@@ -0,0 +1,38 @@
+import json
+import os
+import re
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Startup target reported by --timings, in milliseconds
+MAX_STARTUP_MS = 100
+
+
+def run_python(*args, cwd):
+    return subprocess.run([sys.executable, *args], cwd=cwd, capture_output=True, text=True, check=True).stdout
+
+
+def test_startup_imports_neither_pillow_nor_the_worker_pools(tmp_path):
+    output = run_python("-c", (
+        f"import sys; sys.path.insert(0, {REPO_DIR!r}); import cli, core; "
+        "print(' '.join(sorted(name for name in sys.modules if name.split('.')[0] in "
+        "('PIL', 'numpy', 'cv2', 'pyvips', 'multiprocessing', 'concurrent', 'image_processing'))))"
+    ), cwd=tmp_path)
+
+    assert output.split() == []
+
+
+def test_startup_timing_meets_the_target(tmp_path):
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({}))
+    (tmp_path / "photos").mkdir()
+
+    output = run_python(
+        os.path.join(REPO_DIR, "cli.py"), str(tmp_path / "photos"), "--config", str(config_path), "--no-watermark",
+        "--timings", cwd=tmp_path,
+    )
+
+    startup_ms = float(re.search(r"startup total\s+([\d.]+) ms", output).group(1))
+    assert startup_ms < MAX_STARTUP_MS
@@ -0,0 +1,57 @@
+import pytest
+from PIL import Image
+from config import DEFAULT_CONFIG
+from core import process_pipeline
+
+
+def run_incremental(target_dir, capsys, **options):
+    """Run an incremental instagram-only pipeline and return how many sources it found stale."""
+    options = {
+        **DEFAULT_CONFIG,
+        "watermark_path": "",
+        "platforms": {platform: platform == "instagram" for platform in DEFAULT_CONFIG["platforms"]},
+        "incremental": True,
+        "workers": 1,
+        **options,
+    }
+    assert process_pipeline(str(target_dir), options) == []
+    output = capsys.readouterr().out
+    return int(output.split("Incremental run: ")[1].split(" of ")[0])
+
+
+@pytest.mark.parametrize("changed", [
+    {"reducing_gap": 0},
+    {"resize_cascade": False},
+    {"resize_cascade_min_ratio": 4.0},
+    {"memory_budget_megapixels": 2},
+])
+def test_changing_a_render_setting_regenerates_outputs(tmp_path, capsys, changed):
+    Image.linear_gradient("L").resize((1600, 1200)).convert("RGB").save(tmp_path / "photo.jpg")
+
+    assert run_incremental(tmp_path, capsys) == 1
+    assert run_incremental(tmp_path, capsys) == 0
+    assert run_incremental(tmp_path, capsys, **changed) == 1
+
+
+def test_incremental_runs_need_decode_once(tmp_path):
+    options = {**DEFAULT_CONFIG, "watermark_path": "", "incremental": True, "decode_once": False}
+
+    with pytest.raises(ValueError, match="decode-once"):
+        process_pipeline(str(tmp_path), options)
+
+
+def test_resize_cascade_savings_are_reported_once_per_run(tmp_path, capsys):
+    for name in ("a.jpg", "b.jpg"):
+        Image.linear_gradient("L").resize((5000, 3333)).convert("RGB").save(tmp_path / name)
+    options = {
+        **DEFAULT_CONFIG,
+        "watermark_path": "",
+        "platforms": {platform: platform in ("twitter", "tiktok") for platform in DEFAULT_CONFIG["platforms"]},
+        "instrumentation": True,
+        "workers": 2,
+    }
+
+    assert process_pipeline(str(tmp_path), options) == []
+
+    lines = [line for line in capsys.readouterr().out.splitlines() if "Resize cascade saved" in line]
+    assert len(lines) == 1 and not lines[0].endswith("saved 0% of the resample work.")
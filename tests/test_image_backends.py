@@ -0,0 +1,23 @@
+import pytest
+import benchmark
+
+# Module each optional backend needs
+BACKEND_MODULES = {"pyvips": "pyvips", "opencv": "cv2"}
+
+
+@pytest.mark.parametrize("name", sorted(BACKEND_MODULES))
+def test_backend_matches_pillow(name):
+    pytest.importorskip(BACKEND_MODULES[name])
+
+    results = benchmark.check_conformance(name)
+
+    failed = [
+        f"{check}: {measured:.2f} dB (reference {reference:.2f} dB)"
+        for check, measured, reference, passed in results
+        if not passed
+    ]
+    assert not failed, f"{name} differs from Pillow:\n" + "\n".join(failed)
+
+
+def test_pillow_backend_matches_itself():
+    assert all(passed for _, _, _, passed in benchmark.check_conformance("pillow"))
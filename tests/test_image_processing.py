@@ -0,0 +1,83 @@
+import os
+import threading
+import time
+from PIL import Image, ImageChops
+import benchmark
+import image_processing
+import memory_budget
+from image_processing import CANCELLED, iterate_directory
+
+
+def slow_copy(input_path, output_path):
+    time.sleep(0.3)
+    with open(input_path, "rb") as source, open(output_path, "wb") as output:
+        output.write(source.read())
+
+
+def test_cancelled_run_reports_exactly_the_files_not_written(tmp_path):
+    input_dir = tmp_path / "in"
+    output_dir = tmp_path / "out"
+    input_dir.mkdir()
+    for index in range(8):
+        (input_dir / f"{index}.jpg").write_bytes(b"x")
+    cancel_event = threading.Event()
+
+    def progress(completed, total):
+        if completed:
+            cancel_event.set()  # After the first file, while the other worker is mid-file
+
+    errors = iterate_directory(
+        str(input_dir), str(output_dir), slow_copy, workers=2, chunksize=1, progress=progress, cancel_event=cancel_event
+    )
+
+    cancelled = {os.path.basename(path) for path, error in errors if error == CANCELLED}
+    written = set(os.listdir(output_dir))
+    assert len(written) >= 2  # The file running alongside the first one was finished
+    assert cancelled == {f"{index}.jpg" for index in range(8)} - written
+
+
+def test_workers_are_threads_when_worker_processes_are_off(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_processing, "_fork_workers", True)
+    (tmp_path / "in").mkdir()
+    for index in range(4):
+        (tmp_path / "in" / f"{index}.jpg").write_bytes(b"x")
+    pids = []
+
+    def record_pid(input_path, output_path):
+        pids.append(os.getpid())  # Only seen here if the worker shares this process
+
+    image_processing.use_worker_processes(False)
+    errors = iterate_directory(str(tmp_path / "in"), str(tmp_path / "out"), record_pid, workers=2)
+
+    assert errors == []
+    assert pids == [os.getpid()] * 4
+
+
+def test_large_downscales_are_reduced_first():
+    img = Image.new("RGB", (8000, 5333))
+
+    reduced, box = image_processing.reduce_for_resize(img, (640, 427), (0, 0, 8000, 5333), reducing_gap=3.0)
+
+    assert reduced.width == 8000 // 4  # The largest factor keeping 3x the target width
+    assert box == (0, 0, 2000, 5333 / 4)
+
+
+def test_reducing_gap_matches_single_resize():
+    results = benchmark.check_reducing_gap(reducing_gap=3.0, min_psnr=40.0, min_ssim=0.99)
+
+    failed = [f"{check}: {measured:.4f} (threshold {threshold})" for check, measured, threshold, passed in results if not passed]
+    assert not failed, "Reduced resizes differ from single LANCZOS resizes:\n" + "\n".join(failed)
+
+
+def test_banded_resize_under_a_budget_matches_a_single_resize():
+    img = Image.linear_gradient("L").resize((3000, 2000)).convert("RGB")
+    single = image_processing.lanczos_resize(img, (1000, 667))
+
+    memory_budget.configure(pixel_budget=1_000_000)
+    try:
+        assert memory_budget.strip_pixels() == 1_000_000 // memory_budget.STRIP_FRACTION  # Banded
+        banded = image_processing.lanczos_resize(img, (1000, 667))
+    finally:
+        memory_budget.configure()
+
+    assert max(high for _, high in ImageChops.difference(single, banded).getextrema()) <= 1
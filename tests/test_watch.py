@@ -0,0 +1,38 @@
+import threading
+import time
+import watch
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def test_watching_continues_after_a_batch_fails(tmp_path, monkeypatch):
+    batches = []
+
+    def process_pipeline(target_dir, options, filenames=None):
+        batches.append(sorted(filenames))
+        if len(batches) == 1:
+            raise OSError("disk full")
+
+    monkeypatch.setattr(watch, "process_pipeline", process_pipeline)
+    stop_event = threading.Event()
+    thread = threading.Thread(
+        target=watch.watch_directory, args=(str(tmp_path), {}),
+        kwargs={"settle_seconds": 0.2, "poll_interval": 0.1, "stop_event": stop_event},
+    )
+    thread.start()
+    try:
+        time.sleep(0.2)  # Let the watcher start before the first file lands
+        (tmp_path / "first.jpg").write_bytes(b"1")
+        wait_for(lambda: len(batches) == 1)
+        (tmp_path / "second.jpg").write_bytes(b"2")
+        wait_for(lambda: len(batches) == 2)
+    finally:
+        stop_event.set()
+        thread.join(5)
+
+    assert batches == [["first.jpg"], ["second.jpg"]]
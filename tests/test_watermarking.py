@@ -0,0 +1,63 @@
+import random
+import pytest
+from PIL import Image, ImageChops, ImageDraw
+from watermarking import calculate_position, prepare_watermark_layer, watermark_image
+
+CORNERS = {"top left": True, "top right": False, "bottom left": True, "bottom right": True}
+
+
+def make_watermark():
+    """An RGBA watermark whose alpha runs from fully transparent to opaque, with a partly transparent mark."""
+    watermark = Image.merge("RGBA", (
+        Image.new("L", (256, 128), 250),
+        Image.linear_gradient("L").resize((256, 128)),
+        Image.new("L", (256, 128), 30),
+        Image.linear_gradient("L").rotate(90).resize((256, 128)),
+    ))
+    ImageDraw.Draw(watermark).ellipse((40, 20, 200, 110), fill=(0, 0, 0, 140))
+    return watermark
+
+
+def make_source(mode):
+    img = Image.merge("RGB", (
+        Image.linear_gradient("L").resize((1200, 800)),
+        Image.radial_gradient("L").resize((1200, 800)),
+        Image.frombytes("L", (1200, 800), random.Random(0).randbytes(1200 * 800)),
+    ))
+    if mode == "RGBA":
+        # Partly transparent source pixels, whose alpha the output drops
+        img.putalpha(Image.linear_gradient("L").resize((1200, 800)))
+    return img.convert(mode)
+
+
+def watermark_via_rgba(img, watermark):
+    """The previous implementation: paste every layer onto an RGBA copy of the frame, then convert to RGB."""
+    base = img.convert("RGBA").copy()
+    for position, enabled in CORNERS.items():
+        if enabled:
+            layer = prepare_watermark_layer(watermark, base.width, 20, 60)
+            base.paste(layer, calculate_position(position, base.size, layer.size), layer)
+    layer = prepare_watermark_layer(watermark, base.width, 50, 35, rotation=30)
+    base.paste(layer, ((base.width - layer.width) // 2, (base.height - layer.height) // 2), layer)
+    return base.convert("RGB")
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA"])
+@pytest.mark.parametrize("in_place", [False, True])
+def test_rgb_paste_matches_the_rgba_round_trip(mode, in_place):
+    watermark = make_watermark()
+    expected = watermark_via_rgba(make_source(mode), watermark)
+
+    result = watermark_image(make_source(mode), watermark, CORNERS, 20, 60, True, 50, 35, 30, in_place=in_place)
+
+    assert result.mode == "RGB"
+    assert ImageChops.difference(result, expected).getbbox() is None
+
+
+def test_watermark_is_applied():
+    img = make_source("RGB")
+
+    result = watermark_image(img, make_watermark(), CORNERS, 20, 60, True, 50, 35, 30)
+
+    assert ImageChops.difference(result, img).getbbox() is not None
+    assert ImageChops.difference(img, make_source("RGB")).getbbox() is None  # Not in place, so unchanged
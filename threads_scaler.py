@@ -1,38 +1,59 @@
-from image_processing import resize_image, iterate_directory
+from encoder_profiles import DEFAULT_JPEG, extension
+from image_processing import save_within_max_dimension, iterate_directory, open_image
 import os
-from shutil import copy2
-from PIL import Image
 
+MAX_DIMENSION = 2160  # Maximum dimension for Threads images
 
-def process_images_for_threads(input_dir, output_dir):
+
+def process_image_for_threads(img, output_path, source_path=None, encoder=DEFAULT_JPEG):
+    """
+    Scale a single in-memory image for Threads's maximum dimensions (2160x2160).
+
+    Args:
+        img (PIL.Image.Image): Image to scale. Its pixels are not modified.
+        output_path (str): Path to save the scaled image.
+        source_path (str): Path of the file img was decoded from, if its pixels are unchanged.
+        encoder (dict): Encoder settings, as in encoder_profiles.
+    """
+    save_within_max_dimension(img, output_path, MAX_DIMENSION, source_path, encoder)
+
+
+def file_processor_for_threads(encoder=DEFAULT_JPEG):
+    """
+    Return a process function, as for iterate_directory, that scales one image file for Threads.
+
+    The output is named after the encoder's format. A compliant source is passed through.
     """
-    Process images for Threads' maximum dimensions (2160x2160).
+    def process_image(input_path, output_path):
+        # Name the output after the encoder's format
+        output_path = os.path.splitext(output_path)[0] + extension(encoder)
+        with open_image(input_path) as img:
+            process_image_for_threads(img, output_path, source_path=input_path, encoder=encoder)
+
+    return process_image
+
+
+def process_images_for_threads(input_dir, output_dir, encoder=DEFAULT_JPEG, **iterate_options):
+    """
+    Process images for Threads's maximum dimensions (2160x2160).
     
     Args:
         input_dir (str): Path to the input directory containing images.
         output_dir (str): Path to the output directory for scaled images.
+        encoder (dict): Encoder settings, as in encoder_profiles.
+        **iterate_options: Extra keyword arguments for iterate_directory, such as workers.
+
+    Returns:
+        list: (input_path, error message) for every image that could not be processed.
     """
     print(f"Processing images for Threads in '{input_dir}'...")
     print(f"Output will be saved to '{output_dir}'.")
 
-    max_dimension = 2160  # Maximum dimension for Threads images
-
-    def process_image(input_path, output_path):
-        # Check if the image is larger than max dimension
-        with Image.open(input_path) as img:
-            width, height = img.size
-            # Scale down if larger
-            if width > max_dimension or height > max_dimension:
-                resize_image(input_path, output_path, max_dimension)
-            else:
-                # If it's already small enough and it's a .png, convert to JPEG at high quality
-                if input_path.lower().endswith(".png"):
-                    img.convert("RGB").save(output_path, format="JPEG", quality=100)
-                else:
-                    # If it's a jpeg or already small enough, simply copy the image
-                    copy2(input_path, output_path)
-
-    # Ensure outputs are always JPEG and handle scaling/copying
-    iterate_directory(input_dir, output_dir, process_image, preserve_file_type=False)
+    # Outputs are scaled or copied, named by the encoder's format rather than the source's
+    errors = iterate_directory(
+        input_dir, output_dir, file_processor_for_threads(encoder), preserve_file_type=False, **iterate_options
+    )
 
     print("Threads scaling complete.")
+
+    return errors
@@ -1,52 +1,80 @@
-from image_processing import iterate_directory
+from encoder_profiles import PROFILES, extension, save_options
+from image_processing import calculate_fit_size, resample_image, iterate_directory, open_image, save_image
 import os
-from PIL import Image
 
-def resize_image(input_path, output_webp_path, max_width=1080, max_height=1920):
+DEFAULT_ENCODER = PROFILES["default"]["tiktok"]
+
+
+def process_image_for_tiktok(img, output_webp_path, max_width=1080, max_height=1920, encoder=DEFAULT_ENCODER):
+    """
+    Scale a single in-memory image to the TikTok recommended dimensions (1080x1920)
+    while maintaining the aspect ratio. Saves as WebP unless the encoder says otherwise.
+
+    Args:
+        img (PIL.Image.Image): Image to scale. Its pixels are not modified.
+        output_webp_path (str): Path to save the resized image.
+        max_width (int): Maximum width for the image.
+        max_height (int): Maximum height for the image.
+        encoder (dict): Encoder settings, as in encoder_profiles.
+    """
+    new_size = calculate_fit_size(img.width, img.height, max_width, max_height)
+
+    # Resize the image
+    img = resample_image(img, new_size)
+
+    # Convert to RGB if necessary (WebP requires proper color mode, JPEG has no alpha)
+    if img.mode not in (("RGB",) if encoder["format"] == "JPEG" else ("RGB", "RGBA")):
+        img = img.convert("RGB")
+
+    save_image(img, output_webp_path, **save_options(encoder))
+
+def resize_image(input_path, output_webp_path, max_width=1080, max_height=1920, encoder=DEFAULT_ENCODER):
     """
     Resize an image to fit within the TikTok recommended dimensions (1080x1920) 
     while maintaining the aspect ratio. Saves as WebP.
 
     Args:
         input_path (str): Path to the input image.
-        output_webp_path (str): Path to save the resized WebP image.
+        output_webp_path (str): Path to save the resized image.
         max_width (int): Maximum width for the image.
         max_height (int): Maximum height for the image.
+        encoder (dict): Encoder settings, as in encoder_profiles.
     """
-    with Image.open(input_path) as img:
-        width, height = img.size
-        scale_factor = min(max_width / width, max_height / height)
+    with open_image(input_path) as img:
+        process_image_for_tiktok(img, output_webp_path, max_width=max_width, max_height=max_height, encoder=encoder)
 
-        new_width = int(width * scale_factor)
-        new_height = int(height * scale_factor)
-
-        # Resize the image
-        img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+def file_processor_for_tiktok(encoder=DEFAULT_ENCODER):
+    """
+    Return a process function, as for iterate_directory, that scales one image file for TikTok.
 
-        # Convert to RGB if necessary (WebP requires proper color mode)
-        if img.mode not in ("RGB", "RGBA"):
-            img = img.convert("RGB")
+    The output is named after the encoder's format (.webp by default).
+    """
+    def process_image(input_path, output_path):
+        # Ensure output file has the encoder's extension (.webp by default)
+        output_webp_path = os.path.splitext(output_path)[0] + extension(encoder)
+        resize_image(input_path, output_webp_path, max_width=1080, max_height=1920, encoder=encoder)
 
-        # Save as WebP with high quality
-        img.save(output_webp_path, format="WEBP", quality=100)
+    return process_image
 
-def process_images_for_tiktok(input_dir, output_dir):
+def process_images_for_tiktok(input_dir, output_dir, encoder=DEFAULT_ENCODER, **iterate_options):
     """
     Process images for TikTok with proper scaling (max 1080x1920), ensuring WebP format.
 
     Args:
         input_dir (str): Path to the input directory containing images.
         output_dir (str): Path to the output directory for processed images.
+        encoder (dict): Encoder settings, as in encoder_profiles.
+        **iterate_options: Extra keyword arguments for iterate_directory, such as workers.
+
+    Returns:
+        list: (input_path, error message) for every image that could not be processed.
     """
     print(f"Processing images for TikTok in '{input_dir}'...")
     print(f"Output will be saved to '{output_dir}'.")
 
-    def process_image(input_path, output_path):
-        # Ensure output file has .webp extension
-        output_webp_path = os.path.splitext(output_path)[0] + ".webp"
-        resize_image(input_path, output_webp_path, max_width=1080, max_height=1920)
+    # Force the encoder's format and override preserve_file_type behavior
+    errors = iterate_directory(input_dir, output_dir, file_processor_for_tiktok(encoder), preserve_file_type=False, **iterate_options)
 
-    # Force WebP output and override preserve_file_type behavior
-    iterate_directory(input_dir, output_dir, process_image, preserve_file_type=False)
+    print("TikTok scaling complete.")
 
-    print("TikTok scaling complete.")
\ No newline at end of file
+    return errors
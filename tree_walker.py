@@ -0,0 +1,128 @@
+"""
+Walk a directory tree with parallel os.scandir workers, yielding files as they are found.
+
+On network storage, listing a directory costs a round trip or more per directory, so a
+tree of hundreds of thousands of files takes minutes to list one directory at a time. Here
+every subdirectory is scanned by a pool of threads as soon as it is discovered, and the
+files of each directory are handed to the caller straight away, so processing can start
+long before the whole tree has been listed.
+
+Hidden files and directories are skipped, and so are directories matching an exclude
+pattern, without being scanned. Symbolic links to directories are not followed.
+"""
+import fnmatch
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Directories scanned at once. Most of their time is spent waiting on the filesystem, so
+# this can be well above the number of CPU cores.
+DEFAULT_WALK_WORKERS = 8
+
+# Files of a directory handed over at a time, so huge flat directories stream too
+BATCH_SIZE = 256
+
+
+def matches(relative_path, patterns):
+    """
+    Return whether a path relative to the walked root matches any of the glob patterns.
+
+    Patterns containing "/" are matched against the whole relative path (e.g.
+    "2024/*/raw/*"), others against the last component only (e.g. "*.jpg"). Matching is
+    case-sensitive, and "*" also matches across "/".
+    """
+    if not patterns:
+        return False
+    posix_path = relative_path.replace(os.sep, "/")
+    name = posix_path.rsplit("/", 1)[-1]
+    return any(fnmatch.fnmatchcase(posix_path if "/" in pattern else name, pattern) for pattern in patterns)
+
+
+def is_selected(relative_path, include=(), exclude=()):
+    """Return whether a file passes the include patterns (all files when empty) and none of the exclude patterns."""
+    return (not include or matches(relative_path, include)) and not matches(relative_path, exclude)
+
+
+def walk_tree(root, include=(), exclude=(), skip_dirs=(), workers=DEFAULT_WALK_WORKERS, visit=None):
+    """
+    Yield the files in a directory tree as the parallel walk finds them.
+
+    Files come in no particular order: each directory's files are yielded in batches as it
+    is scanned, while its subdirectories are being scanned alongside. Directories that can't be
+    read below the root are reported and left out. Closing the generator stops the walk.
+
+    Args:
+        root (str): Directory to walk.
+        include (iterable): Glob patterns a file must match to be yielded (see matches).
+            Empty yields every file.
+        exclude (iterable): Glob patterns of files and directories to leave out.
+        skip_dirs (iterable): Paths relative to root of directories to leave out, e.g. outputs.
+        workers (int): Directories scanned at once.
+        visit (function): Called as visit(relative_path, stat) on the walker threads for
+            every selected file, e.g. to read its header in parallel too.
+
+    Yields:
+        tuple: (path relative to root, os.stat_result of the file, or visit's result).
+
+    Raises:
+        OSError: If root itself can't be read.
+    """
+    include = tuple(include)
+    exclude = tuple(exclude)
+    filtering = bool(include or exclude)
+    skip_dirs = {os.path.normpath(path) for path in skip_dirs}
+    found = queue.SimpleQueue()
+    stop = threading.Event()
+    lock = threading.Lock()
+    scanning = 1  # Directories submitted and not finished yet; counted before submitting, so never 0 too early
+
+    def submit(relative_dir):
+        nonlocal scanning
+        with lock:
+            scanning += 1
+        executor.submit(scan, relative_dir)
+
+    def scan(relative_dir):
+        files = []  # Found since the last batch was handed over
+        prefix = relative_dir + os.sep if relative_dir else ""
+        try:
+            with os.scandir(os.path.join(root, relative_dir)) as entries:
+                for entry in entries:
+                    if stop.is_set():
+                        break
+                    if entry.name.startswith("."):
+                        continue
+                    relative_path = prefix + entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        if relative_path not in skip_dirs and not matches(relative_path, exclude):
+                            submit(relative_path)
+                    elif entry.is_file() and (not filtering or is_selected(relative_path, include, exclude)):
+                        stat = entry.stat()
+                        files.append((relative_path, visit(relative_path, stat) if visit else stat))
+                        if len(files) == BATCH_SIZE:
+                            found.put((relative_dir, files, False, None))
+                            files = []
+        except Exception as e:  # Handed to the caller, so the walk never waits on a dead scan
+            found.put((relative_dir, files, True, e))
+            return
+        found.put((relative_dir, files, True, None))
+
+    executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="tree-walker")
+    try:
+        executor.submit(scan, "")
+        while True:
+            relative_dir, files, finished, error = found.get()
+            if error is not None:
+                if not relative_dir or not isinstance(error, OSError):
+                    raise error
+                print(f"Could not read '{os.path.join(root, relative_dir)}': {error}")
+            yield from files
+            if finished:
+                with lock:
+                    scanning -= 1
+                    if not scanning:
+                        break
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
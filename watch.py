@@ -0,0 +1,181 @@
+"""
+Watch a directory and run the pipeline on images as they land in it.
+
+New and changed files are picked up through inotify on Linux and by polling the directory
+with os.scandir elsewhere. A file is only processed once its size and modification time
+have stopped changing for a settle period, so exports that are still being copied are
+never read half-written. Only files directly in the watched directory are inputs; the
+pipeline's output directories (watermarks/, facebook/, ...) and hidden files are ignored.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from core import process_pipeline
+
+# inotify event masks, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+def _is_input_name(name):
+    """Return whether a directory entry name could be a source image (not hidden or temporary)."""
+    return not name.startswith(".")
+
+
+class InotifyWatcher:
+    """Report names of files created, written or moved into a directory, using Linux inotify."""
+
+    name = "inotify"
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY | IN_ATTRIB
+        if libc.inotify_add_watch(self._fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f"inotify_add_watch failed for '{directory}'")
+
+    def wait(self, timeout):
+        """
+        Wait up to timeout seconds for changes.
+
+        Returns:
+            set: Names of the files that changed.
+        """
+        changed = set()
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        while readable:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                if name and not mask & IN_ISDIR and _is_input_name(name):
+                    changed.add(name)
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Report names of files that appeared or changed in a directory, by comparing scandir snapshots."""
+
+    name = "polling"
+
+    def __init__(self, directory, interval=1.0):
+        self.directory = directory
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if _is_input_name(entry.name) and entry.is_file():
+                    stat = entry.stat()
+                    snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds (one poll interval at most) and return the names of changed files."""
+        time.sleep(min(timeout, self.interval))
+        snapshot = self._scan()
+        changed = {name for name, signature in snapshot.items() if self._snapshot.get(name) != signature}
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+def create_watcher(directory, poll_interval=1.0):
+    """Return an inotify watcher for directory where the platform supports it, and a polling watcher otherwise."""
+    try:
+        return InotifyWatcher(directory)
+    except (OSError, AttributeError, TypeError):
+        return PollingWatcher(directory, poll_interval)
+
+
+def _run_pipeline(target_dir, options, filenames=None):
+    """Run the pipeline over target_dir (or just filenames in it), reporting any error instead of raising it."""
+    try:
+        process_pipeline(target_dir, options, filenames=filenames)
+    except Exception as e:
+        # Keep watching: the files are processed again when they next change
+        print(f"Error processing '{target_dir}': {type(e).__name__}: {e}")
+
+
+def watch_directory(target_dir, options, settle_seconds=2.0, poll_interval=1.0, process_existing=False, stop_event=None):
+    """
+    Process every image that is added to or changed in target_dir, until stopped.
+
+    Args:
+        target_dir (str): Directory to watch.
+        options (dict): Pipeline configuration, as for process_pipeline.
+        settle_seconds (float): How long a file's size and modification time must stay the
+            same before it is processed.
+        poll_interval (float): Seconds between scans when inotify is unavailable.
+        process_existing (bool): Run the pipeline over the files already in target_dir first.
+        stop_event (threading.Event): Set it to stop watching. Ctrl+C also stops.
+
+    An error while processing a batch is reported and the batch dropped; its files are
+    picked up again the next time they change.
+    """
+    watcher = create_watcher(target_dir, poll_interval)
+    print(f"Watching '{target_dir}' for new images (using {watcher.name}). Press Ctrl+C to stop.")
+
+    # Files seen changing: name -> ((size, mtime_ns), time that signature was first seen), or None until stat'ed
+    settling = {}
+    try:
+        if process_existing:
+            _run_pipeline(target_dir, options)
+
+        while stop_event is None or not stop_event.is_set():
+            timeout = min(settle_seconds / 2, 1.0) if settling else 1.0
+            for name in watcher.wait(timeout):
+                settling[name] = None
+
+            now = time.monotonic()
+            ready = []
+            for name, state in list(settling.items()):
+                try:
+                    stat = os.stat(os.path.join(target_dir, name))
+                except FileNotFoundError:
+                    del settling[name]  # Deleted or renamed before it settled
+                    continue
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if state is None or state[0] != signature:
+                    settling[name] = (signature, now)
+                elif now - state[1] >= settle_seconds:
+                    del settling[name]
+                    ready.append(name)
+
+            if ready:
+                print(f"Processing {len(ready)} new or changed image(s): {', '.join(sorted(ready))}")
+                _run_pipeline(target_dir, options, filenames=ready)
+                print(f"Watching '{target_dir}' for new images...")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    print("Stopped watching.")
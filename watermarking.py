@@ -1,57 +1,214 @@
+import hashlib
 import os
+import threading
+from collections import OrderedDict
+from image_processing import iterate_directory, open_image, save_image
+import instrumentation
 from PIL import Image, ImageEnhance
 
-def apply_watermark_to_directory(input_dir, output_dir, watermark_path, corner_positions, corner_scale, corner_transparency, center_enabled, center_scale, center_transparency, center_rotation):
-    """Apply watermark to all images in the directory."""
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
 
-    # Load the original watermark
-    original_watermark = Image.open(watermark_path).convert("RGBA")
-
-    for filename in os.listdir(input_dir):
-        input_path = os.path.join(input_dir, filename)
-        output_path = os.path.join(output_dir, filename)
+class WatermarkCache:
+    """
+    Bounded LRU cache of prepared (resized, faded and rotated) watermark layers.
+
+    Layers are keyed by (base width, scale, transparency, rotation, watermark file hash, fit),
+    so consecutive images of the same width reuse the layer prepared for the first one.
+    Cached layers are shared and must not be modified.
+    """
+
+    def __init__(self, maxsize=16, max_bytes=128 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._layers = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, prepare):
+        """Return the layer cached under key, calling prepare() to create it on a miss."""
+        with self._lock:
+            layer = self._layers.get(key)
+            if layer is not None:
+                self._layers.move_to_end(key)
+                self.hits += 1
+                return layer
+            self.misses += 1
+
+        layer = prepare()
+        layer_bytes = layer.width * layer.height * len(layer.getbands())
+
+        with self._lock:
+            if key not in self._layers:
+                self._layers[key] = layer
+                self._bytes += layer_bytes
+            # Evict least recently used layers, but always keep the newest one
+            while len(self._layers) > 1 and (len(self._layers) > self.maxsize or self._bytes > self.max_bytes):
+                _, evicted = self._layers.popitem(last=False)
+                self._bytes -= evicted.width * evicted.height * len(evicted.getbands())
+        return layer
+
+    def clear(self):
+        """Drop all cached layers and reset the hit/miss counters."""
+        with self._lock:
+            self._layers.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return the hit/miss counters and current size of the cache."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "layers": len(self._layers), "bytes": self._bytes}
+
+
+# Shared by the corner and center watermarks and by image_processing.apply_watermark
+watermark_cache = WatermarkCache()
+
+# Loaded watermarks keyed by (path, size, mtime), so a changed file is reloaded
+_loaded_watermarks = {}
+
+
+def load_watermark(watermark_path):
+    """
+    Load a watermark image in RGBA mode.
+
+    The file hash is stored in the image's info["file_hash"] for use in cache keys.
+    Repeated loads of an unchanged file return the same image, which must not be modified.
+    """
+    stat = os.stat(watermark_path)
+    key = (os.path.abspath(watermark_path), stat.st_size, stat.st_mtime_ns)
+    watermark = _loaded_watermarks.get(key)
+    if watermark is None:
+        with open(watermark_path, "rb") as file:
+            file_hash = hashlib.sha256(file.read()).hexdigest()
+        with Image.open(watermark_path) as original:
+            watermark = original.convert("RGBA")
+        watermark.info["file_hash"] = file_hash
+        _loaded_watermarks[key] = watermark
+    return watermark
 
-        # Skip directories
-        if not os.path.isfile(input_path):
-            continue
 
-        with Image.open(input_path) as img:
-            img = img.convert("RGBA")  # Ensure base image supports RGBA
+def _watermark_hash(watermark):
+    """Return the file hash of a loaded watermark, hashing its pixels if it was not loaded from a file."""
+    if "file_hash" not in watermark.info:
+        digest = hashlib.sha256(f"{watermark.mode}{watermark.size}".encode())
+        digest.update(watermark.tobytes())
+        watermark.info["file_hash"] = digest.hexdigest()
+    return watermark.info["file_hash"]
+
+
+def prepare_watermark_layer(original_watermark, base_width, scale, transparency, rotation=0, fit="width"):
+    """
+    Return a resized, faded and rotated watermark layer for an image of the given width.
+
+    Args:
+        original_watermark (PIL.Image.Image): Watermark in RGBA mode, as returned by load_watermark.
+        base_width (int): Width of the image the watermark is applied to.
+        scale (int): Percentage of the image width the watermark should occupy.
+        transparency (int): Transparency of the watermark (0 to 100).
+        rotation (int): Counter-clockwise rotation in degrees, expanding the layer to fit.
+        fit (str): "width" to resize the watermark to exactly the scaled width, or
+            "thumbnail" to shrink it to fit within a square of that width.
+
+    Returns:
+        PIL.Image.Image: The prepared RGBA layer. It is cached and must not be modified.
+    """
+    key = (base_width, scale, transparency, rotation, _watermark_hash(original_watermark), fit)
+
+    def prepare():
+        target_width = base_width * scale / 100
+        if fit == "thumbnail":
+            watermark = original_watermark.copy()
+            watermark.thumbnail((int(target_width), int(target_width)), Image.Resampling.LANCZOS)
+        else:
+            watermark = resize_watermark(original_watermark, target_width)
+        watermark = adjust_transparency(watermark, transparency)
+        if rotation:
+            # Apply rotation to the watermark using Bicubic resampling
+            watermark = watermark.rotate(rotation, resample=Image.Resampling.BICUBIC, expand=True)
+        return watermark
+
+    return watermark_cache.get(key, prepare)
+
+
+def watermark_image(img, original_watermark, corner_positions, corner_scale, corner_transparency, center_enabled, center_scale, center_transparency, center_rotation, in_place=False):
+    """
+    Apply corner and center watermarks to an in-memory image and return the result in RGB mode.
+
+    Watermarks are alpha-blended straight onto an RGB buffer. Pillow's masked paste only
+    touches each watermark's bounding box and blends exactly like pasting onto an RGBA
+    copy of the whole frame, so no full-frame RGBA conversion or copy is needed. With
+    in_place, an RGB image is watermarked directly instead of being copied first.
+    """
+    with instrumentation.stage("decode"):
+        img.load()
+
+    with instrumentation.stage("composite"):
+        if img.mode != "RGB":
+            base = img.convert("RGB")
+        elif in_place:
+            base = img
+        else:
             base = img.copy()
 
-            # Resize watermark for corners while preserving aspect ratio
-            watermark = original_watermark.copy()
-            watermark = resize_watermark(watermark, base.width * corner_scale / 100)  # Scale by corner_scale, but preserve aspect ratio
-
-            # Adjust transparency for watermark (after resizing)
-            watermark = adjust_transparency(watermark, corner_transparency)
-
-            # Apply corner watermarks
-            for position, enabled in corner_positions.items():
-                if not enabled:
-                    continue
-                x, y = calculate_position(position, base.size, watermark.size)
-                base.paste(watermark, (x, y), watermark)
-
-            # Apply center watermark if enabled
-            if center_enabled:
-                center_watermark = original_watermark.copy()
-                center_watermark = resize_watermark(center_watermark, base.width * center_scale / 100)  # Scale by center_scale
-                center_watermark = adjust_transparency(center_watermark, center_transparency)
-                
-                # Apply rotation to the center watermark using Bicubic resampling
-                center_watermark = center_watermark.rotate(center_rotation, resample=Image.Resampling.BICUBIC, expand=True)
-                
-                # Calculate position and paste the watermark
-                center_x = (base.width - center_watermark.width) // 2
-                center_y = (base.height - center_watermark.height) // 2
-                base.paste(center_watermark, (center_x, center_y), center_watermark)
+        # Apply corner watermarks
+        for position, enabled in corner_positions.items():
+            if not enabled:
+                continue
+            # Resize watermark for corners while preserving aspect ratio, then adjust its transparency
+            watermark = prepare_watermark_layer(original_watermark, base.width, corner_scale, corner_transparency)
+            x, y = calculate_position(position, base.size, watermark.size)
+            base.paste(watermark, (x, y), watermark)
+
+        # Apply center watermark if enabled
+        if center_enabled:
+            center_watermark = prepare_watermark_layer(
+                original_watermark, base.width, center_scale, center_transparency, rotation=center_rotation
+            )
+
+            # Calculate position and paste the watermark
+            center_x = (base.width - center_watermark.width) // 2
+            center_y = (base.height - center_watermark.height) // 2
+            base.paste(center_watermark, (center_x, center_y), center_watermark)
+
+    return base
+
+
+def watermark_file_processor(watermark_path, corner_positions, corner_scale, corner_transparency, center_enabled, center_scale, center_transparency, center_rotation):
+    """
+    Return a process function, as for iterate_directory, that watermarks one image file.
+
+    The watermark is loaded once, here. Outputs are saved as JPEG at quality 100.
+    """
+    # Load the original watermark
+    original_watermark = load_watermark(watermark_path)
+
+    def process_image(input_path, output_path):
+        with open_image(input_path) as img:
+            base = watermark_image(
+                img, original_watermark, corner_positions, corner_scale, corner_transparency,
+                center_enabled, center_scale, center_transparency, center_rotation, in_place=True,
+            )
 
             # Save the final image
-            base = base.convert("RGB")
-            base.save(output_path, "JPEG", quality=100)
+            save_image(base, output_path, "JPEG", quality=100)
+
+    return process_image
+
+
+def apply_watermark_to_directory(input_dir, output_dir, watermark_path, corner_positions, corner_scale, corner_transparency, center_enabled, center_scale, center_transparency, center_rotation, **iterate_options):
+    """
+    Apply watermark to all images in the directory.
+
+    Extra keyword arguments are passed to iterate_directory (e.g. workers). Returns the
+    (input_path, error message) pairs of images that could not be watermarked.
+    """
+    process_image = watermark_file_processor(
+        watermark_path, corner_positions, corner_scale, corner_transparency,
+        center_enabled, center_scale, center_transparency, center_rotation,
+    )
+    return iterate_directory(input_dir, output_dir, process_image, **iterate_options)
 
 
 def adjust_transparency(watermark, transparency):